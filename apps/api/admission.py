@@ -0,0 +1,240 @@
+"""
+Admission control for cvOS
+Per-route concurrency limits with a bounded wait queue and a queue-timeout
+deadline. A route at capacity queues requests briefly; past the queue limit
+or the deadline they are shed at once with Retry-After, so a burst on an
+expensive route (PDF rendering) can't starve the cheap ones (/analyze) or
+pile up latency until the whole process collapses.
+
+Limits are tier-aware: a request may only take its tier's share of the
+route's slots (business all of them, free half by default), so paying users
+keep headroom during a free-tier burst, and queued requests are admitted
+business first. The tier is the gateway-verified one (trusted_tier); a
+request without a known tier is treated as free.
+"""
+import asyncio
+import hmac
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Mapping, Optional
+
+from starlette.datastructures import Headers
+
+import metrics
+
+# Highest priority first, as in pdf_jobs
+TIERS = ("business", "pro", "free")
+
+ADMISSION_ENABLED = os.getenv("CVOS_ADMISSION", "1") == "1"
+# Share of a route's concurrency each tier may occupy
+TIER_SHARES = {
+    tier: float(os.getenv(f"CVOS_ADMIT_SHARE_{tier.upper()}", default))
+    for tier, default in (("business", "1.0"), ("pro", "0.75"), ("free", "0.5"))
+}
+# Shared with the gateway, which authenticates the user, sets X-User-Tier and
+# sends this as X-Gateway-Token; clients can't forge either. Without it every
+# request counts as the lowest tier
+GATEWAY_TOKEN = os.getenv("CVOS_GATEWAY_TOKEN", "")
+DEFAULT_TIER = TIERS[-1]
+
+
+def trusted_tier(headers: Mapping[str, str]) -> str:
+    """The caller's plan: X-User-Tier when the gateway vouches for it, else DEFAULT_TIER."""
+    token = headers.get("x-gateway-token", "")
+    if not GATEWAY_TOKEN or not hmac.compare_digest(token, GATEWAY_TOKEN):
+        return DEFAULT_TIER
+    tier = headers.get("x-user-tier", "").lower()
+    return tier if tier in TIERS else DEFAULT_TIER
+
+
+def _route_limit(name: str, concurrency: int, queue: int, timeout: float) -> dict:
+    """Defaults, overridable with CVOS_ADMIT_<NAME>_CONCURRENCY / _QUEUE / _TIMEOUT."""
+    return {
+        "concurrency": int(os.getenv(f"CVOS_ADMIT_{name}_CONCURRENCY", concurrency)),
+        "max_queue": int(os.getenv(f"CVOS_ADMIT_{name}_QUEUE", queue)),
+        "queue_timeout": float(os.getenv(f"CVOS_ADMIT_{name}_TIMEOUT", timeout)),
+    }
+
+
+ROUTE_LIMITS = {
+    "/generate-pdf": _route_limit("GENERATE_PDF", 8, 16, 10),
+    "/preview": _route_limit("PREVIEW", 8, 32, 5),
+    "/analyze": _route_limit("ANALYZE", 16, 64, 5),
+    "/analyze-with-ai": _route_limit("ANALYZE_AI", 16, 32, 15),
+    "/analyze-batch": _route_limit("ANALYZE_BATCH", 2, 4, 30),
+    "/generate-bulk": _route_limit("GENERATE_BULK", 2, 4, 30),
+    "/match": _route_limit("MATCH", 8, 32, 5),
+}
+
+
+class Overloaded(RuntimeError):
+    """
+    Request shed by admission control. status is 429 when only the caller's
+    tier share is used up, 503 when the route itself is saturated.
+    """
+
+    def __init__(self, route: str, reason: str, status: int, retry_after: int):
+        super().__init__(f"Servicio saturado ({route}), reintenta en {retry_after}s")
+        self.route = route
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Gate:
+    """Concurrency limit, priority wait queue and deadline for one route."""
+
+    def __init__(self, route: str, concurrency: int, max_queue: int, queue_timeout: float):
+        self.route = route
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {tier: deque() for tier in TIERS}
+        self.admitted = 0
+        self.shed = 0
+        # Moving average of seconds a request holds a slot, for Retry-After
+        self._avg_seconds = 1.0
+
+    def limit(self, tier: Optional[str]) -> int:
+        """Slots a tier may occupy; requests without a known tier get the lowest tier's share."""
+        share = TIER_SHARES[tier if tier in TIERS else DEFAULT_TIER]
+        return min(self.concurrency, max(1, math.ceil(self.concurrency * share)))
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + 1) * self._avg_seconds / max(self.concurrency, 1)))
+
+    def _reject(self, tier: Optional[str], reason: str) -> Overloaded:
+        self.shed += 1
+        metrics.ADMISSION_SHED.inc(route=self.route, reason=reason)
+        status = 429 if self.running < self.concurrency and self.running >= self.limit(tier) else 503
+        return Overloaded(self.route, reason, status, self.retry_after())
+
+    async def acquire(self, tier: Optional[str] = None):
+        """
+        Take a slot, waiting up to queue_timeout in the queue.
+
+        Raises:
+            Overloaded: the queue is full or the deadline passed
+        """
+        tier = tier if tier in TIERS else DEFAULT_TIER
+        # release() hands freed slots straight to the queue, so a free slot here means nobody eligible waits
+        if self.running < self.limit(tier):
+            self.running += 1
+            self.admitted += 1
+            return
+        if self.waiting >= self.max_queue:
+            raise self._reject(tier, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._waiters[tier]
+        queue.append(waiter)
+        self.waiting += 1
+        try:
+            with metrics.timed("admission_wait"):
+                await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._reject(tier, "queue_timeout")
+        except asyncio.CancelledError:
+            # Client gone: give back the slot if it was granted meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self.release(0.0)
+            raise
+        finally:
+            self.waiting -= 1
+            if waiter.cancelled():
+                queue.remove(waiter)
+        self.admitted += 1
+
+    def release(self, held_seconds: Optional[float] = None):
+        self.running -= 1
+        if held_seconds is not None:
+            self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * held_seconds
+        self._wake()
+
+    def _wake(self):
+        """Hand free slots to queued requests, highest tier first."""
+        for tier in TIERS:
+            queue = self._waiters[tier]
+            while queue and self.running < self.limit(tier):
+                waiter = queue.popleft()
+                self.running += 1
+                waiter.set_result(None)
+
+    def occupancy(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+class AdmissionController:
+    """One Gate per limited route; unlisted routes are never limited."""
+
+    def __init__(self, limits: Optional[Dict[str, dict]] = None, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        limits = ROUTE_LIMITS if limits is None else limits
+        self.gates = {route: Gate(route, **limit) for route, limit in limits.items()}
+
+    def gate(self, route: str) -> Optional[Gate]:
+        return self.gates.get(route) if self.enabled else None
+
+    @asynccontextmanager
+    async def admit(self, route: str, tier: Optional[str] = None) -> AsyncIterator[None]:
+        """Hold a slot of the route for the duration of the block."""
+        gate = self.gate(route)
+        if gate is None:
+            yield
+            return
+        await gate.acquire(tier)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            gate.release(time.perf_counter() - start)
+
+    def occupancy(self) -> dict:
+        return {"enabled": self.enabled, "routes": {route: g.occupancy() for route, g in self.gates.items()}}
+
+
+def shed_response(exc: Overloaded):
+    from fastapi.responses import JSONResponse
+    return JSONResponse({"detail": str(exc)}, status_code=exc.status,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that holds a route's slot until the response (streamed
+    bodies included) is fully sent. Routes in `skip` admit inside the endpoint
+    instead, where the tier can come from the request body.
+    """
+
+    def __init__(self, app, controller: AdmissionController, skip=()):
+        self.app = app
+        self.controller = controller
+        self.skip = frozenset(skip)
+
+    async def __call__(self, scope, receive, send):
+        gate = None
+        if scope["type"] == "http" and scope["method"] != "OPTIONS" and scope["path"] not in self.skip:
+            gate = self.controller.gate(scope["path"])
+        if gate is None:
+            return await self.app(scope, receive, send)
+        tier = trusted_tier(Headers(scope=scope))
+        try:
+            await gate.acquire(tier)
+        except Overloaded as e:
+            return await shed_response(e)(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(time.perf_counter() - start)
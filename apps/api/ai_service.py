@@ -1,23 +1,138 @@
-import google.generativeai as genai
+import asyncio
+import hashlib
+import inspect
+import logging
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
+from metrics import AI_REQUESTS, AI_SLOTS, timed
 
 load_dotenv()
 
-class AIService:
-    def __init__(self):
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            print("WARNING: GOOGLE_API_KEY not found. AI features will fail.")
-            self.model = None
+logger = logging.getLogger("ai_service")
+
+# Limits for calls to the model, overridable per deployment
+AI_TIMEOUT = float(os.getenv("CVOS_AI_TIMEOUT", "20"))
+AI_MAX_CONCURRENCY = int(os.getenv("CVOS_AI_MAX_CONCURRENCY", "4"))
+AI_MAX_QUEUE = int(os.getenv("CVOS_AI_MAX_QUEUE", "16"))
+AI_QUEUE_TIMEOUT = float(os.getenv("CVOS_AI_QUEUE_TIMEOUT", "5"))
+AI_RETRIES = int(os.getenv("CVOS_AI_RETRIES", "2"))
+AI_BACKOFF = float(os.getenv("CVOS_AI_BACKOFF", "0.5"))
+AI_BACKEND = os.getenv("CVOS_AI_BACKEND", "gemini")
+# Alternative Gemini endpoint, e.g. the load-test stand-in (benchmarks/stub_gemini.py)
+GEMINI_ENDPOINT = os.getenv("CVOS_GEMINI_ENDPOINT") or None
+
+# google.api_core errors worth retrying, matched by name so other backends can raise them too
+TRANSIENT_ERRORS = {"ServiceUnavailable", "ResourceExhausted", "DeadlineExceeded",
+                    "InternalServerError", "TooManyRequests", "Aborted"}
+
+
+class AIBusy(RuntimeError):
+    """Every slot and the wait queue are taken; the caller should degrade."""
+
+
+class AITimeout(RuntimeError):
+    """The model didn't answer in time, even after retries."""
+
+
+class GeminiBackend:
+    """
+    Calls Gemini through google-generativeai. generate() is blocking; the
+    request itself gives up after `timeout` seconds, so a call AIService
+    stopped waiting for doesn't keep a thread busy for long.
+    """
+
+    def __init__(self, api_key: str, model_name: str, timeout: float = AI_TIMEOUT):
+        # Imported here: the SDK is slow to import and only this backend needs it
+        import google.generativeai as genai
+        if GEMINI_ENDPOINT:
+            # REST, since a plain HTTP stand-in can't speak gRPC
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": GEMINI_ENDPOINT})
         else:
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
+        self.model = genai.GenerativeModel(model_name)
+        self.timeout = timeout
+        self._request_options = "request_options" in inspect.signature(self.model.generate_content).parameters
 
-    def analyze_cv(self, text: str):
-        if not self.model:
-            return {"error": "AI Service not configured (missing API Key)"}
+    def generate(self, prompt: str) -> str:
+        if self._request_options:
+            return self.model.generate_content(prompt, request_options={"timeout": self.timeout}).text
+        # google-generativeai 0.3.x has no request_options: pass the timeout to its API client directly
+        from google.generativeai import client
+        from google.generativeai.types import generation_types
+        if self.model._client is None:
+            self.model._client = client.get_default_generative_client()
+        response = self.model._client.generate_content(self.model._prepare_request(contents=prompt),
+                                                       timeout=self.timeout)
+        return generation_types.GenerateContentResponse.from_response(response).text
+
+
+class StubBackend:
+    """Local stand-in for load tests: fixed latency, random failures, canned JSON."""
+
+    def __init__(self, latency: float = 0.5, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def generate(self, prompt: str) -> str:
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise ConnectionError("stub backend: simulated transient failure")
+        return ('```json\n{"score": 75, "summary": "Respuesta simulada.", "strengths": [], '
+                '"weaknesses": [], "keywords_detected": []}\n```')
+
+
+def _is_transient(error: Exception) -> bool:
+    # Not our own timeout: the abandoned call still holds an executor thread, so a retry would queue behind it
+    return isinstance(error, ConnectionError) or type(error).__name__ in TRANSIENT_ERRORS
+
+
+class AIService:
+    # Bump when the prompt changes (invalidates cached AI analyses)
+    PROMPT_VERSION = "1"
+    MODEL_NAME = "gemini-pro"
+    # CV text beyond this is not sent to the model
+    MAX_PROMPT_CHARS = 8000
+
+    def __init__(self, backend=None, timeout: float = AI_TIMEOUT, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 max_queue: int = AI_MAX_QUEUE, queue_timeout: float = AI_QUEUE_TIMEOUT,
+                 retries: int = AI_RETRIES, backoff: float = AI_BACKOFF):
+        self.timeout = timeout
+        if backend is None:
+            backend = self._backend_from_env()
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # Backend calls get their own threads, never the default executor that parsing and rendering use
+        self._executor = ThreadPoolExecutor(max_workers=max(max_concurrency, 1), thread_name_prefix="ai-call")
+        # Slots still held by calls that timed out, released when their thread returns
+        self._draining = set()
+        self.abandoned = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._inflight = {}
+        self.coalesced = 0
+        self.coalesce_waiting = 0
+
+    def _backend_from_env(self):
+        if AI_BACKEND == "stub":
+            return StubBackend(float(os.getenv("CVOS_AI_STUB_LATENCY", "0.5")),
+                               float(os.getenv("CVOS_AI_STUB_ERROR_RATE", "0")))
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            logger.warning("GOOGLE_API_KEY not found. AI features will fail.")
+            return None
+        return GeminiBackend(api_key, self.MODEL_NAME, timeout=self.timeout)
 
+    def build_prompt(self, text: str) -> str:
         prompt = f"""
         Actúa como un experto reclutador y sistema ATS avanzado. Analiza el siguiente texto extraído de un CV y dame un reporte estructurado en formato JSON con los siguientes campos:
         1. "score": Un puntaje numérico de 0 a 100 basado en completitud y palabras clave.
@@ -27,14 +142,169 @@ class AIService:
         5. "keywords_detected": Lista de habilidades técnicas o blandas encontradas.
 
         CV TEXT:
-        {text[:8000]} 
+        {text[:self.MAX_PROMPT_CHARS]} 
         """
         # Truncamos a 8000 chars por si acaso, aunque Gemini soporta más.
+        return prompt
+
+    @staticmethod
+    def _clean(raw: str) -> str:
+        # Intentar limpiar el resultado para obtener JSON puro si el modelo devuelve markdown
+        return raw.replace("```json", "").replace("```", "").strip()
+
+    def analyze_cv(self, text: str):
+        """Blocking call, for scripts. The API uses analyze_cv_async."""
+        if not self.backend:
+            return {"error": "AI Service not configured (missing API Key)"}
 
         try:
-            response = self.model.generate_content(prompt)
-            # Intentar limpiar el resultado para obtener JSON puro si el modelo devuelve markdown
-            cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
-            return cleaned_text
+            return self._clean(self.backend.generate(self.build_prompt(text)))
         except Exception as e:
             return {"error": str(e)}
+
+    async def analyze_cv_async(self, text: str):
+        """
+        Same contract as analyze_cv (cleaned JSON string, or {"error": ...}),
+        without blocking the event loop.
+
+        Raises:
+            AIBusy: concurrency limit reached and the wait queue is full or too slow
+            AITimeout: the model did not answer within the timeout (not retried)
+        """
+        if not self.backend:
+            return {"error": "AI Service not configured (missing API Key)"}
+
+        # Single flight: identical analyses already in progress share one model call
+        key = self.coalesce_key(text)
+        leader = self._inflight.get(key)
+        if leader is not None:
+            self.coalesced += 1
+            AI_REQUESTS.inc(outcome="coalesced")
+            self.coalesce_waiting += 1
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                # The leading request was cancelled (client left); run our own call instead
+                if not leader.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            finally:
+                self.coalesce_waiting -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._analyze(text)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # followers re-raise it; don't warn when there are none
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def coalesce_key(self, text: str) -> str:
+        """Requests with the same normalized CV text and prompt version share a call."""
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.PROMPT_VERSION}\n{normalized}".encode("utf-8")).hexdigest()
+
+    async def _analyze(self, text: str):
+        prompt = self.build_prompt(text)
+        await self._acquire()
+        # Backend calls started for this request; the slot is held until all of them have returned
+        calls = []
+        try:
+            return self._clean(await self._generate_with_retries(prompt, calls))
+        except AITimeout:
+            raise
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            running = [call for call in calls if not call.done()]
+            if running:
+                # A timed-out call still occupies its thread and the upstream connection
+                self.abandoned += len(running)
+                AI_REQUESTS.inc(len(running), outcome="abandoned")
+                task = asyncio.ensure_future(self._release_after(running))
+                self._draining.add(task)
+                task.add_done_callback(self._draining.discard)
+            else:
+                self._release()
+
+    async def _release_after(self, calls):
+        try:
+            await asyncio.gather(*(asyncio.wrap_future(call) for call in calls), return_exceptions=True)
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        AI_SLOTS.set(self.in_flight, state="in_flight")
+        self._slots.release()
+
+    async def _acquire(self):
+        if not self._slots.locked():
+            # Free slot: take it without going through the wait queue
+            await self._slots.acquire()
+            self.in_flight += 1
+            AI_SLOTS.set(self.in_flight, state="in_flight")
+            return
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            AI_REQUESTS.inc(outcome="rejected")
+            raise AIBusy("AI service at capacity")
+        self.waiting += 1
+        AI_SLOTS.set(self.waiting, state="waiting")
+        try:
+            with timed("ai_queue_wait"):
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            AI_REQUESTS.inc(outcome="rejected")
+            raise AIBusy("AI service queue wait timed out")
+        finally:
+            self.waiting -= 1
+            AI_SLOTS.set(self.waiting, state="waiting")
+        self.in_flight += 1
+        AI_SLOTS.set(self.in_flight, state="in_flight")
+
+    async def _generate_with_retries(self, prompt: str, calls: list) -> str:
+        for attempt in range(self.retries + 1):
+            try:
+                # The blocking SDK call runs in one of our threads; on timeout we stop waiting for it,
+                # and the request's slot stays taken until the thread is free again
+                call = self._executor.submit(self.backend.generate, prompt)
+                calls.append(call)
+                with timed("ai_call"):
+                    return await asyncio.wait_for(asyncio.wrap_future(call), self.timeout)
+            except Exception as e:
+                if not _is_transient(e) or attempt == self.retries:
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise AITimeout(f"AI service timed out after {self.timeout}s")
+                    raise
+                # Full jitter: sleep somewhere in [0, backoff * 2^attempt]
+                await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "abandoned": self.abandoned,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "coalesced": self.coalesced,
+            "coalesce_waiting": self.coalesce_waiting,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_ai_service() -> AIService:
+    """Process-wide AIService: genai is configured once, limits are shared by all requests."""
+    return AIService()
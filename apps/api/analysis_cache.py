@@ -0,0 +1,87 @@
+"""
+Analysis cache for cvOS
+LRU cache with TTL and a byte budget for JSON analysis results, keyed by the
+SHA-256 of the uploaded PDF plus the analyzer or prompt version.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+ANALYSIS_CACHE_ENTRIES = int(os.getenv("CVOS_ANALYSIS_CACHE_ENTRIES", "2000"))
+ANALYSIS_CACHE_MB = float(os.getenv("CVOS_ANALYSIS_CACHE_MB", "32"))
+ANALYSIS_CACHE_TTL = int(os.getenv("CVOS_ANALYSIS_CACHE_TTL", "3600"))
+AI_CACHE_TTL = int(os.getenv("CVOS_AI_CACHE_TTL", "86400"))
+
+
+def content_key(pdf_bytes: bytes, version: str) -> str:
+    """Cache key: hash of the uploaded bytes plus the version of whatever produced the result."""
+    return f"{hashlib.sha256(pdf_bytes).hexdigest()}:{version}"
+
+
+class AnalysisCache:
+    """Thread-safe LRU of JSON-serializable results, bounded by entries, bytes and age."""
+
+    def __init__(self, max_entries: int = ANALYSIS_CACHE_ENTRIES, max_bytes: Optional[int] = None,
+                 ttl: int = ANALYSIS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = int(ANALYSIS_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.ttl = ttl
+        # key -> (expires_at, size, result)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: str, result: Dict[str, Any]):
+        size = len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            }
+
+    def _drop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
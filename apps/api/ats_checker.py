@@ -1,77 +1,271 @@
-import fitz  # PyMuPDF
+import io
+import os
 import re
-from typing import List, Dict, Any
+from array import array
+from bisect import bisect_right
+from keyword_matcher import get_keyword_index
+from metrics import timed
+from typing import TYPE_CHECKING, List, Dict, Any, BinaryIO, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import fitz  # PyMuPDF
+
+# Ruta en disco, bytes en memoria o un buffer (p. ej. UploadFile.file)
+PDFSource = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+# Límites de entrada: un PDF enorme o malicioso no debe agotar la memoria ni la CPU del worker
+MAX_PDF_BYTES = int(float(os.getenv("CVOS_MAX_PDF_MB", "10")) * 1024 * 1024)
+MAX_PAGES = int(os.getenv("CVOS_MAX_PAGES", "30"))
+MAX_TEXT_CHARS = int(os.getenv("CVOS_MAX_TEXT_CHARS", "100000"))
+
+class PDFTooLarge(ValueError):
+    """El PDF supera MAX_PDF_BYTES."""
+
+    def __init__(self, message: str = ""):
+        super().__init__(message or f"El PDF supera el límite de {MAX_PDF_BYTES // (1024 * 1024)} MB")
+
+def check_pdf_size(size: int):
+    """Lanza PDFTooLarge si size supera MAX_PDF_BYTES."""
+    if size > MAX_PDF_BYTES:
+        raise PDFTooLarge()
+
+def open_pdf(source: PDFSource) -> "fitz.Document":
+    """Abre un PDF desde una ruta, bytes o un buffer sin tocar el disco."""
+    # PyMuPDF se importa al primer uso para no alargar el arranque de la API
+    import fitz
+    if isinstance(source, str):
+        check_pdf_size(os.path.getsize(source))
+        return fitz.open(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        check_pdf_size(len(source))
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    if isinstance(source, io.BytesIO):
+        check_pdf_size(source.getbuffer().nbytes)
+        return fitz.open(stream=source.getvalue(), filetype="pdf")
+    # Un byte más que el límite basta para saber que lo supera
+    data = source.read(MAX_PDF_BYTES + 1)
+    check_pdf_size(len(data))
+    return fitz.open(stream=data, filetype="pdf")
+
+Block = Tuple[int, float, float, float, float, int]
+
+class ParsedDocument:
+    """
+    Un PDF leído una sola vez: todo lo que necesitan el scorer, el prompt de la
+    IA, el matcher de ofertas y cualquier análisis futuro. Se construye una vez
+    por upload; con __slots__ para ocupar lo mínimo cuando hay muchos en memoria.
+    """
+    __slots__ = ("text", "page_count", "truncated", "page_spans", "blocks", "_line_offsets")
+
+    def __init__(self, text: str, page_count: int = 1, truncated: bool = False,
+                 page_spans: Optional[List[Tuple[int, int]]] = None, blocks: Optional[List[Block]] = None):
+        self.text = text
+        # Páginas del PDF, incluidas las que no se leyeron por los límites
+        self.page_count = page_count
+        # True si se dejaron páginas o caracteres sin leer por los límites
+        self.truncated = truncated
+        # (inicio, fin) en text de cada página leída
+        self.page_spans = page_spans if page_spans is not None else [(0, len(text))]
+        # Bloques de PyMuPDF: (página, x0, y0, x1, y1, tipo); tipo 0 = texto, 1 = imagen
+        self.blocks = blocks if blocks is not None else []
+        self._line_offsets = None
+
+    @property
+    def line_offsets(self) -> "array":
+        """Offset en text del inicio de cada línea (se calcula al primer uso)."""
+        if self._line_offsets is None:
+            offsets = array("L", [0])
+            find = self.text.find
+            pos = find("\n")
+            while pos != -1:
+                offsets.append(pos + 1)
+                pos = find("\n", pos + 1)
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    def line_at(self, offset: int) -> int:
+        """Número de línea (desde 0) del carácter en offset."""
+        return bisect_right(self.line_offsets, offset) - 1
+
+    def page_text(self, index: int) -> str:
+        start, end = self.page_spans[index]
+        return self.text[start:end]
+
+    def head(self, max_chars: int) -> str:
+        """Los primeros max_chars caracteres, cortados al final de una línea si es posible."""
+        if len(self.text) <= max_chars:
+            return self.text
+        cut = self.line_offsets[self.line_at(max_chars)]
+        return self.text[:cut or max_chars]
+
+def count_pages(doc: "fitz.Document") -> int:
+    try:
+        return len(doc)
+    except:
+        return 1
+
+def read_document(doc: "fitz.Document", max_pages: int = MAX_PAGES,
+                  max_chars: int = MAX_TEXT_CHARS) -> ParsedDocument:
+    """
+    Extrae texto y bloques página a página (una página cargada a la vez) y se
+    detiene en max_pages o max_chars. Texto y bloques salen del mismo TextPage:
+    cada página se analiza una sola vez.
+    """
+    parts: List[str] = []
+    spans: List[Tuple[int, int]] = []
+    blocks: List[Block] = []
+    total = 0
+    page_count = count_pages(doc)
+    truncated = page_count > max_pages
+    for index in range(min(page_count, max_pages)):
+        page = doc.load_page(index)
+        textpage = page.get_textpage()
+        page_text = page.get_text("text", textpage=textpage)
+        blocks.extend((index, round(b[0], 1), round(b[1], 1), round(b[2], 1), round(b[3], 1), b[6])
+                      for b in page.get_text("blocks", textpage=textpage))
+        clipped = total + len(page_text) > max_chars
+        if clipped:
+            page_text = page_text[:max_chars - total]
+            truncated = True
+        parts.append(page_text)
+        spans.append((total, total + len(page_text)))
+        total += len(page_text)
+        if clipped:
+            break
+    return ParsedDocument("".join(parts), page_count, truncated, spans, blocks)
+
+def parse_pdf(source: PDFSource, max_pages: int = MAX_PAGES, max_chars: int = MAX_TEXT_CHARS) -> ParsedDocument:
+    """Abre el PDF una vez y lo deja listo para todos los análisis."""
+    with timed("fitz_open"):
+        doc = open_pdf(source)
+    try:
+        with timed("text_extract"):
+            return read_document(doc, max_pages, max_chars)
+    finally:
+        doc.close()
+
+# Patrones de viñetas, compilados una vez en una sola alternancia (re.match ancla al inicio)
+BULLET_RE = re.compile(r'[\•\-\*\→\►\▸]|\d+\.|[a-z]\)|[ivx]+\.', re.IGNORECASE)
+
+def scan_text(text: str) -> Dict[str, Any]:
+    """
+    Recorre el texto una sola vez y devuelve los contadores que usan
+    _calculate_metrics y _check_sections.
+    """
+    lines = text.split('\n')
+    non_empty = short_lines = bullet_lines = word_count = word_chars = 0
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        non_empty += 1
+        if len(stripped) < 30:
+            short_lines += 1
+        if BULLET_RE.match(stripped):
+            bullet_lines += 1
+        # Las palabras de text.split() son exactamente las de cada línea
+        words = stripped.split()
+        word_count += len(words)
+        word_chars += sum(map(len, words))
+    # Secciones y skills: un solo recorrido del autómata (palabras completas, sin acentos)
+    sections, skills = get_keyword_index().find(text)
+    return {
+        "total_lines": len(lines),
+        "non_empty_lines": non_empty,
+        "short_lines": short_lines,
+        "bullet_lines": bullet_lines,
+        "word_count": word_count,
+        "word_chars": word_chars,
+        # str.count corre en C; contarlo por línea sería más lento
+        "table_indicators": text.count('\t') + text.count('|'),
+        "sections": sections,
+        "skills": skills,
+    }
+
+def analyzer_version() -> str:
+    """Versión del análisis: código del analizador + diccionario de palabras clave."""
+    return f"{ATSAnalyzer.VERSION}+{get_keyword_index().digest[:12]}"
+
+def analyze_pdf(source: PDFSource) -> Dict[str, Any]:
+    """Atajo para ejecutores (thread/process pool): analiza y retorna el resultado."""
+    return ATSAnalyzer(source).analyze()
 
 class ATSAnalyzer:
-    def __init__(self, pdf_path: str):
-        self.pdf_path = pdf_path
-        self.text = self._extract_text()
+    # Subir cuando cambie el scoring o la forma del resultado (invalida la caché de análisis)
+    VERSION = "1.2.0"
+
+    def __init__(self, source: Union[PDFSource, ParsedDocument], max_pages: int = MAX_PAGES,
+                 max_chars: int = MAX_TEXT_CHARS):
+        """source: un PDF (ruta, bytes o buffer) o un ParsedDocument ya leído, que se reutiliza sin volver a abrirlo."""
+        self.pdf_path = source if isinstance(source, str) else None
+        document = source if isinstance(source, ParsedDocument) else parse_pdf(source, max_pages, max_chars)
+        self._reset(document)
+
+    @classmethod
+    def from_text(cls, text: str, page_count: int = 1) -> "ATSAnalyzer":
+        """Crea un analizador a partir de texto ya extraído."""
+        return cls(ParsedDocument(text, page_count))
+
+    def _reset(self, document: ParsedDocument):
+        self.document = document
+        self.text = document.text
+        self.page_count = document.page_count
+        self.truncated = document.truncated
+        self._scan_result = None
         self.sections_found: List[str] = []
         self.issues: List[str] = []
         self.improvements: List[str] = []
         self.strengths: List[str] = []
         self.score = 0
 
-    def _extract_text(self) -> str:
-        """Extrae todo el texto del PDF."""
-        doc = fitz.open(self.pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
-
     def analyze(self) -> Dict[str, Any]:
         """Ejecuta el análisis completo y retorna resultados detallados."""
-        metrics = self._calculate_metrics()
-        self._check_sections()
-        self._analyze_structure(metrics)
-        self._generate_feedback(metrics)
+        with timed("metrics"):
+            metrics = self._calculate_metrics()
+        with timed("scoring"):
+            self._check_sections()
+            self._analyze_structure(metrics)
+            self._generate_feedback(metrics)
         
         return {
             "score": self.score,
             "sections_found": self.sections_found,
+            "skills_found": self._scan()["skills"],
             "metrics": metrics,
             "issues": self.issues,
             "improvements": self.improvements,
             "strengths": self.strengths,
-            "summary": self._generate_summary()
+            "summary": self._generate_summary(),
+            "truncated": self.truncated
         }
 
+    def _scan(self) -> Dict[str, Any]:
+        if self._scan_result is None:
+            self._scan_result = scan_text(self.text)
+        return self._scan_result
+
     def _calculate_metrics(self) -> Dict[str, Any]:
         """Calcula métricas detalladas del documento."""
-        lines = self.text.split('\n')
-        words = self.text.split()
-        
-        # Detectar viñetas/bullets
-        bullet_patterns = [r'^[\•\-\*\→\►\▸]', r'^\d+\.', r'^[a-z]\)', r'^[ivx]+\.']
-        bullet_lines = 0
-        for line in lines:
-            line_stripped = line.strip()
-            for pattern in bullet_patterns:
-                if re.match(pattern, line_stripped, re.IGNORECASE):
-                    bullet_lines += 1
-                    break
+        scan = self._scan()
+        words = scan["word_count"]
         
         # Detectar posibles columnas (líneas muy cortas seguidas)
-        short_lines = sum(1 for line in lines if 0 < len(line.strip()) < 30)
-        possible_columns = short_lines > len(lines) * 0.4
+        possible_columns = scan["short_lines"] > scan["total_lines"] * 0.4
         
         # Detectar tablas (muchas tabulaciones o pipes)
-        table_indicators = self.text.count('\t') + self.text.count('|')
-        possible_tables = table_indicators > 20
+        possible_tables = scan["table_indicators"] > 20
         
         # Calcular legibilidad simple (proporción de palabras comunes)
-        avg_word_length = sum(len(w) for w in words) / max(len(words), 1)
+        avg_word_length = scan["word_chars"] / max(words, 1)
         readability = max(0, min(100, 100 - (avg_word_length - 5) * 10))
         
         # Verificar si hay suficiente contenido
-        has_enough_content = len(words) >= 200
+        has_enough_content = words >= 200
         
         return {
-            "word_count": len(words),
-            "line_count": len([l for l in lines if l.strip()]),
-            "bullet_count": bullet_lines,
+            "word_count": words,
+            "line_count": scan["non_empty_lines"],
+            "bullet_count": scan["bullet_lines"],
             "has_columns": possible_columns,
             "has_tables": possible_tables,
             "readability_score": round(readability),
@@ -82,34 +276,13 @@ class ATSAnalyzer:
 
     def _get_page_count(self) -> int:
         """Obtiene el número de páginas del PDF."""
-        try:
-            doc = fitz.open(self.pdf_path)
-            count = len(doc)
-            doc.close()
-            return count
-        except:
-            return 1
+        return self.page_count
 
     def _check_sections(self):
         """Detecta secciones estándar buscando palabras clave."""
-        section_keywords = {
-            "Experiencia Laboral": ["experiencia", "experience", "work history", "employment", "trabajo"],
-            "Educación": ["educación", "education", "formación", "academic", "university", "universidad", "estudios"],
-            "Habilidades/Skills": ["habilidades", "skills", "competencias", "technologies", "tecnologías", "conocimientos"],
-            "Resumen/Perfil": ["perfil", "profile", "resumen", "summary", "about me", "sobre mí", "objetivo"],
-            "Contacto": ["contacto", "contact", "email", "teléfono", "phone", "linkedin", "github"]
-        }
-
-        text_lower = self.text.lower()
-        found_count = 0
-        total_sections = len(section_keywords)
-
-        for section, keywords in section_keywords.items():
-            for kw in keywords:
-                if kw in text_lower:
-                    self.sections_found.append(section)
-                    found_count += 1
-                    break
+        self.sections_found.extend(self._scan()["sections"])
+        found_count = len(self.sections_found)
+        total_sections = len(get_keyword_index().sections)
         
         # Score por secciones (40% del total)
         section_score = (found_count / total_sections) * 40
@@ -0,0 +1,221 @@
+"""
+Batch ATS analysis for cvOS
+Fans ATSAnalyzer work for many PDFs out to a process pool and yields one
+result per CV as soon as it finishes. Only `max_in_flight` PDFs are held in
+memory at a time, however large the batch is. The pool is swapped for a fresh
+one when a worker passes its job or memory budget (see worker_limits).
+
+The single-CV endpoints (/analyze, /analyze-with-ai, /match) parse and score
+on the same pool through run_analysis(), so every PDF runs under the per-job
+ceiling and in a worker that gets recycled.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from analysis_cache import content_key
+from ats_checker import ATSAnalyzer, ParsedDocument, analyze_pdf, analyzer_version, check_pdf_size
+from metrics import BYTES_TOTAL, capture_stages, record_stages
+from worker_limits import WorkerBudget, run_job
+
+logger = logging.getLogger("batch_analyzer")
+
+ANALYSIS_WORKERS = int(os.getenv("CVOS_ANALYSIS_WORKERS", os.cpu_count() or 1))
+BATCH_MAX_IN_FLIGHT = int(os.getenv("CVOS_BATCH_MAX_IN_FLIGHT", ANALYSIS_WORKERS * 2))
+BATCH_MAX_FILES = int(os.getenv("CVOS_BATCH_MAX_FILES", "500"))
+# Whole multipart body of a batch (PDFs and zips), enforced while it is received
+BATCH_MAX_BODY_BYTES = int(float(os.getenv("CVOS_BATCH_MAX_BODY_MB", "200")) * 1024 * 1024)
+
+# A batch item: display name plus a coroutine factory that loads the PDF bytes
+BatchItem = Tuple[str, Callable[[], Awaitable[bytes]]]
+
+
+def _init_worker():
+    # Build the keyword automaton once per worker, not on the first CV
+    from keyword_matcher import get_keyword_index
+    get_keyword_index()
+
+
+def _run_in_worker(fn, *args) -> Tuple[object, list, dict]:
+    # Stage timings and the worker's memory usage travel back with the result; its own metrics are never scraped
+    with capture_stages() as stages:
+        result, usage = run_job(fn, *args)
+    return result, stages, usage
+
+
+def analyze_document(document: ParsedDocument) -> Dict:
+    """ATS analysis of an already parsed CV (for run_analysis)."""
+    return ATSAnalyzer(document).analyze()
+
+
+@lru_cache(maxsize=None)
+def get_analysis_executor() -> ProcessPoolExecutor:
+    """Process pool shared by every batch request."""
+    logger.info(f"Starting analysis pool: {ANALYSIS_WORKERS} workers")
+    return ProcessPoolExecutor(
+        max_workers=ANALYSIS_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    )
+
+
+def warm_analysis_pool() -> int:
+    """Start every worker (each builds its keyword index) before the first upload needs one."""
+    pool = get_analysis_executor()
+    # Workers are spawned one per submit that finds none idle
+    pids = {future.result() for future in [pool.submit(os.getpid) for _ in range(ANALYSIS_WORKERS)]}
+    return len(pids)
+
+
+def shutdown_analysis_executor():
+    if get_analysis_executor.cache_info().currsize:
+        get_analysis_executor().shutdown(wait=False, cancel_futures=True)
+        get_analysis_executor.cache_clear()
+
+
+analysis_budget = WorkerBudget("analysis")
+# Held while picking the shared pool and submitting to it, so a recycle can't shut it down in between
+_executor_lock = threading.Lock()
+
+
+def _submit(executor, fn, *args) -> Future:
+    with _executor_lock:
+        pool = executor or get_analysis_executor()
+        future = pool.submit(_run_in_worker, fn, *args)
+    if executor is None:
+        future.add_done_callback(lambda f: _account(f, pool))
+    return future
+
+
+def _account(future: Future, pool: ProcessPoolExecutor):
+    with _executor_lock:
+        current = get_analysis_executor.cache_info().currsize and get_analysis_executor() is pool
+    reason = analysis_budget.observe(future, current=bool(current))
+    if reason:
+        recycle_analysis_executor(pool, reason)
+
+
+def recycle_analysis_executor(pool: ProcessPoolExecutor, reason: str = "manual"):
+    """
+    Start the next analyses on a fresh pool; `pool` finishes the ones it has
+    already taken and then exits. A no-op if `pool` was replaced already.
+    """
+    with _executor_lock:
+        if not get_analysis_executor.cache_info().currsize or get_analysis_executor() is not pool:
+            return
+        get_analysis_executor.cache_clear()
+    analysis_budget.recycled(reason)
+    threading.Thread(target=pool.shutdown, kwargs={"wait": True}, name="analysis-recycle", daemon=True).start()
+
+
+async def run_analysis(fn, *args):
+    """
+    Run fn(*args) on the shared analysis pool and return its result. fn must
+    be a module-level function (it is pickled to the worker).
+
+    Raises:
+        CeilingExceeded: the job passed its time or memory ceiling
+    """
+    try:
+        result, stages, _ = await asyncio.wrap_future(_submit(None, fn, *args))
+    except BrokenProcessPool:
+        # A worker died; the next request gets a fresh pool
+        get_analysis_executor.cache_clear()
+        raise
+    record_stages(stages)
+    return result
+
+
+def zip_batch_items(archive: io.IOBase) -> Iterator[BatchItem]:
+    """Batch items for the PDFs inside a zip archive; members are read lazily, off the event loop."""
+    zf = zipfile.ZipFile(archive)
+    for info in zf.infolist():
+        name = info.filename
+        if info.is_dir() or not name.lower().endswith(".pdf") or name.startswith("__MACOSX/"):
+            continue
+        yield name, (lambda info=info: asyncio.to_thread(_read_member, zf, info))
+
+
+def _read_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    # Checked before decompressing: a small zip can expand to gigabytes
+    check_pdf_size(info.file_size)
+    return zf.read(info)
+
+
+async def analyze_batch(items: Iterable[BatchItem], executor=None,
+                        max_in_flight: int = BATCH_MAX_IN_FLIGHT, cache=None) -> AsyncIterator[Dict]:
+    """
+    Analyze every item and yield a result dict per CV in completion order.
+    A failing file produces an error entry; it never aborts the batch.
+    With an AnalysisCache, PDFs seen before skip the pool entirely.
+    """
+    version = analyzer_version()
+    loop = asyncio.get_running_loop()
+    items = iter(items)
+    # future -> (index, filename, cache key to fill, served from cache)
+    pending: Dict[asyncio.Future, Tuple[int, str, Optional[str], bool]] = {}
+    index = 0
+    total = failed = 0
+
+    async def launch(idx: int, name: str, load: Callable[[], Awaitable[bytes]]):
+        try:
+            pdf_bytes = await load()
+            BYTES_TOTAL.inc(len(pdf_bytes), kind="upload")
+            check_pdf_size(len(pdf_bytes))
+            if not pdf_bytes.startswith(b"%PDF"):
+                raise ValueError("El archivo debe ser un PDF")
+            key = content_key(pdf_bytes, version) if cache is not None else None
+            cached = cache.get(key) if key else None
+            if cached is not None:
+                future = loop.create_future()
+                future.set_result((cached, [], None))
+                pending[future] = (idx, name, None, True)
+                return
+            future = asyncio.wrap_future(_submit(executor, analyze_pdf, pdf_bytes))
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died; the next batch gets a fresh pool
+                get_analysis_executor.cache_clear()
+            future = loop.create_future()
+            future.set_exception(e)
+            key = None
+        pending[future] = (idx, name, key, False)
+
+    try:
+        while True:
+            while len(pending) < max_in_flight:
+                item = next(items, None)
+                if item is None:
+                    break
+                await launch(index, *item)
+                index += 1
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                idx, name, key, hit = pending.pop(future)
+                total += 1
+                try:
+                    result, stages, _ = future.result()
+                    record_stages(stages)
+                    if key:
+                        cache.put(key, result)
+                    entry = {"index": idx, "filename": name, "ok": True, "cached": hit, "result": result}
+                except Exception as e:
+                    failed += 1
+                    entry = {"index": idx, "filename": name, "ok": False, "error": str(e) or type(e).__name__}
+                yield entry
+    finally:
+        # Client went away: don't keep analyzing for nobody
+        for future in pending:
+            future.cancel()
+
+    yield {"done": True, "total": total, "failed": failed}
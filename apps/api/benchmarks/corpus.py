@@ -0,0 +1,109 @@
+"""
+Synthetic CV corpus for cvOS benchmarks.
+Deterministic (seeded) CV form data for PDFGenerator and CV PDFs for
+ATSAnalyzer, with varying page counts, bullet density and column/table layouts,
+and job postings for the job matcher.
+"""
+import random
+from typing import Dict, List
+
+import fitz  # PyMuPDF
+
+# name -> layout knobs for make_cv_pdf()
+PROFILES: Dict[str, dict] = {
+    "1p_plain": {"pages": 1, "bullet_ratio": 0.1, "columns": False, "tables": False},
+    "2p_bullets": {"pages": 2, "bullet_ratio": 0.7, "columns": False, "tables": False},
+    "2p_columns": {"pages": 2, "bullet_ratio": 0.3, "columns": True, "tables": False},
+    "3p_tables": {"pages": 3, "bullet_ratio": 0.3, "columns": False, "tables": True},
+    "10p_long": {"pages": 10, "bullet_ratio": 0.4, "columns": False, "tables": False},
+}
+
+WORDS = ("desarrollé lideré implementé gestioné equipo proyecto ventas clientes análisis datos "
+         "python java docker kubernetes aws optimización rendimiento costos crecimiento "
+         "developed led managed team project customers performance architecture microservices "
+         "leadership strategy product design communication growth international").split()
+HEADERS = ["Perfil", "Experiencia", "Educación", "Habilidades", "Contacto", "Certificaciones"]
+BULLETS = ["•", "-", "▸", "1.", "a)"]
+
+
+def _sentence(rng: random.Random, low: int = 6, high: int = 18) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def make_cv_data(seed: int = 0, jobs: int = 3, bullets_per_job: int = 4) -> dict:
+    """Form data in the shape the dashboard wizard posts to /generate-pdf."""
+    rng = random.Random(seed)
+    return {
+        "fullName": f"Candidata {seed}",
+        "title": "Senior Software Engineer",
+        "email": f"cv{seed}@example.com",
+        "phone": "+57 300 000 0000",
+        "location": "Bogotá, Colombia",
+        "website": "https://example.com",
+        "github": "github.com/example",
+        "summary": _sentence(rng, 30, 50),
+        "experience": [
+            {
+                "company": f"Empresa {i}",
+                "position": rng.choice(["Developer", "Tech Lead", "Engineering Manager"]),
+                "location": "Remote",
+                "startDate": str(2015 + i),
+                "endDate": str(2016 + i),
+                "description": "\n".join(f"• {_sentence(rng)}" for _ in range(bullets_per_job)),
+            }
+            for i in range(jobs)
+        ],
+        "education": [
+            {"institution": "Universidad Nacional", "degree": "Ingeniería de Sistemas",
+             "startDate": "2010", "endDate": "2015", "location": "Bogotá"}
+        ],
+        "skills": "Python, FastAPI, Docker, Kubernetes, AWS, PostgreSQL",
+        "languages": "Español (nativo), English (C1)",
+        "certifications": [{"name": "AWS Solutions Architect", "issuer": "Amazon", "date": "2023"}],
+    }
+
+
+def _page_lines(rng: random.Random, profile: dict) -> List[str]:
+    lines = []
+    for header in HEADERS:
+        lines.append(header)
+        for _ in range(rng.randint(4, 7)):
+            if rng.random() < profile["bullet_ratio"]:
+                lines.append(f"{rng.choice(BULLETS)} {_sentence(rng)}")
+            else:
+                lines.append(_sentence(rng))
+        if profile["tables"]:
+            lines.extend(" | ".join(_sentence(rng, 1, 2) for _ in range(4)) for _ in range(3))
+    return lines
+
+
+def make_cv_pdf(profile_name: str, seed: int = 0) -> bytes:
+    """Build a CV-like PDF for the given profile with PyMuPDF."""
+    profile = PROFILES[profile_name]
+    rng = random.Random(f"{profile_name}:{seed}")
+    doc = fitz.open()
+    for _ in range(profile["pages"]):
+        page = doc.new_page()
+        lines = _page_lines(rng, profile)
+        if profile["columns"]:
+            half = len(lines) // 2
+            page.insert_textbox(fitz.Rect(36, 36, 290, 806), "\n".join(lines[:half]), fontsize=8)
+            page.insert_textbox(fitz.Rect(306, 36, 560, 806), "\n".join(lines[half:]), fontsize=8)
+        else:
+            page.insert_textbox(fitz.Rect(36, 36, 560, 806), "\n".join(lines), fontsize=8)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def make_postings(count: int, seed: int = 0) -> List[dict]:
+    """Job postings for JobIndex: corpus words plus a long tail of rare terms, like real ads."""
+    rng = random.Random(f"postings:{seed}")
+    return [
+        {
+            "id": f"job-{seed}-{i}",
+            "title": rng.choice(["Backend Developer", "Data Engineer", "Tech Lead", "Product Manager"]),
+            "description": " ".join([_sentence(rng, 40, 80)] + [f"term{rng.randint(0, 50000)}" for _ in range(30)]),
+        }
+        for i in range(count)
+    ]
@@ -0,0 +1,352 @@
+"""
+Load-test harness for cvOS.
+Starts the API locally (uvicorn, in a subprocess) next to the Gemini
+stand-in, replays a scripted mix of /analyze, /analyze-with-ai, /generate-pdf
+and /templates at increasing request rates, and reports throughput and
+p50/p95/p99 latency per endpoint for each rate, plus the saturation point:
+the highest rate the instance sustains within the SLO.
+
+Run from apps/api:
+    python -m benchmarks.loadtest --rates 2,5,10,20 --duration 20 --output load.json
+    python -m benchmarks.loadtest --scenario render --baseline load_main.json
+    python -m benchmarks.loadtest --url https://staging.example.com --rates 5,10
+
+Load is open-loop (arrivals don't wait for responses) and seeded, so two runs
+send the same requests in the same order. Every upload and CV is made unique
+so the analysis, AI and render caches don't answer for the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from benchmarks.run import summarize  # noqa: E402
+
+# Endpoint mixes (weights are relative)
+SCENARIOS: Dict[str, Dict[str, float]] = {
+    "mixed": {"analyze": 0.45, "analyze_ai": 0.15, "generate_pdf": 0.25, "templates": 0.15},
+    "analyze": {"analyze": 0.8, "templates": 0.2},
+    "ai": {"analyze_ai": 1.0},
+    "render": {"generate_pdf": 0.9, "templates": 0.1},
+}
+
+# A step is saturated when it misses any of these
+MIN_THROUGHPUT_RATIO = 0.9
+MAX_ERROR_RATE = 0.05
+DEFAULT_SLO_MS = 2000
+
+
+class Payloads:
+    """Seeded request bodies; each call returns a body no cache has seen."""
+
+    def __init__(self, seed: int):
+        from benchmarks.corpus import PROFILES, make_cv_pdf
+
+        rng = random.Random(seed)
+        self._pdfs = [make_cv_pdf(name, seed=rng.randint(0, 10 ** 6)) for name in PROFILES for _ in range(2)]
+        self._rng = rng
+        self._counter = 0
+
+    def pdf(self) -> bytes:
+        # Bytes after %%EOF are ignored by PDF readers but change the content hash
+        self._counter += 1
+        return self._rng.choice(self._pdfs) + f"\n%loadtest-{self._counter}\n".encode("ascii")
+
+    def cv_data(self) -> dict:
+        from benchmarks.corpus import make_cv_data
+
+        self._counter += 1
+        data = make_cv_data(seed=self._counter)
+        data["template"] = self._rng.choice(["classic", "modern", "executive"])
+        return data
+
+
+def build_request(endpoint: str, payloads: Payloads) -> dict:
+    """Keyword arguments for httpx.AsyncClient.request()."""
+    if endpoint == "templates":
+        return {"method": "GET", "url": "/templates"}
+    if endpoint == "generate_pdf":
+        return {"method": "POST", "url": "/generate-pdf", "json": payloads.cv_data()}
+    path = "/analyze" if endpoint == "analyze" else "/analyze-with-ai"
+    return {"method": "POST", "url": path, "files": {"file": ("cv.pdf", payloads.pdf(), "application/pdf")}}
+
+
+async def run_step(client, rate: float, duration: float, mix: Dict[str, float], rng: random.Random,
+                   payloads: Payloads, max_in_flight: int) -> dict:
+    """Offer `rate` requests/s for `duration` seconds (Poisson arrivals) and summarize what came back."""
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    records: List[tuple] = []
+    tasks = set()
+    dropped = 0
+
+    async def fire(endpoint: str, request: dict):
+        start = time.perf_counter()
+        try:
+            response = await client.request(**request)
+            status = response.status_code
+        except Exception as e:
+            status = type(e).__name__
+        records.append((endpoint, status, (time.perf_counter() - start) * 1000))
+
+    started = time.perf_counter()
+    next_at = 0.0
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at >= duration:
+            break
+        delay = started + next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = rng.choices(endpoints, weights)[0]
+        request = build_request(endpoint, payloads)
+        if len(tasks) >= max_in_flight:
+            # The client can't keep up either; count it rather than distort the arrival rate
+            dropped += 1
+            continue
+        task = asyncio.create_task(fire(endpoint, request))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(set(tasks))
+    elapsed = time.perf_counter() - started
+    return summarize_step(rate, duration, elapsed, records, dropped)
+
+
+def summarize_step(rate: float, duration: float, elapsed: float, records: List[tuple], dropped: int) -> dict:
+    by_endpoint: Dict[str, dict] = {}
+    for endpoint in sorted({r[0] for r in records} | {"all"}):
+        rows = records if endpoint == "all" else [r for r in records if r[0] == endpoint]
+        ok = [ms for _, status, ms in rows if status == 200]
+        statuses: Dict[str, int] = {}
+        for _, status, _ in rows:
+            if status != 200:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        by_endpoint[endpoint] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "errors": statuses,
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            **(summarize(ok) if ok else {}),
+        }
+    total = by_endpoint["all"]
+    offered = total["requests"] + dropped
+    error_rate = 1 - total["ok"] / offered if offered else 0.0
+    return {
+        "rate_rps": rate,
+        # Poisson arrivals: what was actually offered differs a little from rate_rps
+        "offered_rps": round(offered / duration, 2),
+        "seconds": round(elapsed, 2),
+        "dropped": dropped,
+        "error_rate": round(error_rate, 4),
+        "endpoints": by_endpoint,
+    }
+
+
+def is_saturated(step: dict, slo_ms: float) -> bool:
+    total = step["endpoints"]["all"]
+    return (total["throughput_rps"] < step["offered_rps"] * MIN_THROUGHPUT_RATIO
+            or step["error_rate"] > MAX_ERROR_RATE
+            or total.get("p95_ms", float("inf")) > slo_ms)
+
+
+def start_api(port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    """Start the API with uvicorn; its logs go to log_path so they don't bury the report."""
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning"],
+            cwd=API_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+        )
+
+
+async def wait_ready(client, process: Optional[subprocess.Popen], timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"API exited with code {process.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("API not ready in time")
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[dict]:
+    """Lower saturation point, or p95 per endpoint grown by more than threshold at the same rate."""
+    regressions = []
+    before = baseline["saturation"]["max_sustainable_rps"] or 0
+    after = report["saturation"]["max_sustainable_rps"] or 0
+    if after < before:
+        regressions.append({"metric": "max_sustainable_rps", "baseline": before, "current": after})
+    baseline_steps = {step["rate_rps"]: step for step in baseline["steps"]}
+    for step in report["steps"]:
+        old = baseline_steps.get(step["rate_rps"])
+        if old is None:
+            continue
+        for endpoint, current in step["endpoints"].items():
+            previous = old["endpoints"].get(endpoint, {})
+            if "p95_ms" in current and "p95_ms" in previous \
+                    and current["p95_ms"] > previous["p95_ms"] * (1 + threshold) \
+                    and current["p95_ms"] - previous["p95_ms"] > 5:
+                regressions.append({"metric": f"{endpoint}.p95_ms@{step['rate_rps']}rps",
+                                    "baseline": previous["p95_ms"], "current": current["p95_ms"]})
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{'rate':>6} {'endpoint':<14} {'ok/req':>10} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}  errors")
+    for step in report["steps"]:
+        for endpoint, row in step["endpoints"].items():
+            print(f"{step['rate_rps']:>6} {endpoint:<14} {row['ok']:>4}/{row['requests']:<5} "
+                  f"{row['throughput_rps']:>7} {row.get('p50_ms', '-'):>8} {row.get('p95_ms', '-'):>8} "
+                  f"{row.get('p99_ms', '-'):>8}  {row['errors'] or ''}")
+    saturation = report["saturation"]
+    print(f"Max sustainable rate: {saturation['max_sustainable_rps']} rps "
+          f"(saturated at {saturation['saturated_at_rps']}, SLO p95 <= {saturation['slo_ms']} ms)")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """'analyze=3,templates=1' -> {'analyze': 3.0, 'templates': 1.0}"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS["mixed"]:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from benchmarks import stub_gemini
+
+    process = stub = None
+    base_url = args.url
+    if base_url is None:
+        env = {"CVOS_RENDER_WORKERS": str(args.render_workers)}
+        if args.ai == "http":
+            stub = stub_gemini.start(latency=args.stub_latency, jitter=args.stub_jitter,
+                                     error_rate=args.stub_error_rate, seed=args.seed)
+            env.update({"CVOS_AI_BACKEND": "gemini", "CVOS_GEMINI_ENDPOINT": stub.url,
+                        "GOOGLE_API_KEY": "stub"})
+        else:
+            env.update({"CVOS_AI_BACKEND": "stub", "CVOS_AI_STUB_LATENCY": str(args.stub_latency),
+                        "CVOS_AI_STUB_ERROR_RATE": str(args.stub_error_rate)})
+        process = start_api(args.port, env, args.api_log)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    mix = args.mix or SCENARIOS[args.scenario]
+    rng = random.Random(args.seed)
+    payloads = Payloads(args.seed)
+    steps = []
+    saturated_at = None
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, process)
+            for rate in args.rates:
+                step = await run_step(client, rate, args.duration, mix, rng, payloads, args.max_in_flight)
+                step["saturated"] = is_saturated(step, args.slo_ms)
+                steps.append(step)
+                print(f"{rate} rps: {step['endpoints']['all']['throughput_rps']} ok/s, "
+                      f"p95 {step['endpoints']['all'].get('p95_ms', '-')} ms, errors {step['error_rate']:.1%}")
+                if step["saturated"]:
+                    saturated_at = rate
+                    if not args.keep_going:
+                        break
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if stub is not None:
+            stub.shutdown()
+
+    sustained = [s["rate_rps"] for s in steps if not s["saturated"]
+                 and (saturated_at is None or s["rate_rps"] < saturated_at)]
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.url or "local",
+            "mix": mix,
+            "duration": args.duration,
+            "seed": args.seed,
+            "render_workers": args.render_workers,
+            "ai": args.ai if args.url is None else "remote",
+            "stub": stub.stats() if stub is not None else None,
+        },
+        "steps": steps,
+        "saturation": {
+            "max_sustainable_rps": max(sustained) if sustained else None,
+            "saturated_at_rps": saturated_at,
+            "slo_ms": args.slo_ms,
+        },
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="cvOS load test")
+    parser.add_argument("--url", help="test a running API instead of starting one locally")
+    parser.add_argument("--port", type=int, default=8765, help="port for the local API")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--mix", type=parse_mix, help="custom mix, e.g. analyze=3,generate_pdf=1")
+    parser.add_argument("--rates", type=lambda v: [float(r) for r in v.split(",")], default=[2, 5, 10, 20, 40],
+                        help="requests/s per step, in order")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per step")
+    parser.add_argument("--slo-ms", type=float, default=DEFAULT_SLO_MS, help="p95 latency that counts as saturated")
+    parser.add_argument("--keep-going", action="store_true", help="run every rate even after saturation")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="client-side cap on open requests")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--render-workers", type=int, default=2, help="CVOS_RENDER_WORKERS for the local API")
+    parser.add_argument("--ai", choices=["http", "stub"], default="http",
+                        help="http: the Gemini SDK against benchmarks/stub_gemini; stub: in-process StubBackend")
+    parser.add_argument("--stub-latency", type=float, default=0.8, help="model seconds per call")
+    parser.add_argument("--stub-jitter", type=float, default=0.2)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", default="load_results.json")
+    parser.add_argument("--api-log", default="load_api.log", help="where the local API's output goes")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p95 growth, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+    if args.ai == "http":
+        try:
+            import google.generativeai  # noqa: F401
+        except ImportError:
+            print("google-generativeai not installed; using the in-process stub backend")
+            args.ai = "stub"
+
+    report = asyncio.run(run(args))
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    for r in regressions:
+        print(f"REGRESSION {r['metric']}: {r['baseline']} -> {r['current']}")
+    print(f"Report written to {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
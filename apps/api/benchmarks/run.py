@@ -0,0 +1,289 @@
+"""
+Benchmark runner for cvOS.
+Times ATSAnalyzer (extraction vs scoring), PDFGenerator per template (Jinja
+render vs layout with each PDF backend, plus each backend's peak memory in a
+fresh process), job matching against growing posting indexes and
+end-to-end endpoint latency through an in-process ASGI client, then writes
+the numbers as JSON.
+
+Run from apps/api:
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --baseline bench_main.json --threshold 0.25
+
+With --baseline, any metric whose p50 got slower than the threshold allows
+is reported and the exit code is 1, so regressions show up in review.
+CI compares against benchmarks/baseline.json; refresh it from the
+bench-results artifact of a main build when a slowdown is intended.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+# Ignore differences smaller than this; sub-millisecond metrics are mostly noise
+MIN_DELTA_MS = 0.5
+
+
+def summarize(samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 3),
+        "min_ms": round(ordered[0], 3),
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+async def measure_async(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def weasyprint_error() -> Optional[str]:
+    """None when WeasyPrint and its system libraries load, else the reason they don't."""
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError) as e:
+        return str(e).splitlines()[0]
+    return None
+
+
+def bench_analyzer(results: Dict[str, dict], profiles: List[str], repeat: int):
+    from ats_checker import ATSAnalyzer
+    from benchmarks.corpus import make_cv_pdf
+
+    for name in profiles:
+        pdf_bytes = make_cv_pdf(name)
+        parsed = ATSAnalyzer(pdf_bytes)
+        results[f"analyzer.extract.{name}"] = measure(lambda: ATSAnalyzer(pdf_bytes), repeat)
+        results[f"analyzer.score.{name}"] = measure(
+            lambda: ATSAnalyzer.from_text(parsed.text, parsed.page_count).analyze(), repeat)
+
+
+def bench_matcher(results: Dict[str, dict], sizes: List[int], repeat: int):
+    from ats_checker import ATSAnalyzer
+    from benchmarks.corpus import make_cv_pdf, make_postings
+    from job_matcher import JobIndex
+
+    cv_text = ATSAnalyzer(make_cv_pdf("2p_bullets")).text
+    index = JobIndex()
+    for size in sizes:
+        index.add(make_postings(size - len(index), seed=size))
+        index.build()
+        # Should stay roughly flat as the index grows
+        results[f"matcher.match.{size}"] = measure(lambda: index.match(cv_text, top_k=20), repeat)
+
+
+def bench_renderer(results: Dict[str, dict], repeat: int, weasyprint: bool = True):
+    """Layout time per template and backend ("write_pdf" is WeasyPrint, kept for older baselines)."""
+    from benchmarks.corpus import make_cv_data
+    from pdf_backends import get_backend
+    from pdf_generator import PDFGenerator, TEMPLATES
+
+    generator = PDFGenerator()
+    data = make_cv_data(seed=1, jobs=4, bullets_per_job=5)
+    for template, info in TEMPLATES.items():
+        html = generator.render_html(data, template)
+        results[f"renderer.jinja.{template}"] = measure(lambda: generator.render_html(data, template), repeat)
+        for backend in info["backends"]:
+            if backend == "weasyprint" and not weasyprint:
+                continue
+            metric = "write_pdf" if backend == "weasyprint" else backend
+            results[f"renderer.{metric}.{template}"] = measure(
+                lambda: get_backend(backend).render(generator, html, template), repeat)
+
+
+def _rss_mb() -> float:
+    """Current resident set size (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _backend_memory(backend: str, template: str, renders: int) -> dict:
+    """Runs in a fresh process: RSS before loading the generator, after `renders` renders, and the peak."""
+    import resource
+    from benchmarks.corpus import make_cv_data
+
+    samples = [make_cv_data(seed=seed, jobs=4, bullets_per_job=5) for seed in range(renders)]
+    before = _rss_mb()
+    from pdf_generator import PDFGenerator
+
+    generator = PDFGenerator()
+    for data in samples:
+        generator.render_pdf(data, template, backend)
+    after = _rss_mb()
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"renders": renders, "baseline_rss_mb": round(before, 1), "rss_mb": round(after, 1),
+            "peak_rss_mb": round(peak, 1), "growth_mb": round(after - before, 1)}
+
+
+def bench_memory(memory: Dict[str, dict], renders: int, weasyprint: bool = True):
+    """Peak memory per backend, each measured in its own spawned process so imports count."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from pdf_generator import TEMPLATES
+
+    context = multiprocessing.get_context("spawn")
+    for template, info in TEMPLATES.items():
+        for backend in info["backends"]:
+            if backend == "weasyprint" and not weasyprint:
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                memory[f"renderer.{backend}.{template}"] = executor.submit(
+                    _backend_memory, backend, template, renders).result()
+
+
+async def bench_endpoints(results: Dict[str, dict], repeat: int, render: bool):
+    import httpx
+    import main
+    from benchmarks.corpus import make_cv_data, make_cv_pdf
+
+    pdf_bytes = make_cv_pdf("2p_bullets")
+    if render:
+        # No lifespan here: start the render pool the way the warm-up would
+        main.render_pool.start()
+    files = {"file": ("cv.pdf", pdf_bytes, "application/pdf")}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results["endpoint.health"] = await measure_async(lambda: client.get("/health"), repeat)
+
+        async def analyze_uncached():
+            main.analysis_cache.clear()
+            return await client.post("/analyze", files=files)
+        results["endpoint.analyze"] = await measure_async(analyze_uncached, repeat)
+        results["endpoint.analyze.cached"] = await measure_async(
+            lambda: client.post("/analyze", files=files), repeat)
+
+        if render:
+            results["endpoint.templates"] = await measure_async(lambda: client.get("/templates"), repeat)
+            counter = iter(range(10 ** 9))
+            # A different CV each time so the render cache never answers
+            results["endpoint.generate_pdf"] = await measure_async(
+                lambda: client.post("/generate-pdf", json=make_cv_data(seed=next(counter))), repeat)
+            same = make_cv_data(seed=0)
+            results["endpoint.generate_pdf.cached"] = await measure_async(
+                lambda: client.post("/generate-pdf", json=same), repeat)
+    main.render_pool.shutdown()
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[dict]:
+    """Metrics whose p50 grew by more than threshold (and MIN_DELTA_MS) against the baseline."""
+    regressions = []
+    for name, current in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        delta = current["p50_ms"] - before["p50_ms"]
+        if delta > MIN_DELTA_MS and current["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            regressions.append({
+                "metric": name,
+                "baseline_p50_ms": before["p50_ms"],
+                "p50_ms": current["p50_ms"],
+                "change": round(current["p50_ms"] / before["p50_ms"] - 1, 3),
+            })
+    return regressions
+
+
+def print_table(results: Dict[str, dict]):
+    width = max(len(name) for name in results) if results else 10
+    print(f"{'metric':<{width}}  {'p50 ms':>9}  {'p95 ms':>9}  {'mean ms':>9}")
+    for name, r in sorted(results.items()):
+        print(f"{name:<{width}}  {r['p50_ms']:>9.2f}  {r['p95_ms']:>9.2f}  {r['mean_ms']:>9.2f}")
+
+
+def main(argv=None) -> int:
+    from benchmarks.corpus import PROFILES
+
+    parser = argparse.ArgumentParser(description="cvOS benchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--repeat", type=int, default=20, help="timed iterations per metric")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and corpus profiles (CI)")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p50 slowdown, 0.25 = 25%%")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="render pool size for endpoint runs (0 = render in-process)")
+    args = parser.parse_args(argv)
+
+    # Must be set before main/render_pool are imported
+    os.environ["CVOS_RENDER_WORKERS"] = str(args.render_workers)
+    repeat = 10 if args.quick else args.repeat
+    profiles = ["1p_plain", "3p_tables"] if args.quick else list(PROFILES)
+
+    results: Dict[str, dict] = {}
+    skipped: Dict[str, str] = {}
+    bench_analyzer(results, profiles, repeat)
+    bench_matcher(results, [1000, 5000] if args.quick else [1000, 10000, 30000], repeat)
+    memory: Dict[str, dict] = {}
+    render_error = weasyprint_error()
+    if render_error:
+        skipped["renderer.weasyprint"] = skipped["endpoint.templates"] = render_error
+        skipped["endpoint.generate_pdf"] = render_error
+    bench_renderer(results, repeat, weasyprint=render_error is None)
+    bench_memory(memory, 20 if args.quick else 100, weasyprint=render_error is None)
+    asyncio.run(bench_endpoints(results, repeat, render=render_error is None))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+        },
+        "skipped": skipped,
+        "results": results,
+        "memory": memory,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        report["regressions"] = regressions
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_table(results)
+    for name, m in sorted(memory.items()):
+        print(f"memory {name}: {m['rss_mb']} MB RSS, peak {m['peak_rss_mb']} MB "
+              f"(+{m['growth_mb']} MB over {m['renders']} renders)")
+    for name, reason in skipped.items():
+        print(f"skipped {name}: {reason}")
+    for r in regressions:
+        print(f"REGRESSION {r['metric']}: {r['baseline_p50_ms']} -> {r['p50_ms']} ms (+{r['change']:.0%})")
+    print(f"Results written to {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
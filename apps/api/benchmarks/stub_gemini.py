@@ -0,0 +1,122 @@
+"""
+Local stand-in for the Gemini API, for load tests.
+Answers the REST generateContent call the google-generativeai SDK makes, with
+configurable latency, jitter and error rate, so the /analyze-with-ai path can
+be exercised end to end (SDK, retries, timeouts) without a real key.
+
+Run from apps/api:
+    python -m benchmarks.stub_gemini --port 8089 --latency 0.8 --error-rate 0.02
+
+and start the API with:
+    CVOS_GEMINI_ENDPOINT=http://127.0.0.1:8089 GOOGLE_API_KEY=stub uvicorn main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANALYSIS = {
+    "score": 75,
+    "summary": "Respuesta simulada por el servidor de pruebas.",
+    "strengths": ["Experiencia relevante", "Logros medibles", "Formato claro"],
+    "weaknesses": ["Falta un resumen", "Pocas palabras clave", "Sin certificaciones"],
+    "keywords_detected": ["Python", "Docker", "AWS"],
+}
+
+
+class StubGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.8, jitter: float = 0.2, error_rate: float = 0.0,
+                 seed: int = 0):
+        super().__init__(address, StubGeminiHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self):
+        """(seconds to wait, whether to fail) for the next call; the random stream is seeded."""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.error_rate
+            self.errors += fail
+        return delay, fail
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors, "latency": self.latency,
+                "jitter": self.jitter, "error_rate": self.error_rate}
+
+
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.split("?")[0].endswith(":generateContent"):
+            return self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+        delay, fail = self.server.draw()
+        time.sleep(delay)
+        if fail:
+            return self._send(503, {"error": {"code": 503, "message": "The model is overloaded.",
+                                              "status": "UNAVAILABLE"}})
+        prompt_chars = len(body)
+        text = "```json\n" + json.dumps(CANNED_ANALYSIS, ensure_ascii=False) + "\n```"
+        self._send(200, {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {"promptTokenCount": prompt_chars // 4, "candidatesTokenCount": len(text) // 4},
+        })
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port: int = 0, **options) -> StubGeminiServer:
+    """Serve in a background thread; port 0 picks a free port (see server.url)."""
+    server = StubGeminiServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, name="stub-gemini", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Gemini stand-in for load tests")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.8, help="mean seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- seconds around the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    server = StubGeminiServer(("127.0.0.1", args.port), latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, seed=args.seed)
+    print(f"Stub Gemini listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
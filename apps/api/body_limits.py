@@ -0,0 +1,83 @@
+"""
+Request body limits for cvOS
+Content-Length alone doesn't bound an upload: chunked requests carry none,
+and multipart parsing spools the whole body to memory/disk before the
+endpoint runs. BodyLimitMiddleware counts body bytes as the app receives
+them and fails the request with 413 as soon as the route's limit is passed,
+without reading the rest.
+"""
+import logging
+from typing import Mapping
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+
+import metrics
+
+logger = logging.getLogger("body_limits")
+
+MB = 1024 * 1024
+
+
+class BodyTooLarge(HTTPException):
+    """
+    The body passed its route's limit. An HTTPException, so FastAPI's body
+    parsing re-raises it and the app answers 413 like any other HTTP error.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"La solicitud supera el límite de {round(limit / MB, 1):g} MB")
+        self.limit = limit
+
+
+class BodyLimitMiddleware:
+    """ASGI middleware enforcing `limits` (path -> max body bytes, read per request) on request bodies."""
+
+    def __init__(self, app, limits: Mapping[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if not limit:
+            return await self.app(scope, receive, send)
+        length = Headers(scope=scope).get("content-length", "")
+        if length.isdigit() and int(length) > limit:
+            # Declared too large: answer before reading any of it
+            return await self._reject(scope, receive, send, self._too_large(scope, limit))
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise self._too_large(scope, limit)
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge as e:
+            # Read outside FastAPI's error handling (e.g. while streaming the response)
+            if started:
+                raise
+            await self._reject(scope, receive, send, e)
+
+    @staticmethod
+    def _too_large(scope, limit: int) -> BodyTooLarge:
+        metrics.BODIES_REJECTED.inc(route=scope["path"])
+        logger.warning(f"Rejected {scope['path']} body over {limit} bytes")
+        return BodyTooLarge(limit)
+
+    @staticmethod
+    async def _reject(scope, receive, send, exc: BodyTooLarge):
+        from fastapi.responses import JSONResponse
+        await JSONResponse({"detail": exc.detail}, status_code=413)(scope, receive, send)
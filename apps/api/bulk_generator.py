@@ -0,0 +1,242 @@
+"""
+Bulk CV generation for cvOS
+Renders many CVs (a JSON array, or an NDJSON/CSV upload) with one template
+and streams them back as a ZIP archive, one PDF entry written as soon as each
+render finishes, followed by manifest.json listing the files and the records
+that failed.
+
+Records are read lazily and only `max_in_flight` renders run at once; each
+finished PDF goes straight to the response and is dropped, so memory follows
+max_in_flight, not the size of the batch. When the client reads slowly no new
+renders are started until it catches up.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from metrics import BYTES_TOTAL
+from render_pool import RENDER_WORKERS, RenderQueueFull
+
+logger = logging.getLogger("bulk_generator")
+
+BULK_MAX_RECORDS = int(os.getenv("CVOS_BULK_MAX_RECORDS", "1000"))
+BULK_MAX_IN_FLIGHT = int(os.getenv("CVOS_BULK_MAX_IN_FLIGHT", max(RENDER_WORKERS, 1) * 2))
+# Request body (JSON or the uploaded file), enforced while it is received
+BULK_MAX_BODY_BYTES = int(float(os.getenv("CVOS_BULK_MAX_BODY_MB", "20")) * 1024 * 1024)
+# Attempts when the render pool is full of other traffic, as for PDF jobs
+BULK_RENDER_ATTEMPTS = 5
+
+FORMATS = ("json", "ndjson", "csv")
+# CSV cells of these columns hold a JSON array (the same shape as in /generate-pdf)
+LIST_FIELDS = ("experience", "education", "certifications")
+
+# A parsed record, or the reason it could not be parsed (reported in the manifest)
+Record = Union[dict, Exception]
+RenderFn = Callable[[dict], Awaitable[bytes]]
+
+
+def records_format(filename: str, content_type: str = "") -> str:
+    """Input format of an upload, from its extension or content type ("json" when unknown)."""
+    name = (filename or "").lower()
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    return "json"
+
+
+def json_records(records: Iterable) -> Iterator[Record]:
+    for record in records:
+        yield record if isinstance(record, dict) else ValueError("Cada registro debe ser un objeto JSON")
+
+
+def ndjson_records(lines: Iterable[str]) -> Iterator[Record]:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"JSON inválido: {e}")
+            continue
+        yield from json_records([record])
+
+
+def csv_records(lines: Iterable[str]) -> Iterator[Record]:
+    """One record per row, keyed by the header row; empty cells are left out."""
+    for row in csv.DictReader(lines):
+        record = {}
+        try:
+            for field, value in row.items():
+                value = (value or "").strip() if isinstance(value, str) else value
+                if not field or not value:
+                    continue
+                if field in LIST_FIELDS:
+                    value = json.loads(value)
+                    if not isinstance(value, list):
+                        raise ValueError(f"La columna '{field}' debe ser un arreglo JSON")
+                record[field.strip()] = value
+        except ValueError as e:
+            yield ValueError(f"Fila inválida: {e}")
+            continue
+        yield record
+
+
+def read_records(fileobj: io.IOBase, fmt: str) -> Iterator[Record]:
+    """Records of an uploaded file, read lazily (a JSON array is loaded whole)."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        return csv_records(text)
+    if fmt == "ndjson":
+        return ndjson_records(text)
+    records = json.load(text)
+    if not isinstance(records, list):
+        raise ValueError("El archivo JSON debe contener un arreglo de registros")
+    return json_records(records)
+
+
+class ZipStream:
+    """
+    Write-only, non-seekable file for zipfile: collects what the archive
+    writes so it can be handed to the response in pieces (entries then use
+    data descriptors instead of seeking back to patch their headers).
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._written = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._written
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+_PATH_SEPARATORS = re.compile(r"[\\/]+")
+
+
+def entry_name(index: int, filename: str) -> str:
+    """Archive path of a record's PDF: numbered so equal names don't collide, never a directory."""
+    return f"{index + 1:04d}_{_PATH_SEPARATORS.sub('_', filename).lstrip('.')}"
+
+
+def _zip_info(name: str) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    # PDFs are compressed already; storing them keeps the stream cheap
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+async def _render_with_retries(render: RenderFn, record: dict) -> bytes:
+    for attempt in range(BULK_RENDER_ATTEMPTS):
+        try:
+            return await render(record)
+        except RenderQueueFull:
+            if attempt == BULK_RENDER_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(0.5 * (2 ** attempt))
+
+
+async def generate_bulk(records: Iterable[Record], render: RenderFn, filename: Callable[[dict], str],
+                        max_in_flight: int = BULK_MAX_IN_FLIGHT, max_records: int = BULK_MAX_RECORDS,
+                        manifest: Optional[dict] = None) -> AsyncIterator[bytes]:
+    """
+    Render every record and yield the ZIP archive in chunks, each holding the
+    PDFs that just finished (completion order), then manifest.json (`manifest`
+    adds fields to it). A record that fails never aborts the batch; one that can't be read
+    ends the input, and the manifest says so.
+    """
+    loop = asyncio.get_running_loop()
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED)
+    records = iter(records)
+    # future -> (index, record name, archive path)
+    pending: Dict[asyncio.Future, Tuple[int, str, str]] = {}
+    files, errors = [], []
+    index = 0
+    exhausted = truncated = False
+    input_error = None
+    started = time.perf_counter()
+
+    def launch(idx: int, record: Record):
+        if isinstance(record, Exception):
+            future = loop.create_future()
+            future.set_exception(record)
+            pending[future] = (idx, "", "")
+            return
+        future = asyncio.ensure_future(_render_with_retries(render, record))
+        pending[future] = (idx, str(record.get("fullName") or ""), entry_name(idx, filename(record)))
+
+    try:
+        while True:
+            while len(pending) < max_in_flight and not exhausted:
+                try:
+                    record = next(records, None)
+                except Exception as e:
+                    input_error = f"Error leyendo los registros: {e}"
+                    record = None
+                if record is None:
+                    exhausted = True
+                elif index >= max_records:
+                    exhausted = truncated = True
+                else:
+                    launch(index, record)
+                    index += 1
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: pending[f][0]):
+                idx, name, path = pending.pop(future)
+                try:
+                    pdf_bytes = future.result()
+                except Exception as e:
+                    errors.append({"index": idx, "name": name, "error": str(e) or type(e).__name__})
+                    continue
+                archive.writestr(_zip_info(path), pdf_bytes)
+                files.append({"index": idx, "name": name, "file": path, "bytes": len(pdf_bytes)})
+            chunk = stream.drain()
+            if chunk:
+                BYTES_TOTAL.inc(len(chunk), kind="bulk_out")
+                yield chunk
+    finally:
+        # Client went away: don't keep rendering for nobody
+        for future in pending:
+            future.cancel()
+
+    summary = {
+        **(manifest or {}),
+        "total": index,
+        "generated": len(files),
+        "failed": len(errors),
+        "truncated": truncated,
+        "max_records": max_records,
+        "input_error": input_error,
+        "seconds": round(time.perf_counter() - started, 3),
+        "files": sorted(files, key=lambda f: f["index"]),
+        "errors": sorted(errors, key=lambda e: e["index"]),
+    }
+    archive.writestr(_zip_info("manifest.json"), json.dumps(summary, ensure_ascii=False, indent=2))
+    archive.close()
+    chunk = stream.drain()
+    BYTES_TOTAL.inc(len(chunk), kind="bulk_out")
+    logger.info(f"Bulk generation: {len(files)}/{index} PDFs, {len(errors)} failed")
+    yield chunk
@@ -0,0 +1,286 @@
+"""
+Job matching for cvOS
+Scores a CV against job postings: "how well do I match this job?", for one
+posting or for hundreds at once.
+
+Postings are tokenized into a shared vocabulary and kept as a sparse TF-IDF
+matrix (one row per posting, rows L2-normalized), next to a binary matrix of
+the dictionary skills (keywords.json) each posting asks for. Scoring one CV is
+a single sparse matrix-vector product over the columns of the CV's terms, so
+the cost follows the postings that share terms with the CV rather than the
+size of the whole vocabulary. Matches come back ranked, with the skills and
+terms of each posting that the CV is missing.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from keyword_matcher import KeywordIndex, get_keyword_index, normalize_text
+from metrics import timed
+
+logger = logging.getLogger("job_matcher")
+
+# Optional JSON Lines file of postings loaded at startup: {"id", "title", "description", ...} per line
+JOB_POSTINGS_PATH = os.getenv("CVOS_JOB_POSTINGS_PATH") or None
+MAX_POSTING_CHARS = 20000
+# Postings held by the index, and the JSON size of each one's extra fields (returned with every match)
+MAX_POSTINGS = int(os.getenv("CVOS_MAX_POSTINGS", "50000"))
+MAX_POSTING_META_BYTES = 4096
+
+# Final score = 100 * (TEXT_WEIGHT * TF-IDF cosine + SKILL_WEIGHT * share of the posting's skills found)
+TEXT_WEIGHT = 0.6
+SKILL_WEIGHT = 0.4
+MISSING_TERMS = 10
+
+# Words like "c++", "c#", "node.js" stay whole; a trailing period does not
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a al algo como con de del el en entre es esta este hacer la las lo los mas o para pero por que se ser si sin
+sobre su sus tu un una uno y ya
+an and are as at be by for from has have in is it its of on or our that the their this to we will with you
+your years year experience team work trabajo equipo experiencia anos
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalized word tokens (accents stripped, stopwords and bare numbers dropped)."""
+    return [tok for tok in _TOKEN_RE.findall(normalize_text(text))
+            if len(tok) > 1 and tok not in STOPWORDS and not tok.isdigit()]
+
+
+class JobIndex:
+    """
+    Sparse TF-IDF index of job postings. add() appends postings; the matrices
+    are rebuilt on the next match() after a change, under a lock, and
+    matching itself only reads an immutable snapshot.
+    """
+
+    def __init__(self, keyword_index: Optional[KeywordIndex] = None, max_postings: int = MAX_POSTINGS):
+        self._keywords = keyword_index or get_keyword_index()
+        self.max_postings = max_postings
+        self._skill_ids = {skill: i for i, skill in enumerate(self._keywords.skills)}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.vocabulary: Dict[str, int] = {}
+        self._terms: List[str] = []
+        self.postings: List[dict] = []
+        self._ids: Dict[str, int] = {}
+        # Rows added since the last build: (term ids, term counts, skill ids)
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._counts = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._skills = sparse.csr_matrix((0, len(self._skill_ids)), dtype=np.float32)
+        self._snapshot = None
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+    def add(self, postings: Iterable[dict]) -> int:
+        """
+        Index postings: dicts with an "id" and a "description" (plus optional
+        "title"; any other fields are returned as-is with the matches).
+
+        Raises:
+            ValueError: a posting without id/description, an id already indexed,
+                extra fields over MAX_POSTING_META_BYTES, or more than max_postings in all
+        """
+        rows = []
+        metas = []
+        with self._lock:
+            seen = set()
+            for posting in postings:
+                posting_id = str(posting.get("id") or "")
+                description = posting.get("description")
+                if not posting_id or not isinstance(description, str):
+                    raise ValueError("Cada oferta necesita 'id' y 'description'")
+                if posting_id in self._ids or posting_id in seen:
+                    raise ValueError(f"La oferta '{posting_id}' ya está indexada")
+                seen.add(posting_id)
+                if len(self.postings) + len(seen) > self.max_postings:
+                    raise ValueError(f"El índice admite como máximo {self.max_postings} ofertas")
+                meta = {k: v for k, v in posting.items() if k != "description"} | {"id": posting_id}
+                if len(json.dumps(meta, ensure_ascii=False, default=str).encode("utf-8")) > MAX_POSTING_META_BYTES:
+                    raise ValueError(f"Los campos de la oferta '{posting_id}' superan {MAX_POSTING_META_BYTES} bytes")
+                text = f"{posting.get('title') or ''}\n{description[:MAX_POSTING_CHARS]}"
+                metas.append(meta)
+                rows.append(self._vectorize(text, grow=True))
+            for meta, row in zip(metas, rows):
+                self._ids[meta["id"]] = len(self.postings)
+                self.postings.append(meta)
+                self._pending.append(row)
+            if rows:
+                self._snapshot = None
+        return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _vectorize(self, text: str, grow: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Term ids and counts of a text (new terms join the vocabulary when grow=True), and its skill ids."""
+        counts, skill_ids = self._analyze(text)
+        return (*self._term_ids(counts, grow), skill_ids)
+
+    def _analyze(self, text: str) -> Tuple[Counter, np.ndarray]:
+        """Term counts and skill ids of a text. Reads no index state, so it runs without the lock."""
+        _, skills = self._keywords.find(text)
+        return Counter(tokenize(text)), np.array([self._skill_ids[s] for s in skills], dtype=np.int32)
+
+    def _term_ids(self, counts: Counter, grow: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """Vocabulary ids and counts of the terms; caller holds the lock."""
+        ids, values = [], []
+        for term, count in counts.items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                if not grow:
+                    continue
+                term_id = self.vocabulary[term] = len(self._terms)
+                self._terms.append(term)
+            ids.append(term_id)
+            values.append(count)
+        return np.array(ids, dtype=np.int32), np.array(values, dtype=np.float32)
+
+    def _build(self):
+        """Fold pending rows into the count matrices and recompute the TF-IDF weights."""
+        n_terms = len(self._terms)
+        counts = self._counts
+        skills = self._skills
+        if self._pending:
+            counts = sparse.vstack([_resize(counts, n_terms), _rows_matrix([r[:2] for r in self._pending], n_terms)],
+                                   format="csr")
+            skill_rows = [(ids, np.ones(len(ids), dtype=np.float32)) for _, _, ids in self._pending]
+            skills = sparse.vstack([skills, _rows_matrix(skill_rows, len(self._skill_ids))], format="csr")
+            self._counts, self._skills, self._pending = counts, skills, []
+
+        n_docs = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=n_terms)
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        weights = counts.copy()
+        # Sublinear tf: a term repeated ten times is not ten times as relevant
+        weights.data = (1 + np.log(weights.data)) * idf[weights.indices]
+        norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+        weights = sparse.diags(1 / np.maximum(norms, 1e-12)).dot(weights).tocsr().astype(np.float32)
+        skill_totals = np.asarray(skills.sum(axis=1)).ravel()
+        # CSC for scoring (slice the CV's columns), CSR for per-posting lookups
+        self._snapshot = (weights.tocsc(), weights, skills, skill_totals, idf, list(self.postings))
+        return self._snapshot
+
+    def build(self) -> dict:
+        """Build the matrices now instead of on the next match (startup warm-up)."""
+        with self._lock:
+            if self._snapshot is None:
+                self._build()
+        return self.stats()
+
+    def match(self, cv_text: str, top_k: int = 10, min_score: float = 0.0) -> List[dict]:
+        """
+        Rank postings for a CV.
+
+        Returns:
+            Up to top_k matches, best first: the posting fields plus score (0-100),
+            text_similarity, skill_coverage, matched_skills, missing_skills and
+            missing_keywords (the posting's highest-weight terms absent from the CV)
+        """
+        # The keyword pass over the CV is the slow part: outside the lock, so matches and add() don't queue on it
+        counts, cv_skill_ids = self._analyze(cv_text)
+        with self._lock:
+            snapshot = self._snapshot or self._build()
+            cv_ids, cv_counts = self._term_ids(counts, grow=False)
+        weights_csc, weights, skills, skill_totals, idf, postings = snapshot
+        # Terms that joined the vocabulary after the snapshot (a rejected add) have no column yet
+        known = cv_ids < weights.shape[1]
+        cv_ids, cv_counts = cv_ids[known], cv_counts[known]
+        if not postings or top_k <= 0:
+            return []
+
+        with timed("job_match"):
+            query = (1 + np.log(cv_counts)) * idf[cv_ids] if len(cv_ids) else cv_counts
+            norm = float(np.linalg.norm(query))
+            if norm:
+                similarity = weights_csc[:, cv_ids] @ (query / norm)
+            else:
+                similarity = np.zeros(len(postings), dtype=np.float32)
+            cv_skills = np.zeros(skills.shape[1], dtype=np.float32)
+            cv_skills[cv_skill_ids] = 1
+            matched = skills @ cv_skills
+            # Postings that ask for no dictionary skill are judged on text alone
+            coverage = np.divide(matched, skill_totals, out=similarity.astype(np.float32), where=skill_totals > 0)
+            scores = 100 * (TEXT_WEIGHT * similarity + SKILL_WEIGHT * coverage)
+
+            k = min(top_k, len(postings))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+        cv_terms = set(cv_ids.tolist())
+        cv_skill_set = set(cv_skill_ids.tolist())
+        results = []
+        for row in top:
+            score = float(scores[row])
+            if score < min_score:
+                break
+            results.append(self._explain(postings[row], row, weights, skills, cv_terms, cv_skill_set) | {
+                "score": round(score, 1),
+                "text_similarity": round(float(similarity[row]), 3),
+                "skill_coverage": round(float(coverage[row]), 3),
+            })
+        return results
+
+    def _explain(self, posting: dict, row: int, weights, skills, cv_terms: set, cv_skills: set) -> dict:
+        skill_ids = skills.indices[skills.indptr[row]:skills.indptr[row + 1]]
+        names = self._keywords.skills
+        start, end = weights.indptr[row], weights.indptr[row + 1]
+        order = np.argsort(-weights.data[start:end], kind="stable")
+        missing_terms = []
+        for term_id in weights.indices[start:end][order]:
+            if term_id not in cv_terms:
+                missing_terms.append(self._terms[term_id])
+                if len(missing_terms) == MISSING_TERMS:
+                    break
+        return {
+            **posting,
+            "matched_skills": [names[i] for i in sorted(skill_ids) if i in cv_skills],
+            "missing_skills": [names[i] for i in sorted(skill_ids) if i not in cv_skills],
+            "missing_keywords": missing_terms,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            nnz = self._counts.nnz + sum(len(ids) for ids, _, _ in self._pending)
+            return {"postings": len(self.postings), "vocabulary": len(self._terms), "nonzeros": int(nnz),
+                    "built": self._snapshot is not None}
+
+
+def _rows_matrix(rows: List[Tuple[np.ndarray, np.ndarray]], n_cols: int) -> sparse.csr_matrix:
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids, _ in rows], out=indptr[1:])
+    indices = np.concatenate([ids for ids, _ in rows]) if rows else np.zeros(0, dtype=np.int32)
+    data = np.concatenate([values for _, values in rows]) if rows else np.zeros(0, dtype=np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), n_cols), dtype=np.float32)
+
+
+def _resize(matrix: sparse.csr_matrix, n_cols: int) -> sparse.csr_matrix:
+    """The same rows with room for terms added to the vocabulary since."""
+    return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], n_cols))
+
+
+def load_postings(index: JobIndex, path: str) -> int:
+    """Add the postings of a JSON Lines file to the index."""
+    with open(path, encoding="utf-8") as f:
+        added = index.add(json.loads(line) for line in f if line.strip())
+    logger.info(f"Loaded {added} job postings from {path}")
+    return added
+
+
+def match_description(cv_text: str, description: str, title: str = "") -> dict:
+    """Score a CV against one job description that isn't in any index."""
+    index = JobIndex()
+    index.add([{"id": "job", "title": title, "description": description}])
+    return index.match(cv_text, top_k=1)[0]
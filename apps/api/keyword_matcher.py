@@ -0,0 +1,149 @@
+"""
+Keyword automaton for cvOS
+Aho-Corasick matcher over the multilingual section/skill dictionary in
+keywords.json. Matching is case- and accent-insensitive, respects word
+boundaries and runs in time linear in the text, however many terms there are.
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+KEYWORDS_PATH = os.getenv(
+    "CVOS_KEYWORDS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "keywords.json"),
+)
+
+_SPACES_RE = re.compile(r"[^\S\n]+")
+# Combining diacritical mark blocks left behind by NFKD decomposition
+_COMBINING_RE = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents and collapse runs of spaces (newlines are kept)."""
+    text = text.lower()
+    if not text.isascii():
+        text = _COMBINING_RE.sub("", unicodedata.normalize("NFKD", text))
+    return _SPACES_RE.sub(" ", text)
+
+
+class KeywordAutomaton:
+    """
+    Multi-pattern matcher. Each term carries a label; match() returns the
+    set of labels whose terms occur in the text as whole words.
+    """
+
+    def __init__(self, terms: Iterable[Tuple[str, object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (term length, label, needs left boundary, needs right boundary)
+        self._out: List[List[Tuple[int, object, bool, bool]]] = [[]]
+        self.size = 0
+        for term, label in terms:
+            self._add(normalize_text(term).strip(), label)
+        self._build_failure_links()
+        self._build_transitions()
+
+    def _add(self, term: str, label):
+        if not term:
+            return
+        state = 0
+        for ch in term:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(term), label, term[0].isalnum(), term[-1].isalnum()))
+        self.size += 1
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _build_transitions(self):
+        """Fold failure links into a full transition table: one dict lookup per character."""
+        alphabet = {ch for edges in self._goto for ch in edges}
+        self._delta: List[Dict[str, int]] = [dict() for _ in self._goto]
+        self._delta[0] = dict(self._goto[0])
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fallback = self._delta[self._fail[state]]
+            row = self._delta[state]
+            for ch in alphabet:
+                nxt = self._goto[state].get(ch)
+                if nxt is not None:
+                    row[ch] = nxt
+                    queue.append(nxt)
+                else:
+                    target = fallback.get(ch, 0)
+                    if target:
+                        row[ch] = target
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """Yield (start, end, label) for whole-word matches in already-normalized text."""
+        delta, out = self._delta, self._out
+        last = len(text) - 1
+        state = 0
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if not out[state]:
+                continue
+            for length, label, left, right in out[state]:
+                start = i - length + 1
+                if left and start > 0 and text[start - 1].isalnum():
+                    continue
+                if right and i < last and text[i + 1].isalnum():
+                    continue
+                yield start, i + 1, label
+
+    def match(self, text: str) -> Set:
+        """Labels found in raw text."""
+        return {label for _, _, label in self.iter_matches(normalize_text(text))}
+
+
+class KeywordIndex:
+    """Section and skill dictionaries compiled into one automaton."""
+
+    def __init__(self, config: dict):
+        # Changes whenever the dictionary does; part of the analysis cache version
+        self.digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+        self.sections: List[str] = list(config["sections"])
+        self.skills: List[str] = list(config.get("skills", {}))
+        terms = []
+        for section, by_language in config["sections"].items():
+            for words in by_language.values():
+                terms.extend((word, ("section", section)) for word in words)
+        for skill, words in config.get("skills", {}).items():
+            terms.extend((word, ("skill", skill)) for word in words)
+        self.automaton = KeywordAutomaton(terms)
+
+    def find(self, text: str) -> Tuple[List[str], List[str]]:
+        """Return (sections, skills) found in the text, in dictionary order."""
+        labels = self.automaton.match(text)
+        sections = [s for s in self.sections if ("section", s) in labels]
+        skills = [s for s in self.skills if ("skill", s) in labels]
+        return sections, skills
+
+
+@lru_cache(maxsize=None)
+def get_keyword_index(path: str = KEYWORDS_PATH) -> KeywordIndex:
+    """Build the keyword index once per process."""
+    with open(path, encoding="utf-8") as f:
+        return KeywordIndex(json.load(f))
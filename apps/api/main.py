@@ -1,17 +1,134 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from ats_checker import ATSAnalyzer
-from ai_service import AIService
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from ats_checker import MAX_PDF_BYTES, PDFTooLarge, analyze_pdf, analyzer_version, check_pdf_size, parse_pdf
+from analysis_cache import AI_CACHE_TTL, AnalysisCache, content_key
+from ai_service import AI_BACKEND, AIBusy, AIService, AITimeout, get_ai_service
+from render_pool import RenderPool, RenderQueueFull
+from render_cache import RenderCache
+from preview import CSP as PREVIEW_CSP, FORMATS as PREVIEW_FORMATS, PREVIEW_DPI, PreviewService
+from admission import AdmissionController, AdmissionMiddleware, Overloaded, trusted_tier
+from pdf_jobs import DONE, FAILED, JobQueueFull, PDFJobQueue
+from body_limits import BodyLimitMiddleware
+from batch_analyzer import (BATCH_MAX_BODY_BYTES, BATCH_MAX_FILES, analysis_budget, analyze_batch, analyze_document, run_analysis,
+                            shutdown_analysis_executor, warm_analysis_pool, zip_batch_items)
+from bulk_generator import BULK_MAX_BODY_BYTES, BULK_MAX_RECORDS, generate_bulk, json_records, read_records, records_format
+import metrics
+from profiler import PROFILE_BUFFER_SIZE, PROFILE_SAMPLE_RATE, is_admin, profile_call, profile_store, should_profile
+from warmup import WarmupState, start_warmup
+from keyword_matcher import get_keyword_index
+from worker_limits import CeilingExceeded, rss_bytes
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Awaitable, List, Optional
+from urllib.parse import quote
+import asyncio
+import hashlib
 import json
+import logging
 import os
+import uuid
+import zipfile
 from datetime import datetime
 
+# Cada línea de log lleva el ID del request que la produjo
+metrics.install_request_id_logging()
+logging.basicConfig(level=logging.INFO, format=metrics.LOG_FORMAT)
+
 # Version tracking - update this on each deployment
 API_VERSION = "2.1.0"
 DEPLOY_DATE = "2026-01-08"
 
-app = FastAPI(title="cvOS API", version=API_VERSION)
+# Optional directory where generated PDFs are also written (off by default)
+PDF_OUTPUT_DIR = os.getenv("CVOS_PDF_OUTPUT_DIR") or None
+
+# Margen para las cabeceras multipart (y campos como job_description) sobre MAX_PDF_BYTES
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Lote de ofertas de POST /postings: número de ofertas y tamaño del cuerpo
+MAX_POSTINGS_PER_REQUEST = int(os.getenv("CVOS_MAX_POSTINGS_PER_REQUEST", "1000"))
+POSTINGS_MAX_BODY_BYTES = int(float(os.getenv("CVOS_POSTINGS_MAX_BODY_MB", "16")) * 1024 * 1024)
+# Cuerpo máximo por ruta de upload; se cuenta mientras llega, con o sin Content-Length
+UPLOAD_LIMITS = {
+    "/analyze": MAX_PDF_BYTES + MULTIPART_OVERHEAD_BYTES,
+    "/analyze-with-ai": MAX_PDF_BYTES + MULTIPART_OVERHEAD_BYTES,
+    "/match": MAX_PDF_BYTES + MULTIPART_OVERHEAD_BYTES,
+    "/analyze-batch": BATCH_MAX_BODY_BYTES,
+    "/generate-bulk": BULK_MAX_BODY_BYTES,
+    "/postings": POSTINGS_MAX_BODY_BYTES,
+}
+
+# Warm worker processes for WeasyPrint rendering (CVOS_RENDER_WORKERS=0 renders in-process)
+render_pool = RenderPool()
+# Repeat downloads of the same CV are served from here (CVOS_RENDER_CACHE_*)
+render_cache = RenderCache()
+# Resultados de /analyze y /analyze-with-ai por hash del PDF (CVOS_ANALYSIS_CACHE_*)
+analysis_cache = AnalysisCache()
+ai_cache = AnalysisCache(ttl=AI_CACHE_TTL)
+# Generación asíncrona por jobs, con prioridad por plan (CVOS_JOB_*)
+pdf_jobs = PDFJobQueue(render=lambda data, template: get_pdf_generator().render_cv_async(
+    data, template=template, backend=data.get("backend")))
+# Vistas previas HTML/PNG del asistente, cacheadas por hash del contenido (CVOS_PREVIEW_*)
+previews = PreviewService(lambda: get_pdf_generator())
+# Límites de concurrencia y colas por ruta (CVOS_ADMIT_*); sin cupo se responde 503/429 al instante
+admission = AdmissionController()
+# Las rutas de render se admiten en el endpoint: el cupo cubre solo el render, no el envío
+TEMPLATE_ROUTES = ("/generate-pdf", "/preview")
+# Tiempos de importación y warm-up; /ready responde 200 cuando termina
+warmup_state = WarmupState()
+
+@lru_cache(maxsize=None)
+def get_pdf_generator():
+    """Process-wide PDFGenerator backed by the render pool and render cache."""
+    from pdf_generator import PDFGenerator
+    return PDFGenerator(engine=render_pool, cache=render_cache)
+
+@lru_cache(maxsize=None)
+def get_job_index():
+    """Índice de ofertas del proceso; carga CVOS_JOB_POSTINGS_PATH si está configurado."""
+    from job_matcher import JOB_POSTINGS_PATH, JobIndex, load_postings
+    index = JobIndex()
+    if JOB_POSTINGS_PATH:
+        load_postings(index, JOB_POSTINGS_PATH)
+    return index
+
+# Sin estos pasos la instancia no puede servir análisis ni PDFs: /ready sigue en 503 si alguno falla
+REQUIRED_WARMUP_STEPS = ("keyword_index", "render", "analysis_pool")
+
+def warm_render_path():
+    """Pool enabled: start and warm the workers. Otherwise warm templates and fonts in this process."""
+    if render_pool.enabled:
+        render_pool.start()
+        failed = [w for w in render_pool.warmup_report if "error" in w["templates"]]
+        if failed:
+            raise RuntimeError(f"render worker warm-up failed: {failed[0]['templates']['error']}")
+        return render_pool.warmup_report
+    return get_pdf_generator().warm_up()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # WeasyPrint only matters here when rendering in-process; the workers import their own
+    modules = ["fitz", "scipy.sparse"]
+    if not render_pool.enabled:
+        modules.append("weasyprint")
+    if AI_BACKEND == "gemini":
+        modules.append("google.generativeai")
+    start_warmup(warmup_state, {
+        "keyword_index": lambda: get_keyword_index().digest[:12],
+        "render": warm_render_path,
+        "analysis_pool": warm_analysis_pool,
+        "ai_service": lambda: get_ai_service().stats()["backend"],
+        "job_index": lambda: get_job_index().build(),
+    }, modules, required=REQUIRED_WARMUP_STEPS)
+    pdf_jobs.start()
+    yield
+    await pdf_jobs.stop()
+    render_pool.shutdown()
+    shutdown_analysis_executor()
+
+app = FastAPI(title="cvOS API", version=API_VERSION, lifespan=lifespan)
 
 # Configurar CORS para permitir peticiones desde el frontend (Vercel)
 origins = [
@@ -23,14 +140,45 @@ origins = [
     "*"  # Allow all for debugging
 ]
 
+# Antes que CORS para que las respuestas 503/429 también lleven cabeceras CORS
+app.add_middleware(AdmissionMiddleware, controller=admission, skip=TEMPLATE_ROUTES)
+# Uploads (JSON o spool multipart): se cortan con 413 en cuanto pasan el límite de su ruta
+app.add_middleware(BodyLimitMiddleware, limits=UPLOAD_LIMITS)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Cache", "X-AI-Degraded", "X-Request-ID", "X-Profile-ID", "Retry-After"],
 )
 
+@lru_cache(maxsize=None)
+def route_paths() -> frozenset:
+    return frozenset(route.path for route in app.routes)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Request ID (X-Request-ID), in-flight gauge and latency histogram per route."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = metrics.request_id_var.set(request_id)
+    # Rutas desconocidas se agrupan para no crear una serie por URL
+    route = request.url.path if request.url.path in route_paths() else "other"
+    metrics.REQUESTS_IN_FLIGHT.inc(route=route)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec(route=route)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route=route,
+                                        method=request.method, status=status)
+        metrics.request_id_var.reset(token)
+
 @app.get("/")
 def read_root():
     return {
@@ -42,75 +190,282 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    """Health check endpoint for Railway/monitoring."""
+    """Health check endpoint for Railway/monitoring (liveness: the process is up)."""
     return {
         "status": "healthy",
         "version": API_VERSION,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow().isoformat(),
+        # Ocupación por ruta: el balanceador puede desviar tráfico antes de que se rechace
+        "admission": admission.occupancy()
     }
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once the warm-up succeeded, 503 while it runs or if a required step failed."""
+    report = warmup_state.report()
+    if warmup_state.ready:
+        report["status"] = "ready"
+    else:
+        report["status"] = "failed" if report["finished"] else "warming_up"
+    return JSONResponse(report, status_code=200 if warmup_state.ready else 503)
+
 @app.get("/debug")
 def debug_info():
     """Debug endpoint to verify deployment state."""
     import weasyprint
     import inspect
+    from pdf_backends import PDF_BACKEND, WeasyPrintBackend
     from pdf_generator import PDFGenerator
     
-    gen = PDFGenerator()
-    method_source = inspect.getsource(gen.generate_cv)
+    method_source = inspect.getsource(WeasyPrintBackend.render)
     
     return {
         "api_version": API_VERSION,
         "pdf_generator_version": PDFGenerator.VERSION,
         "weasyprint_version": weasyprint.__version__,
-        "pdf_generator_uses_write_pdf_bytes": "pdf_bytes = html_doc.write_pdf()" in method_source,
-        "method_source_preview": method_source[:500]
+        "pdf_backend_override": PDF_BACKEND or None,
+        "pdf_generator_uses_write_pdf_bytes": "pdf_bytes = html_doc.write_pdf(" in method_source,
+        "method_source_preview": method_source[:500],
+        "render_workers": render_pool.workers,
+        "render_pool_started": render_pool.started,
+        "render_pool": render_pool.stats(),
+        "analysis_pool": analysis_budget.stats(),
+        "render_cache": render_cache.stats(),
+        "preview_cache": previews.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "ai_cache": ai_cache.stats(),
+        "ai_service": get_ai_service().stats(),
+        "pdf_jobs": pdf_jobs.stats(),
+        "startup": warmup_state.report(),
+        "profiling": {
+            "sample_rate": PROFILE_SAMPLE_RATE,
+            "buffer_size": PROFILE_BUFFER_SIZE,
+            "stored": len(profile_store.list()),
+        }
     }
 
+def require_admin(request: Request):
+    if not is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/debug/profiles")
+def list_profiles(request: Request):
+    """Recent request profiles, newest first (admin only)."""
+    require_admin(request)
+    return {"profiles": profile_store.list()}
+
+@app.get("/debug/profiles/{profile_id}")
+def download_profile(profile_id: int, request: Request, format: str = "pstats", sort: str = "cumulative"):
+    """
+    Download one profile (admin only).
+    format=pstats returns a file for `python -m pstats` / snakeviz; format=text the top functions.
+    """
+    require_admin(request)
+    record = profile_store.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Profile not found (expired from the buffer?)")
+    if format == "text":
+        try:
+            return PlainTextResponse(record.text(sort=sort))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        content=record.stats,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="cvos_{record.kind}_{record.id}.pstats"'},
+    )
+
+async def run_profiled(kind: str, label: str, run: Awaitable) -> tuple:
+    """
+    Espera `run`, que perfila el trabajo donde se ejecuta (un worker del pool,
+    con profile_call) y devuelve (resultado, perfil); guarda el perfil y
+    retorna (resultado, id del perfil).
+    """
+    result, captured = await run
+    return result, profile_store.add(kind, label, metrics.request_id_var.get(), captured)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage histograms, request gauges, byte counters, cache stats."""
+    metrics.set_cache_stats("render", render_cache.stats())
+    metrics.set_cache_stats("preview", previews.cache.stats())
+    metrics.set_cache_stats("analysis", analysis_cache.stats())
+    metrics.set_cache_stats("ai", ai_cache.stats())
+    metrics.WORKER_RSS.set(rss_bytes(), pool="api")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Lectura del upload por bloques: se corta en cuanto supera MAX_PDF_BYTES
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def check_upload_size(size: int):
+    try:
+        check_pdf_size(size)
+    except PDFTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def ceiling_error(e: CeilingExceeded) -> HTTPException:
+    """
+    Límite por job superado en un worker: solo falla esta solicitud y el pool se
+    recicla. 504 si fue el tiempo; 422 si fue la memoria, porque el contenido no
+    se puede procesar y reintentar no cambia nada (no es un cuerpo demasiado grande).
+    """
+    return HTTPException(status_code=422 if e.kind == "memory" else 504, detail=str(e))
+
+async def read_upload(file: UploadFile) -> bytes:
+    """Lee el PDF subido a memoria por bloques, con límite de tamaño, midiendo el tiempo y los bytes recibidos."""
+    if file.size is not None:
+        check_upload_size(file.size)
+    with metrics.timed("upload_read"):
+        chunks = []
+        received = 0
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            received += len(chunk)
+            check_upload_size(received)
+            chunks.append(chunk)
+        pdf_bytes = b"".join(chunks)
+    metrics.BYTES_TOTAL.inc(len(pdf_bytes), kind="upload")
+    return pdf_bytes
+
 @app.post("/analyze")
-async def analyze_cv(file: UploadFile = File(...)):
+async def analyze_cv(request: Request, response: Response, file: UploadFile = File(...)):
     """
     Endpoint para subir un PDF y recibir el análisis ATS.
     """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="El archivo debe ser un PDF")
 
-    # Guardar temporalmente el archivo para procesarlo
-    temp_filename = f"temp_{file.filename}"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # El PDF se procesa en memoria: sin archivos temporales ni colisiones de nombre
+    pdf_bytes = await read_upload(file)
+
+    # Mismo PDF + misma versión del analizador = mismo resultado
+    cache_key = content_key(pdf_bytes, analyzer_version())
+    # Un request perfilado siempre analiza: perfilar un acierto de caché no sirve
+    profiling = should_profile(request.headers)
+    cached = None if profiling else analysis_cache.get(cache_key)
+    if cached is not None:
+        response.headers["X-Cache"] = "HIT"
+        return cached
 
     try:
-        analyzer = ATSAnalyzer(temp_filename)
-        # Análisis básico
-        basic_result = analyzer.analyze()
+        # Análisis básico, fuera del event loop
+        if profiling:
+            basic_result, profile_id = await run_profiled(
+                "analyze", file.filename or "cv.pdf", run_analysis(profile_call, analyze_pdf, pdf_bytes))
+            response.headers["X-Profile-ID"] = str(profile_id)
+        else:
+            # En el pool de análisis: con límite por job y workers que se reciclan
+            basic_result = await run_analysis(analyze_pdf, pdf_bytes)
+        analysis_cache.put(cache_key, basic_result)
+        response.headers["X-Cache"] = "MISS"
         return basic_result
+    except PDFTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CeilingExceeded as e:
+        raise ceiling_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+
+def degraded_ai_result(local: dict, reason: str) -> dict:
+    """Resultado con la forma del análisis IA, construido con el ATSAnalyzer local."""
+    return {
+        "score": local.get("score", 0),
+        "summary": "El análisis con IA no está disponible en este momento. Mostramos el análisis ATS local.",
+        "strengths": local.get("strengths", []),
+        "weaknesses": local.get("issues", []) + local.get("improvements", []),
+        "keywords_detected": local.get("skills_found", []),
+        "degraded": True,
+        "degraded_reason": reason,
+        "truncated": local.get("truncated", False),
+    }
+
+@app.post("/postings")
+async def add_postings(postings: List[dict], request: Request):
+    """
+    Indexa ofertas de empleo para /match (solo admin): lista de {"id", "title", "description", ...}.
+    Los campos extra se devuelven tal cual con cada coincidencia.
+    """
+    require_admin(request)
+    if len(postings) > MAX_POSTINGS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_POSTINGS_PER_REQUEST} ofertas por solicitud")
+    try:
+        added = await asyncio.to_thread(get_job_index().add, postings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"added": added, **get_job_index().stats()}
+
+@app.get("/postings")
+def postings_stats():
+    """Tamaño del índice de ofertas."""
+    return get_job_index().stats()
+
+@app.delete("/postings")
+def clear_postings(request: Request):
+    """Vacía el índice de ofertas (solo admin)."""
+    require_admin(request)
+    get_job_index().clear()
+    return get_job_index().stats()
+
+@app.post("/match")
+async def match_cv(file: UploadFile = File(...), job_description: Optional[str] = Form(None),
+                   top_k: int = 10, min_score: float = 0.0):
+    """
+    Compara un CV con ofertas de empleo. Con job_description, contra esa oferta;
+    si no, contra todas las ofertas indexadas, ordenadas de mejor a peor, con las
+    habilidades y palabras clave que le faltan al CV en cada una.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="El archivo debe ser un PDF")
+    pdf_bytes = await read_upload(file)
+    try:
+        document = await run_analysis(parse_pdf, pdf_bytes)
+    except PDFTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CeilingExceeded as e:
+        raise ceiling_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if job_description:
+        from job_matcher import match_description
+        matches = [await asyncio.to_thread(match_description, document.text, job_description)]
+        searched = 1
+    else:
+        index = get_job_index()
+        matches = await asyncio.to_thread(index.match, document.text, max(1, min(top_k, 100)), min_score)
+        searched = len(index)
+    return {"matches": matches, "postings_searched": searched, "truncated": document.truncated}
 
 @app.post("/analyze-with-ai")
-async def analyze_cv_ai(file: UploadFile = File(...)):
+async def analyze_cv_ai(response: Response, file: UploadFile = File(...)):
     """
     Endpoint Premium: Sube un PDF y usa IA para un análisis profundo.
     """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="El archivo debe ser un PDF")
 
-    temp_filename = f"temp_ai_{file.filename}"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    pdf_bytes = await read_upload(file)
+
+    # Un PDF ya analizado por la IA no vuelve a llamar a Gemini
+    cache_key = content_key(pdf_bytes, f"ai-{AIService.PROMPT_VERSION}-{AIService.MODEL_NAME}")
+    cached = ai_cache.get(cache_key)
+    if cached is not None:
+        response.headers["X-Cache"] = "HIT"
+        return cached
+    response.headers["X-Cache"] = "MISS"
 
     try:
-        # 1. Extraer texto usando el ATSAnalyzer existente
-        analyzer = ATSAnalyzer(temp_filename)
-        text = analyzer._extract_text()
+        # 1. Leer el PDF una sola vez: el prompt y el análisis local usan el mismo documento
+        document = await run_analysis(parse_pdf, pdf_bytes)
+        # La IA solo ve los primeros MAX_PROMPT_CHARS (cortados en fin de línea); la respuesta indica si se dejó texto fuera
+        truncated = document.truncated or len(document.text) > AIService.MAX_PROMPT_CHARS
         
-        # 2. Enviar a Gemini AI
-        ai_service = AIService()
-        ai_result_str = ai_service.analyze_cv(text)
+        # 2. Enviar a Gemini AI (servicio compartido, con límite de concurrencia y timeout)
+        try:
+            ai_result_str = await get_ai_service().analyze_cv_async(document.head(AIService.MAX_PROMPT_CHARS))
+        except (AIBusy, AITimeout) as e:
+            # Respuesta degradada y rápida: el análisis ATS local en lugar de esperar a la IA
+            response.headers["X-AI-Degraded"] = "1"
+            return degraded_ai_result(await run_analysis(analyze_document, document), str(e))
         
         # 3. Parsear respuesta (asumiendo que Gemini devuelve JSON string válido)
         try:
@@ -118,20 +473,67 @@ async def analyze_cv_ai(file: UploadFile = File(...)):
                  return ai_result_str # Retornar error directo
             
             ai_data = json.loads(ai_result_str)
+            if isinstance(ai_data, dict):
+                ai_data["truncated"] = truncated
+            ai_cache.put(cache_key, ai_data)
             return ai_data
         except json.JSONDecodeError:
             # Fallback si no es JSON válido
             return {
-                "score": analyzer.analyze().get("score", 0),
+                "score": (await run_analysis(analyze_document, document)).get("score", 0),
                 "summary": "La IA generó un reporte no estructurado.",
-                "raw_analysis": ai_result_str
+                "raw_analysis": ai_result_str,
+                "truncated": truncated
             }
 
+    except PDFTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except CeilingExceeded as e:
+        raise ceiling_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+
+@app.post("/analyze-batch")
+async def analyze_cv_batch(request: Request):
+    """
+    Endpoint para agencias: recibe muchos PDFs en el campo multipart "files"
+    (o uno o varios .zip con PDFs) y responde NDJSON, una línea por CV en
+    cuanto termina su análisis.
+    """
+    # El formulario se lee a mano: FastAPI cerraría los UploadFile antes de
+    # que termine el streaming. Se cierra al final de ndjson().
+    form = await request.form(max_files=BATCH_MAX_FILES + 1)
+    items = []
+    try:
+        for upload in form.getlist("files"):
+            if isinstance(upload, str):
+                continue
+            is_zip = upload.content_type in ("application/zip", "application/x-zip-compressed") \
+                or (upload.filename or "").lower().endswith(".zip")
+            if is_zip:
+                try:
+                    items.extend(zip_batch_items(upload.file))
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"ZIP inválido: {upload.filename}")
+            else:
+                items.append((upload.filename or f"file_{len(items)}", upload.read))
+        
+        if not items:
+            raise HTTPException(status_code=400, detail="No se recibieron PDFs")
+        if len(items) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_FILES} archivos por lote")
+    except BaseException:
+        await form.close()
+        raise
+    
+    async def ndjson():
+        try:
+            async for entry in analyze_batch(items, cache=analysis_cache):
+                yield json.dumps(entry, ensure_ascii=False) + "\n"
+        finally:
+            await form.close()
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 @app.get("/templates")
 def list_templates():
@@ -144,37 +546,233 @@ def list_templates():
         ]
     }
 
+def cv_filename(data: dict) -> str:
+    return f"cv_{str(data.get('fullName') or 'unknown').replace(' ', '_')}.pdf"
+
+def pdf_response(request: Request, pdf_bytes: bytes, filename: str) -> Response:
+    """
+    Send PDF bytes straight from memory with a strong ETag.
+    Answers 304 when the client already holds the same document.
+    """
+    etag = f'"{hashlib.sha256(pdf_bytes).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers={"ETag": etag})
+    metrics.BYTES_TOTAL.inc(len(pdf_bytes), kind="pdf_out")
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
 @app.post("/generate-pdf")
-async def generate_pdf(data: dict):
+async def generate_pdf(data: dict, request: Request):
     """
     Generate CV PDF based on form data.
-    Accepts optional 'template' field in data: 'classic', 'modern', 'executive'.
+    Accepts optional 'template' field in data: 'classic', 'modern', 'executive',
+    and optional 'backend': 'weasyprint' or 'mupdf' (más rápido; solo plantillas que lo soportan).
+    The PDF is returned from memory; set CVOS_PDF_OUTPUT_DIR to also keep a copy on disk.
     """
-    from pdf_generator import PDFGenerator
-    from fastapi.responses import FileResponse
-    import uuid
-    
     try:
-        generator = PDFGenerator()
+        generator = get_pdf_generator()
         
         # Get template from request data (default: classic)
         template = data.get('template', 'classic')
+        backend = data.get('backend')
         
-        # Generate filename
-        filename = f"cv_{data.get('fullName', 'unknown').replace(' ', '_')}_{uuid.uuid4().hex[:8]}.pdf"
-        output_path = f"/tmp/{filename}"
+        # Generate PDF with selected template (rendered off the event loop).
+        # Profiled requests skip the cache; the worker that renders them profiles the render.
+        profile_id = None
+        # Cupo de render según el plan verificado por el gateway; sin cupo, 503/429 con Retry-After
+        async with admission.admit("/generate-pdf", trusted_tier(request.headers)):
+            if should_profile(request.headers):
+                template = generator.resolve_template(template)
+                backend = generator.resolve_backend(template, backend)
+                if generator.engine is not None and generator.engine.enabled:
+                    rendering = generator.engine.render_profiled_async(data, template, backend)
+                else:
+                    rendering = asyncio.to_thread(profile_call, generator.render_pdf, data, template, backend)
+                pdf_bytes, profile_id = await run_profiled("render", f"{template}/{backend}", rendering)
+            else:
+                pdf_bytes = await generator.render_cv_async(data, template=template, backend=backend)
         
-        # Generate PDF with selected template
-        generator.generate_cv(data, output_path, template=template)
+        filename = cv_filename(data)
+        if PDF_OUTPUT_DIR:
+            output_path = os.path.join(PDF_OUTPUT_DIR, f"{filename[:-4]}_{uuid.uuid4().hex[:8]}.pdf")
+            await asyncio.to_thread(generator.save_pdf, pdf_bytes, output_path)
         
-        return FileResponse(
-            path=output_path,
-            filename=filename,
-            media_type="application/pdf"
-        )
+        response = pdf_response(request, pdf_bytes, filename)
+        if profile_id is not None:
+            response.headers["X-Profile-ID"] = str(profile_id)
+        return response
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except RenderQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except CeilingExceeded as e:
+        raise ceiling_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generando PDF: {str(e)}")
 
+@app.post("/preview")
+async def preview_cv(data: dict, request: Request, format: str = "html", dpi: int = PREVIEW_DPI):
+    """
+    Vista previa rápida para el asistente del dashboard. Mismo cuerpo que /generate-pdf.
+    format=html devuelve el HTML con estilos (sin WeasyPrint); format=png la primera
+    página en baja resolución. Las vistas previas se cachean por hash del contenido
+    y se responde 304 si el cliente ya tiene la misma (If-None-Match).
+    """
+    if format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {format} (html o png)")
+    template = data.get('template', 'classic')
+    try:
+        async with admission.admit("/preview", trusted_tier(request.headers)):
+            content, key = await previews.preview(data, template, format, dpi)
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except RenderQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generando vista previa: {str(e)}")
+    
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if format == "html":
+        headers["Content-Security-Policy"] = PREVIEW_CSP
+    if etag in (tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    media_type = "text/html; charset=utf-8" if format == "html" else "image/png"
+    return Response(content=content, media_type=media_type, headers=headers)
+
+def job_links(job_id: str) -> dict:
+    return {
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "download_url": f"/jobs/{job_id}/download",
+    }
+
+def get_job_or_404(job_id: str):
+    job = pdf_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado o expirado")
+    return job
+
+@app.post("/jobs/generate-pdf", status_code=202)
+async def submit_pdf_job(data: dict, request: Request):
+    """
+    Encola la generación de un PDF y responde al instante con el id del job.
+    Mismo cuerpo que /generate-pdf. 429 con Retry-After si la cola del plan está llena.
+    """
+    template = data.get('template', 'classic')
+    try:
+        job = pdf_jobs.submit(data, template, trusted_tier(request.headers), filename=cv_filename(data))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return {**job.to_dict(), **job_links(job.id)}
+
+@app.get("/jobs/{job_id}")
+def pdf_job_status(job_id: str):
+    """Estado de un job: queued, running, done o failed."""
+    job = get_job_or_404(job_id)
+    return {**job.to_dict(), **job_links(job.id)}
+
+@app.get("/jobs/{job_id}/events")
+async def pdf_job_events(job_id: str):
+    """Server-sent events: un evento 'status' por cada cambio, hasta que el job termina."""
+    job = get_job_or_404(job_id)
+    
+    async def stream():
+        # Si el cliente se desconecta, StreamingResponse cancela este generador
+        while True:
+            sent = job.to_dict()
+            yield f"event: status\ndata: {json.dumps(sent)}\n\n"
+            if sent["status"] in (DONE, FAILED):
+                return
+            # El estado puede haber cambiado mientras se enviaba el evento
+            if job.status == sent["status"] and not await job.wait_for_change(timeout=15):
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/download")
+def download_pdf_job(job_id: str, request: Request):
+    """Descarga el PDF de un job terminado (409 mientras sigue en cola o generándose)."""
+    job = get_job_or_404(job_id)
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=job.error or f"El job está '{job.status}'")
+    return pdf_response(request, job.pdf_bytes, job.filename)
+
+@app.post("/generate-bulk")
+async def generate_bulk_pdfs(request: Request, template: Optional[str] = None, backend: Optional[str] = None):
+    """
+    Generación masiva para el plan Business (plan verificado por el gateway): muchos CVs
+    con la misma plantilla, devueltos como un ZIP que se envía a medida que
+    termina cada PDF, con manifest.json al final (archivos y registros fallidos).
+    Cuerpo JSON {"records": [...], "template", "backend"} (o el arreglo solo), o
+    multipart con el archivo en el campo "file" (.json, .ndjson/.jsonl o .csv;
+    en CSV las columnas experience/education/certifications van como arreglos
+    JSON) y los campos "template" y "backend".
+    """
+    if trusted_tier(request.headers) != "business":
+        raise HTTPException(status_code=403, detail="La generación masiva está disponible en el plan Business")
+    
+    # Como en /analyze-batch, el formulario se cierra al terminar el streaming
+    form = None
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Falta el archivo de registros (campo 'file')")
+            template = form.get("template") or template
+            backend = form.get("backend") or backend
+            try:
+                records = read_records(upload.file, records_format(upload.filename, upload.content_type or ""))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Archivo de registros inválido: {e}")
+        else:
+            try:
+                body = await request.json()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="JSON inválido")
+            if isinstance(body, dict):
+                template = body.get("template") or template
+                backend = body.get("backend") or backend
+                body = body.get("records")
+            if not isinstance(body, list) or not body:
+                raise HTTPException(status_code=400, detail="Se esperaba una lista de registros")
+            if len(body) > BULK_MAX_RECORDS:
+                raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_RECORDS} registros por lote")
+            records = json_records(body)
+    except BaseException:
+        if form is not None:
+            await form.close()
+        raise
+    
+    generator = get_pdf_generator()
+    template = generator.resolve_template(template or "classic")
+    backend = generator.resolve_backend(template, backend)
+    
+    async def stream():
+        try:
+            async for chunk in generate_bulk(
+                    records, lambda data: generator.render_cv_async(data, template=template, backend=backend,
+                                                                     use_cache=False),
+                    cv_filename, manifest={"template": template, "backend": backend}):
+                yield chunk
+        finally:
+            if form is not None:
+                await form.close()
+    
+    return StreamingResponse(stream(), media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="cvs.zip"'})
+
+warmup_state.app_import_seconds = round(time.perf_counter() - _import_started, 4)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,232 @@
+"""
+Metrics for cvOS
+Latency histograms per processing stage, request gauges and byte counters,
+exported in the Prometheus text format by GET /metrics. Also carries the
+request ID of the current request so every log line can include it.
+
+Recording is a perf_counter pair plus a bucket increment under a lock; it
+is cheap enough to leave on in production.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers a cached answer (~1ms) up to a slow Gemini call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, [list(e[0]), e[1], e[2]]) for key, e in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "cvos_stage_seconds", "Time spent in each processing stage.", ["stage"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "cvos_request_seconds", "HTTP request latency.", ["route", "method", "status"]))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "cvos_requests_in_flight", "HTTP requests currently being served.", ["route"]))
+BYTES_TOTAL = REGISTRY.register(Counter(
+    "cvos_bytes_total", "Bytes received in uploads and sent as generated PDFs.", ["kind"]))
+ADMISSION_SHED = REGISTRY.register(Counter(
+    "cvos_admission_shed_total", "Requests rejected by admission control.", ["route", "reason"]))
+CACHE_STATS = REGISTRY.register(Gauge(
+    "cvos_cache", "Cache counters (hits, misses, evictions, entries, bytes).", ["cache", "stat"]))
+WORKER_RSS = REGISTRY.register(Gauge(
+    "cvos_worker_rss_bytes", "Resident memory of the API process and of the largest worker of each pool.", ["pool"]))
+WORKER_RECYCLES = REGISTRY.register(Counter(
+    "cvos_worker_recycles_total", "Worker pools replaced after reaching their job or memory budget.",
+    ["pool", "reason"]))
+CEILING_HITS = REGISTRY.register(Counter(
+    "cvos_job_ceiling_hits_total", "Jobs failed for exceeding the per-job time or memory ceiling.", ["pool", "kind"]))
+BODIES_REJECTED = REGISTRY.register(Counter(
+    "cvos_bodies_rejected_total", "Requests rejected for a body over their route's size limit.", ["route"]))
+AI_REQUESTS = REGISTRY.register(Counter(
+    "cvos_ai_requests_total", "AI analyses coalesced onto another call, rejected at capacity, or abandoned on timeout.",
+    ["outcome"]))
+AI_SLOTS = REGISTRY.register(Gauge(
+    "cvos_ai_requests", "AI analyses holding a model slot (in_flight) or queued for one (waiting).", ["state"]))
+
+# Stage timings of the current task, when a worker process is collecting them for the parent
+_captured: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "cvos_captured_stages", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    captured = _captured.get()
+    if captured is not None:
+        captured.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record how long the block takes under cvos_stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def capture_stages() -> Iterator[List[Tuple[str, float]]]:
+    """
+    Collect the stage timings recorded inside the block. Worker processes
+    return them so the API process can record them with record_stages().
+    """
+    stages: List[Tuple[str, float]] = []
+    token = _captured.set(stages)
+    try:
+        yield stages
+    finally:
+        _captured.reset(token)
+
+
+def record_stages(stages: Sequence[Tuple[str, float]]):
+    for stage, seconds in stages:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def set_cache_stats(cache: str, stats: dict):
+    for stat, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            CACHE_STATS.set(value, cache=cache, stat=stat)
+
+
+# Request ID of the request being served; "-" outside a request
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("cvos_request_id", default="-")
+
+LOG_FORMAT = "%(levelname)s:%(name)s:[%(request_id)s] %(message)s"
+
+
+def install_request_id_logging():
+    """Give every log record a request_id attribute (usable as %(request_id)s in formats)."""
+    previous = logging.getLogRecordFactory()
+    if getattr(previous, "_cvos_request_id", False):
+        return
+
+    def factory(*args, **kwargs):
+        record = previous(*args, **kwargs)
+        record.request_id = request_id_var.get()
+        return record
+
+    factory._cvos_request_id = True
+    logging.setLogRecordFactory(factory)
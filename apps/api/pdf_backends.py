@@ -0,0 +1,88 @@
+"""
+PDF backends for cvOS
+PDFGenerator renders the Jinja template to HTML and hands it to a backend for
+layout:
+  - weasyprint: full CSS (flexbox, @page rules); the reference output, but
+    layout dominates render time and needs the Pango/Cairo stack
+  - mupdf: PyMuPDF's Story engine, already loaded for ATS analysis; several
+    times faster and far lighter, but with a smaller CSS subset (no flexbox,
+    no text-transform), so it is only offered for templates that look right
+    with it (see TEMPLATES[...]["backends"])
+"""
+import io
+import logging
+import os
+
+from metrics import timed
+
+logger = logging.getLogger("pdf_backends")
+
+# Preferred backend for every template that supports it; per-request choices override it
+PDF_BACKEND = os.getenv("CVOS_PDF_BACKEND", "")
+
+
+class PDFBackend:
+    """Lays out rendered template HTML into PDF bytes."""
+
+    name = ""
+
+    def render(self, generator, html_content: str, template: str) -> bytes:
+        raise NotImplementedError
+
+
+class WeasyPrintBackend(PDFBackend):
+    name = "weasyprint"
+
+    def render(self, generator, html_content: str, template: str) -> bytes:
+        # WeasyPrint is imported on first use; warm_up() pays for it at startup
+        from weasyprint import HTML
+        stylesheet, font_config = generator.stylesheet(template)
+        with timed("write_pdf"):
+            html_doc = HTML(string=html_content, base_url=generator.template_path)
+            pdf_bytes = html_doc.write_pdf(stylesheets=[stylesheet], font_config=font_config)
+        return pdf_bytes
+
+
+class MuPDFBackend(PDFBackend):
+    """
+    PyMuPDF Story layout. Story ignores @page, so the page box comes from
+    here (A4 with 2cm margins, as in the stylesheets), and STORY_CSS patches
+    what its CSS subset lacks on top of the template's own stylesheet.
+    """
+
+    name = "mupdf"
+    PAPER = "a4"
+    MARGIN = 2 / 2.54 * 72
+
+    # No flexbox (nor floats on inline boxes): right-align the dates on their own
+    # line and pull them up beside the title, like justify-content: space-between
+    STORY_CSS = """
+.item-date { display: block; text-align: right; margin-top: -16px; }
+"""
+
+    def render(self, generator, html_content: str, template: str) -> bytes:
+        import fitz
+
+        css = generator.css_source(template) + self.STORY_CSS
+        mediabox = fitz.paper_rect(self.PAPER)
+        where = mediabox + (self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        buffer = io.BytesIO()
+        with timed("story_layout"):
+            story = fitz.Story(html=html_content, user_css=css, archive=generator.template_path)
+            writer = fitz.DocumentWriter(buffer)
+            more = True
+            while more:
+                device = writer.begin_page(mediabox)
+                more, _ = story.place(where)
+                story.draw(device)
+                writer.end_page()
+            writer.close()
+        return buffer.getvalue()
+
+
+BACKENDS = {backend.name: backend for backend in (WeasyPrintBackend(), MuPDFBackend())}
+DEFAULT_BACKEND = WeasyPrintBackend.name
+
+
+def get_backend(name: str) -> PDFBackend:
+    return BACKENDS[name]
@@ -1,74 +1,356 @@
 """
 PDF Generator for cvOS
-Version: 2.2.0 (2026-01-08)
+Version: 2.3.1 (2026-10-18)
 Supports multiple templates: classic (free), modern (pro), executive (business)
 """
-from weasyprint import HTML
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from metrics import timed
+from pdf_backends import BACKENDS, DEFAULT_BACKEND, PDF_BACKEND, get_backend
+from render_cache import render_key
+import asyncio
+import hashlib
 import os
 import logging
+import stat
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("pdf_generator")
 
-# Available templates with their tier requirements
+# Dev mode: template and stylesheet edits are picked up without a restart
+DEV_MODE = os.getenv("CVOS_DEV_MODE", "0") == "1"
+# Compiled Jinja bytecode, shared by the API process and render workers. Unset: Jinja's own
+# per-user directory (created 0700, ownership checked); "" disables it. Loading bytecode
+# runs it, so a directory other users can write to is never used
+JINJA_CACHE_DIR = os.getenv("CVOS_JINJA_CACHE_DIR")
+
+# Available templates with their tier requirements; "css" lives in templates/css/.
+# "backends" are the PDF backends (pdf_backends.py) the template renders correctly with, default first
 TEMPLATES = {
-    "classic": {"file": "cv_classic.html", "tier": "free", "name": "Classic"},
-    "modern": {"file": "cv_modern.html", "tier": "pro", "name": "Modern"},
-    "executive": {"file": "cv_executive.html", "tier": "business", "name": "Executive"}
+    "classic": {"file": "cv_classic.html", "css": "cv_classic.css", "tier": "free", "name": "Classic",
+                "backends": ("weasyprint", "mupdf")},
+    "modern": {"file": "cv_modern.html", "css": "cv_modern.css", "tier": "pro", "name": "Modern",
+               "backends": ("weasyprint",)},
+    "executive": {"file": "cv_executive.html", "css": "cv_executive.css", "tier": "business", "name": "Executive",
+                  "backends": ("weasyprint",)}
+}
+
+
+class _Styles(threading.local):
+    """
+    Parsed stylesheets and the FontConfiguration they were parsed with.
+    Per thread: WeasyPrint's font map must not be shared across threads
+    (render workers have one thread; in-process renders run in a thread pool).
+    """
+
+    def __init__(self):
+        self.font_config = None
+        # css path -> (mtime, weasyprint.CSS)
+        self.sheets = {}
+
+
+_styles = _Styles()
+
+
+def _check_private_dir(path: str):
+    """Raise RuntimeError unless path is a real directory owned by this user and writable only by it."""
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise RuntimeError(f"{path} is not a directory")
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is owned by another user")
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError(f"{path} is writable by other users")
+
+
+def _bytecode_cache(version: str):
+    if JINJA_CACHE_DIR == "":
+        return None
+    # Entries are only checked against the template source, but the compiled code also depends
+    # on Environment options (autoescape): keep each generator version's bytecode apart
+    pattern = f"__jinja2_{version}_%s.cache"
+    try:
+        if JINJA_CACHE_DIR is None:
+            return FileSystemBytecodeCache(pattern=pattern)
+        os.makedirs(JINJA_CACHE_DIR, mode=0o700, exist_ok=True)
+        _check_private_dir(JINJA_CACHE_DIR)
+    except (OSError, RuntimeError) as e:
+        logger.warning(f"Jinja bytecode cache disabled: {e}")
+        return None
+    return FileSystemBytecodeCache(JINJA_CACHE_DIR, pattern)
+
+# Throwaway CV rendered by warm_up(): touches every section so fonts and styles get loaded
+WARMUP_DATA = {
+    "fullName": "Warm Up",
+    "title": "Software Engineer",
+    "email": "warmup@example.com",
+    "phone": "+57 300 000 0000",
+    "location": "Bogotá, Colombia",
+    "summary": "Perfil profesional de prueba con acentos: áéíóú ñ.",
+    "experience": [{"company": "cvOS", "position": "Engineer", "startDate": "2020", "endDate": "2024",
+                    "description": "• Logro uno\n• Logro dos"}],
+    "education": [{"institution": "Universidad", "degree": "Ingeniería", "startDate": "2014", "endDate": "2019"}],
+    "skills": "Python, FastAPI",
+    "languages": "Español, English",
+    "certifications": [{"name": "Cert", "issuer": "Issuer", "date": "2023"}],
 }
 
 class PDFGenerator:
-    """Generate CV PDFs from structured data using WeasyPrint."""
+    """Generate CV PDFs from structured data (WeasyPrint by default, see pdf_backends)."""
     
-    VERSION = "2.2.0"
+    VERSION = "2.3.1"
     
-    def __init__(self, template_dir: str = "templates"):
+    def __init__(self, template_dir: str = "templates", engine=None, cache=None):
+        """
+        Args:
+            template_dir: Directory (relative to this file) holding the templates
+            engine: Optional RenderPool; when set, WeasyPrint layout runs in its
+                worker processes instead of the calling thread
+            cache: Optional RenderCache; repeat renders of the same data and
+                template are served from it
+        """
         logger.info(f"Initializing PDFGenerator v{self.VERSION}")
         base_dir = os.path.dirname(os.path.abspath(__file__))
         template_path = os.path.join(base_dir, template_dir)
-        self.env = Environment(loader=FileSystemLoader(template_path))
+        # Without DEV_MODE templates are compiled once and never re-checked on disk.
+        # CV fields are user input and the HTML is served by /preview: escape it
+        self.env = Environment(
+            loader=FileSystemLoader(template_path),
+            autoescape=select_autoescape(["html"]),
+            bytecode_cache=_bytecode_cache(self.VERSION),
+            auto_reload=DEV_MODE,
+        )
         self.template_path = template_path
+        self.css_path = os.path.join(template_path, "css")
+        self.engine = engine
+        self.cache = cache
+        self._template_digests = {}
+        self._compiled = {}
+        self._css_sources = {}
 
     def get_available_templates(self) -> dict:
         """Return dict of available templates with metadata."""
         return TEMPLATES
 
-    def generate_cv(self, data: dict, output_path: str, template: str = "classic") -> str:
+    def warm_up(self, render: bool = True) -> dict:
         """
-        Generate PDF from CV data using specified template.
+        Compile every template and, with render=True, render a throwaway CV per
+        template and backend so WeasyPrint's import, font discovery and caches
+        are paid here instead of by the first request.
+        
+        Returns:
+            Seconds spent per template
+        """
+        timings = {}
+        for template, info in TEMPLATES.items():
+            start = time.perf_counter()
+            self._get_template(info["file"])
+            if render:
+                for backend in info["backends"]:
+                    self.render_pdf(WARMUP_DATA, template, backend)
+            timings[template] = round(time.perf_counter() - start, 4)
+        logger.info(f"PDFGenerator warmed up: {timings}")
+        return timings
+
+    def resolve_template(self, template: str) -> str:
+        """Return a valid template id, falling back to 'classic'."""
+        if template not in TEMPLATES:
+            logger.warning(f"Unknown template '{template}', falling back to 'classic'")
+            return "classic"
+        return template
+
+    def resolve_backend(self, template: str, backend: str = None) -> str:
+        """
+        The backend to render a template with: the requested one, else
+        CVOS_PDF_BACKEND, else the template's default; choices the template
+        doesn't support fall back to its default.
+        """
+        supported = TEMPLATES[self.resolve_template(template)]["backends"]
+        if backend and backend not in supported:
+            logger.warning(f"Backend '{backend}' not available for template '{template}', using '{supported[0]}'")
+        for choice in (backend, PDF_BACKEND):
+            if choice in supported and choice in BACKENDS:
+                return choice
+        return supported[0] if supported else DEFAULT_BACKEND
+
+    def cache_key(self, data: dict, template: str, backend: str = None) -> str:
+        """Content hash of a render: data, template id and contents, backend, generator version."""
+        template = self.resolve_template(template)
+        backend = self.resolve_backend(template, backend)
+        return render_key(data, template, self._template_digest(template), self.VERSION, backend)
+
+    def _template_digest(self, template: str) -> str:
+        """SHA-256 of the template and stylesheet sources, recomputed only when a file changes."""
+        cached = self._template_digests.get(template)
+        if cached is not None and cached[1]():
+            return cached[0]
+        info = TEMPLATES[template]
+        source, _, uptodate = self.env.loader.get_source(self.env, info["file"])
+        css_file = os.path.join(self.css_path, info["css"])
+        with open(css_file, "rb") as f:
+            css_source = f.read()
+        css_mtime = os.path.getmtime(css_file)
+        digest = hashlib.sha256(source.encode("utf-8") + b"\0" + css_source).hexdigest()
+        html_uptodate = uptodate or (lambda: True)
+        self._template_digests[template] = (
+            digest, lambda: html_uptodate() and os.path.getmtime(css_file) == css_mtime)
+        return digest
+
+    def _get_template(self, template_file: str):
+        """Compiled Jinja template; outside DEV_MODE it is looked up once per generator."""
+        if DEV_MODE:
+            return self.env.get_template(template_file)
+        tpl = self._compiled.get(template_file)
+        if tpl is None:
+            tpl = self._compiled[template_file] = self.env.get_template(template_file)
+        return tpl
+
+    def stylesheet(self, template: str):
+        """
+        The template's stylesheet, parsed once per thread with the shared
+        FontConfiguration (re-parsed in DEV_MODE when the file changes).
+
+        Returns:
+            (weasyprint.CSS, weasyprint FontConfiguration)
+        """
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+        
+        if _styles.font_config is None:
+            _styles.font_config = FontConfiguration()
+        css_file = os.path.join(self.css_path, TEMPLATES[self.resolve_template(template)]["css"])
+        cached = _styles.sheets.get(css_file)
+        mtime = os.path.getmtime(css_file) if DEV_MODE or cached is None else cached[0]
+        if cached is None or cached[0] != mtime:
+            with timed("css_parse"):
+                sheet = CSS(filename=css_file, font_config=_styles.font_config)
+            cached = _styles.sheets[css_file] = (mtime, sheet)
+        return cached[1], _styles.font_config
+
+    def render_html(self, data: dict, template: str = "classic") -> str:
+        """Render the CV data through the Jinja template (styles are applied separately, see stylesheet())."""
+        template_file = TEMPLATES[self.resolve_template(template)]["file"]
+        with timed("template_render"):
+            tpl = self._get_template(template_file)
+            html_content = tpl.render(data=data)
+        logger.info(f"Template '{template_file}' rendered successfully")
+        return html_content
+
+    def css_source(self, template: str) -> str:
+        """The template's stylesheet as text, read once (re-read in DEV_MODE when the file changes)."""
+        css_file = os.path.join(self.css_path, TEMPLATES[self.resolve_template(template)]["css"])
+        cached = self._css_sources.get(css_file)
+        mtime = os.path.getmtime(css_file) if DEV_MODE or cached is None else cached[0]
+        if cached is None or cached[0] != mtime:
+            with open(css_file, encoding="utf-8") as f:
+                cached = self._css_sources[css_file] = (mtime, f.read())
+        return cached[1]
+
+    def render_preview_html(self, data: dict, template: str = "classic") -> str:
+        """
+        Standalone HTML for a browser preview: render_html() with the stylesheet
+        inlined, since templates no longer embed their styles. No WeasyPrint involved.
+        """
+        html_content = self.render_html(data, template)
+        style = f"<style>\n{self.css_source(template)}</style>\n"
+        head_end = html_content.find("</head>")
+        if head_end == -1:
+            return style + html_content
+        return html_content[:head_end] + style + html_content[head_end:]
+
+    def render_pdf(self, data: dict, template: str = "classic", backend: str = None) -> bytes:
+        """Render the CV to PDF bytes in the current process."""
+        template = self.resolve_template(template)
+        backend = self.resolve_backend(template, backend)
+        # Render HTML template
+        html_content = self.render_html(data, template)
+        
+        # Lay it out with the chosen backend
+        pdf_bytes = get_backend(backend).render(self, html_content, template)
+        
+        logger.info(f"PDF generated with {backend}: {len(pdf_bytes)} bytes")
+        return pdf_bytes
+
+    def render_cv(self, data: dict, template: str = "classic", backend: str = None) -> bytes:
+        """
+        Render CV data to PDF bytes, using the render cache and pool when configured.
         
         Args:
             data: Dictionary with CV fields (fullName, title, etc.)
-            output_path: Path to save the generated PDF
             template: Template name ('classic', 'modern', 'executive')
+            backend: PDF backend ('weasyprint', 'mupdf'); None picks the default
             
         Returns:
-            The output_path on success
+            The PDF document as bytes
         """
-        # Validate template
-        if template not in TEMPLATES:
-            logger.warning(f"Unknown template '{template}', falling back to 'classic'")
-            template = "classic"
+        template = self.resolve_template(template)
+        backend = self.resolve_backend(template, backend)
+        logger.info(f"Generating CV for: {data.get('fullName', 'unknown')} using template: {template} ({backend})")
         
-        template_info = TEMPLATES[template]
-        template_file = template_info["file"]
+        key, pdf_bytes = self._cache_lookup(data, template, backend) if self.cache is not None else (None, None)
+        if pdf_bytes is not None:
+            return pdf_bytes
         
-        logger.info(f"Generating CV for: {data.get('fullName', 'unknown')} using template: {template}")
-        
-        # Render HTML template
-        tpl = self.env.get_template(template_file)
-        html_content = tpl.render(data=data)
-        logger.info(f"Template '{template_file}' rendered successfully")
+        if self.engine is not None and self.engine.enabled:
+            pdf_bytes = self.engine.render(data, template, backend)
+        else:
+            pdf_bytes = self.render_pdf(data, template, backend)
+        if key:
+            self.cache.put(key, pdf_bytes)
+        return pdf_bytes
+
+    async def render_cv_async(self, data: dict, template: str = "classic", backend: str = None,
+                              use_cache: bool = True) -> bytes:
+        """
+        Same as render_cv, but awaits the render instead of blocking the event loop.
+        use_cache=False bypasses the render cache (one-off bulk renders would evict the hot entries).
+        """
+        template = self.resolve_template(template)
+        backend = self.resolve_backend(template, backend)
+        logger.info(f"Generating CV for: {data.get('fullName', 'unknown')} using template: {template} ({backend})")
         
-        # Generate PDF
-        html_doc = HTML(string=html_content, base_url=self.template_path)
-        pdf_bytes = html_doc.write_pdf()
+        # The key stats the template files and the disk tier reads/writes PDFs: keep both off the event loop
+        key, pdf_bytes = None, None
+        if self.cache is not None and use_cache:
+            key, pdf_bytes = await asyncio.to_thread(self._cache_lookup, data, template, backend)
+        if pdf_bytes is not None:
+            return pdf_bytes
         
-        logger.info(f"PDF generated: {len(pdf_bytes)} bytes")
+        if self.engine is not None and self.engine.enabled:
+            pdf_bytes = await self.engine.render_async(data, template, backend)
+        else:
+            pdf_bytes = await asyncio.to_thread(self.render_pdf, data, template, backend)
+        if key:
+            await asyncio.to_thread(self.cache.put, key, pdf_bytes)
+        return pdf_bytes
+
+    def _cache_lookup(self, data: dict, template: str, backend: str):
+        """(cache key, cached PDF bytes or None) for a resolved template and backend."""
+        key = self.cache_key(data, template, backend)
+        pdf_bytes = self.cache.get(key)
+        if pdf_bytes is not None:
+            logger.info(f"Render cache hit: {key[:12]}")
+        return key, pdf_bytes
+
+    def generate_cv(self, data: dict, output_path: str, template: str = "classic", backend: str = None) -> str:
+        """
+        Generate PDF from CV data using specified template.
         
-        # Write to file
-        with open(output_path, 'wb') as f:
+        Args:
+            data: Dictionary with CV fields (fullName, title, etc.)
+            output_path: Path to save the generated PDF
+            template: Template name ('classic', 'modern', 'executive')
+            backend: PDF backend ('weasyprint', 'mupdf'); None picks the default
+            
+        Returns:
+            The output_path on success
+        """
+        return self.save_pdf(self.render_cv(data, template, backend), output_path)
+
+    def save_pdf(self, pdf_bytes: bytes, output_path: str) -> str:
+        """Write rendered PDF bytes to output_path."""
+        with timed("file_write"), open(output_path, 'wb') as f:
             f.write(pdf_bytes)
         
         logger.info(f"PDF saved to: {output_path}")
@@ -0,0 +1,264 @@
+"""
+PDF generation jobs for cvOS
+Asynchronous alternative to /generate-pdf: a submit returns a job id at once,
+the render runs on the API's worker pool and the client polls, listens to
+server-sent events or downloads when it is done.
+
+Queued jobs are served by tier priority (business, then pro, then free) with
+a concurrency cap and a queue-depth cap per tier, so a burst of free renders
+can't delay paying customers. Finished PDFs expire after CVOS_JOB_TTL seconds,
+swept periodically; at most CVOS_JOB_MAX_RETAINED finished jobs and
+CVOS_JOB_MAX_RETAINED_MB of PDFs are kept, the oldest dropped first.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from render_pool import RenderQueueFull
+
+logger = logging.getLogger("pdf_jobs")
+
+# Highest priority first
+TIERS = ("business", "pro", "free")
+
+
+def _tier_setting(prefix: str, defaults: Dict[str, int]) -> Dict[str, int]:
+    return {tier: int(os.getenv(f"{prefix}_{tier.upper()}", defaults[tier])) for tier in TIERS}
+
+
+# Jobs rendering at once, across tiers
+JOB_WORKERS = int(os.getenv("CVOS_JOB_WORKERS", "4"))
+# Per-tier limits: renders running at once and jobs waiting
+JOB_CONCURRENCY = _tier_setting("CVOS_JOB_CONCURRENCY", {"business": 4, "pro": 3, "free": 1})
+JOB_QUEUE_LIMITS = _tier_setting("CVOS_JOB_QUEUE", {"business": 100, "pro": 50, "free": 20})
+JOB_TTL = int(os.getenv("CVOS_JOB_TTL", "600"))
+# Finished jobs held for download, whatever their age
+JOB_MAX_RETAINED = int(os.getenv("CVOS_JOB_MAX_RETAINED", "500"))
+JOB_MAX_RETAINED_BYTES = int(float(os.getenv("CVOS_JOB_MAX_RETAINED_MB", "256")) * 1024 * 1024)
+# Seconds between sweeps of expired jobs, so idle periods don't keep their PDFs
+JOB_SWEEP_INTERVAL = float(os.getenv("CVOS_JOB_SWEEP_INTERVAL", "30"))
+# Attempts when the render pool itself is full
+JOB_RENDER_ATTEMPTS = 5
+
+RenderFn = Callable[[dict, str], Awaitable[bytes]]
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueueFull(RuntimeError):
+    """The tier's queue is at its limit; retry after `retry_after` seconds."""
+
+    def __init__(self, tier: str, retry_after: int):
+        super().__init__(f"Cola de generación llena para el plan '{tier}'")
+        self.tier = tier
+        self.retry_after = retry_after
+
+
+class PDFJob:
+    def __init__(self, data: dict, template: str, tier: str, filename: str = "cv.pdf"):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.template = template
+        self.tier = tier
+        self.filename = filename
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.pdf_bytes: Optional[bytes] = None
+        # Set and replaced on every status change; SSE listeners wait on it
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def _set_status(self, status: str):
+        self.status = status
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        """Wait until the status changes; False on timeout."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "tier": self.tier,
+            "template": self.template,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "size": len(self.pdf_bytes) if self.pdf_bytes is not None else None,
+        }
+
+
+class PDFJobQueue:
+    """
+    In-process job queue: priority by tier, per-tier concurrency and queue
+    caps, and expiry of finished jobs by age, count and size. Runs on the API
+    event loop; the render itself goes through `render` (the render pool,
+    normally).
+    """
+
+    def __init__(self, render: RenderFn, workers: int = JOB_WORKERS,
+                 concurrency: Optional[Dict[str, int]] = None, queue_limits: Optional[Dict[str, int]] = None,
+                 ttl: int = JOB_TTL, max_retained: int = JOB_MAX_RETAINED,
+                 max_retained_bytes: int = JOB_MAX_RETAINED_BYTES):
+        self.render = render
+        self.workers = workers
+        self.concurrency = dict(JOB_CONCURRENCY if concurrency is None else concurrency)
+        self.queue_limits = dict(JOB_QUEUE_LIMITS if queue_limits is None else queue_limits)
+        self.ttl = ttl
+        self.max_retained = max_retained
+        self.max_retained_bytes = max_retained_bytes
+        self._queues: Dict[str, Deque[PDFJob]] = {tier: deque() for tier in TIERS}
+        self._running: Dict[str, int] = {tier: 0 for tier in TIERS}
+        self._jobs: Dict[str, PDFJob] = {}
+        # Finished jobs, oldest first, and the bytes of their PDFs
+        self._finished: "OrderedDict[str, PDFJob]" = OrderedDict()
+        self.retained_bytes = 0
+        self.evicted = 0
+        self._tasks = set()
+        self._sweeper: Optional[asyncio.Task] = None
+        # Moving average of render seconds, for Retry-After
+        self._avg_seconds = 2.0
+        self.rejected = 0
+
+    def submit(self, data: dict, template: str, tier: str, filename: str = "cv.pdf") -> PDFJob:
+        """
+        Queue a render and start it as soon as a slot for its tier is free.
+
+        Raises:
+            JobQueueFull: the tier already has queue_limits[tier] jobs waiting
+        """
+        self.expire()
+        queue = self._queues[tier]
+        if len(queue) >= self.queue_limits[tier]:
+            self.rejected += 1
+            raise JobQueueFull(tier, self.retry_after(tier))
+        job = PDFJob(data, template, tier, filename)
+        self._jobs[job.id] = job
+        queue.append(job)
+        self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[PDFJob]:
+        self.expire()
+        return self._jobs.get(job_id)
+
+    def retry_after(self, tier: str) -> int:
+        """Rough seconds until the tier's queue has room: its backlog over its concurrency."""
+        backlog = len(self._queues[tier]) + self._running[tier]
+        return max(1, math.ceil(backlog * self._avg_seconds / max(self.concurrency[tier], 1)))
+
+    def expire(self):
+        """Forget finished jobs (and their PDFs) older than ttl, then the oldest past the retention caps."""
+        cutoff = time.time() - self.ttl
+        while self._finished and next(iter(self._finished.values())).finished_at < cutoff:
+            self._forget()
+        while self._finished and (len(self._finished) > self.max_retained
+                                  or self.retained_bytes > self.max_retained_bytes):
+            self._forget()
+            self.evicted += 1
+
+    def _forget(self):
+        job_id, job = self._finished.popitem(last=False)
+        self.retained_bytes -= len(job.pdf_bytes or b"")
+        del self._jobs[job_id]
+
+    def start(self, interval: float = JOB_SWEEP_INTERVAL):
+        """Sweep expired jobs every `interval` seconds until stop()."""
+        async def sweep():
+            while True:
+                await asyncio.sleep(interval)
+                self.expire()
+
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    def _next_job(self) -> Optional[PDFJob]:
+        for tier in TIERS:
+            if self._queues[tier] and self._running[tier] < self.concurrency[tier]:
+                return self._queues[tier].popleft()
+        return None
+
+    def _dispatch(self):
+        while sum(self._running.values()) < self.workers:
+            job = self._next_job()
+            if job is None:
+                return
+            self._running[job.tier] += 1
+            task = asyncio.get_running_loop().create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: PDFJob):
+        job.started_at = time.time()
+        job._set_status(RUNNING)
+        try:
+            job.pdf_bytes = await self._render_with_retries(job)
+            status = DONE
+        except Exception as e:
+            logger.error(f"PDF job {job.id} failed: {e}")
+            job.error = str(e) or type(e).__name__
+            status = FAILED
+        finally:
+            self._running[job.tier] -= 1
+        job.finished_at = time.time()
+        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (job.finished_at - job.started_at)
+        # The data isn't needed anymore; only the PDF is kept until expiry
+        job.data = None
+        self._finished[job.id] = job
+        self.retained_bytes += len(job.pdf_bytes or b"")
+        job._set_status(status)
+        self.expire()
+        self._dispatch()
+
+    async def _render_with_retries(self, job: PDFJob) -> bytes:
+        for attempt in range(JOB_RENDER_ATTEMPTS):
+            try:
+                return await self.render(job.data, job.template)
+            except RenderQueueFull:
+                # Synchronous /generate-pdf traffic filled the pool; wait instead of failing the job
+                if attempt == JOB_RENDER_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(0.5 * (2 ** attempt))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "jobs": len(self._jobs),
+            "rejected": self.rejected,
+            "retained": len(self._finished),
+            "retained_bytes": self.retained_bytes,
+            "evicted": self.evicted,
+            "tiers": {
+                tier: {
+                    "queued": len(self._queues[tier]),
+                    "running": self._running[tier],
+                    "concurrency": self.concurrency[tier],
+                    "queue_limit": self.queue_limits[tier],
+                }
+                for tier in TIERS
+            },
+        }
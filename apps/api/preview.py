@@ -0,0 +1,119 @@
+"""
+Live preview for cvOS
+Cheap previews for the dashboard wizard, on top of PDFGenerator:
+  - html: the Jinja render with the stylesheet inlined (no WeasyPrint at all)
+  - png: page 1 of the PDF rasterized at low resolution with PyMuPDF; the PDF
+    comes from the render cache, so the final download is then a cache hit
+
+Previews are cached per content hash, and identical previews already being
+built are shared, so a client firing debounced requests while the user types
+only pays for content it hasn't seen yet.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Callable, Dict, Tuple
+
+from metrics import timed
+from render_cache import RenderCache
+
+logger = logging.getLogger("preview")
+
+PREVIEW_CACHE_MB = float(os.getenv("CVOS_PREVIEW_CACHE_MB", "16"))
+PREVIEW_DPI = int(os.getenv("CVOS_PREVIEW_DPI", "48"))
+# Anything sharper is a real render; ask for the PDF
+MAX_PREVIEW_DPI = 96
+
+FORMATS = ("html", "png")
+# The html preview only needs its inlined <style>; nothing in it may run or load
+CSP = "default-src 'none'; style-src 'unsafe-inline'"
+
+
+def rasterize_page(pdf_bytes: bytes, page: int = 0, dpi: int = PREVIEW_DPI) -> bytes:
+    """PNG of one PDF page at the given resolution."""
+    import fitz
+
+    with timed("rasterize"):
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            return doc[page].get_pixmap(dpi=dpi, alpha=False).tobytes("png")
+        finally:
+            doc.close()
+
+
+class PreviewService:
+    """Builds and caches previews; `generator` returns the PDFGenerator to render with."""
+
+    def __init__(self, generator: Callable[[], object], cache: RenderCache = None):
+        self.generator = generator
+        # Memory only: previews are cheap to rebuild and short-lived
+        self.cache = cache if cache is not None else RenderCache(
+            max_bytes=int(PREVIEW_CACHE_MB * 1024 * 1024), disk_dir="")
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def key(self, data: dict, template: str, fmt: str, dpi: int = PREVIEW_DPI) -> str:
+        """
+        Content hash of a preview: the render key plus format and resolution.
+        Checks the template files on disk (see PDFGenerator.cache_key); call it off the event loop.
+        """
+        # Only the PNG comes from a PDF, rendered with the backend the download will use
+        render = self.generator().cache_key(data, template, data.get("backend") if fmt == "png" else None)
+        return hashlib.sha256(f"{render}\n{fmt}\n{dpi if fmt == 'png' else ''}".encode("utf-8")).hexdigest()
+
+    async def preview(self, data: dict, template: str = "classic", fmt: str = "html",
+                      dpi: int = PREVIEW_DPI) -> Tuple[bytes, str]:
+        """
+        Returns:
+            (content, key): HTML as UTF-8 bytes or PNG bytes, and the content hash (usable as ETag)
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato de vista previa no soportado: {fmt}")
+        dpi = max(12, min(dpi, MAX_PREVIEW_DPI))
+        key = await asyncio.to_thread(self.key, data, template, fmt, dpi)
+        content = self.cache.get(key)
+        if content is not None:
+            return content, key
+
+        # Single flight: the same preview requested again while it is being built waits for it
+        leader = self._inflight.get(key)
+        if leader is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(leader), key
+            except asyncio.CancelledError:
+                # The leading request was cancelled (client left); build the preview ourselves
+                if not leader.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            content = await self._build(data, template, fmt, dpi)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # followers re-raise it; don't warn when there are none
+            raise
+        else:
+            future.set_result(content)
+            self.cache.put(key, content)
+            return content, key
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _build(self, data: dict, template: str, fmt: str, dpi: int) -> bytes:
+        generator = self.generator()
+        if fmt == "html":
+            html_content = await asyncio.to_thread(generator.render_preview_html, data, template)
+            return html_content.encode("utf-8")
+        # Same template and backend as /generate-pdf, so the download is then a render cache hit
+        pdf_bytes = await generator.render_cv_async(data, template=template, backend=data.get("backend"))
+        return await asyncio.to_thread(rasterize_page, pdf_bytes, 0, dpi)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "coalesced": self.coalesced, "building": len(self._inflight)}
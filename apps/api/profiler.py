@@ -0,0 +1,152 @@
+"""
+Request profiler for cvOS
+Opt-in cProfile capture of the ATSAnalyzer / PDFGenerator work behind a
+request, kept in a bounded in-memory ring buffer for admins to list and
+download from /debug/profiles.
+
+A request is profiled when it carries `X-Profile: 1` together with a valid
+`X-Admin-Token`, or when it is picked by CVOS_PROFILE_SAMPLE_RATE. The work is
+profiled where it runs: work done by a pool's worker process is profiled there
+(profile_call), and the marshalled stats come back with the result.
+"""
+import cProfile
+import hmac
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Mapping, Optional, Tuple, TypeVar
+
+PROFILE_SAMPLE_RATE = float(os.getenv("CVOS_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUFFER_SIZE = int(os.getenv("CVOS_PROFILE_BUFFER_SIZE", "50"))
+# Without a token, only sampling can turn profiling on and the admin endpoints stay closed
+ADMIN_TOKEN = os.getenv("CVOS_ADMIN_TOKEN", "")
+
+# What /debug/profiles/{id}?format=text may sort by
+SORT_KEYS = frozenset(key.value for key in pstats.SortKey)
+
+T = TypeVar("T")
+
+
+def is_admin(headers: Mapping[str, str]) -> bool:
+    token = headers.get("x-admin-token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def should_profile(headers: Mapping[str, str], sample_rate: Optional[float] = None) -> bool:
+    """Admin asked for it explicitly, or the request was sampled."""
+    if headers.get("x-profile") == "1" and is_admin(headers):
+        return True
+    rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    return rate > 0 and random.random() < rate
+
+
+@dataclass
+class ProfileRecord:
+    id: int
+    kind: str
+    label: str
+    request_id: str
+    created_at: float
+    duration_ms: float
+    stats: bytes = field(repr=False)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "label": self.label,
+            "request_id": self.request_id,
+            "created_at": self.created_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "size": len(self.stats),
+        }
+
+    def text(self, limit: int = 30, sort: str = "cumulative") -> str:
+        """Top functions, as printed by pstats. Raises ValueError for a sort not in SORT_KEYS."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key '{sort}' (one of: {', '.join(sorted(SORT_KEYS))})")
+        out = io.StringIO()
+        stats = pstats.Stats(_StatsSource(marshal.loads(self.stats)), stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+class _StatsSource:
+    """Minimal object pstats.Stats accepts in place of a Profile (it only calls create_stats)."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+@contextmanager
+def capture_profile() -> Iterator[dict]:
+    """
+    cProfile the block in the current thread (cProfile only sees the thread
+    that enabled it). On exit the dict holds "duration_ms" and the marshalled
+    "stats", even if the block raised.
+    """
+    captured = {}
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    profile.enable()
+    try:
+        yield captured
+    finally:
+        profile.disable()
+        captured["duration_ms"] = (time.perf_counter() - start) * 1000
+        profile.create_stats()
+        captured["stats"] = marshal.dumps(profile.stats)
+
+
+def profile_call(fn: Callable[..., T], *args) -> Tuple[T, dict]:
+    """
+    fn(*args) under cProfile; returns (result, captured profile). Module-level
+    so a worker process can run it and send the profile back with the result.
+    """
+    with capture_profile() as captured:
+        result = fn(*args)
+    return result, captured
+
+
+class ProfileStore:
+    """Ring buffer of the most recent profiles; the oldest is dropped when full."""
+
+    def __init__(self, size: int = PROFILE_BUFFER_SIZE):
+        self._records: "deque[ProfileRecord]" = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, label: str, request_id: str, captured: dict) -> int:
+        """Store a profile taken with capture_profile(), here or in a worker; returns its id."""
+        duration_ms, stats = captured["duration_ms"], captured["stats"]
+        with self._lock:
+            record = ProfileRecord(next(self._ids), kind, label, request_id, time.time(), duration_ms, stats)
+            self._records.append(record)
+            return record.id
+
+    def get(self, record_id: int) -> Optional[ProfileRecord]:
+        with self._lock:
+            return next((r for r in self._records if r.id == record_id), None)
+
+    def list(self) -> List[dict]:
+        """Newest first."""
+        with self._lock:
+            return [r.summary() for r in reversed(self._records)]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,203 @@
+"""
+Render cache for cvOS
+Content-addressed cache of generated PDFs: an in-memory LRU tier bounded by
+bytes, plus an optional on-disk tier with size and TTL eviction. A disk hit
+refreshes the file's mtime, so the disk tier is LRU too and its TTL counts
+from the last use.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger("render_cache")
+
+RENDER_CACHE_MB = float(os.getenv("CVOS_RENDER_CACHE_MB", "64"))
+RENDER_CACHE_DIR = os.getenv("CVOS_RENDER_CACHE_DIR") or None
+RENDER_CACHE_DISK_MB = float(os.getenv("CVOS_RENDER_CACHE_DISK_MB", "512"))
+RENDER_CACHE_TTL = int(os.getenv("CVOS_RENDER_CACHE_TTL", "86400"))
+
+
+def canonical_hash(data: dict) -> str:
+    """Stable SHA-256 of a JSON-like dict (key order and whitespace don't matter)."""
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_key(data: dict, template: str, template_digest: str, version: str, backend: str = "weasyprint") -> str:
+    """Cache key for one render: CV data + template id + template contents + generator version + PDF backend."""
+    parts = "\n".join([canonical_hash(data), template, template_digest, version, backend])
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """Two-tier (memory LRU + optional disk) cache of PDF bytes keyed by render_key()."""
+
+    def __init__(self, max_bytes: Optional[int] = None, disk_dir: Optional[str] = None,
+                 disk_max_bytes: Optional[int] = None, disk_ttl: Optional[int] = None):
+        self.max_bytes = int(RENDER_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.disk_dir = RENDER_CACHE_DIR if disk_dir is None else disk_dir
+        self.disk_max_bytes = int(RENDER_CACHE_DISK_MB * 1024 * 1024) if disk_max_bytes is None else disk_max_bytes
+        self.disk_ttl = RENDER_CACHE_TTL if disk_ttl is None else disk_ttl
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bytes in the disk tier, tracked on writes; None until the directory was scanned once
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            pdf_bytes = self._entries.get(key)
+            if pdf_bytes is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return pdf_bytes
+
+        pdf_bytes = self._disk_get(key)
+        with self._lock:
+            if pdf_bytes is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._memory_put(key, pdf_bytes)
+        return pdf_bytes
+
+    def put(self, key: str, pdf_bytes: bytes):
+        with self._lock:
+            self._memory_put(key, pdf_bytes)
+        self._disk_put(key, pdf_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(hits / total, 3) if total else 0.0,
+                "disk_enabled": bool(self.disk_dir),
+            }
+
+    # --- memory tier (caller holds the lock) ---
+
+    def _memory_put(self, key: str, pdf_bytes: bytes):
+        if len(pdf_bytes) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = pdf_bytes
+        self._bytes += len(pdf_bytes)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    # --- disk tier ---
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pdf")
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.disk_ttl:
+                self._disk_remove(path, st.st_size)
+                return None
+            with open(path, "rb") as f:
+                pdf_bytes = f.read()
+            # Recently used: evicted last
+            os.utime(path)
+            return pdf_bytes
+        except OSError:
+            return None
+
+    def _disk_put(self, key: str, pdf_bytes: bytes):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(pdf_bytes)
+            # Under the lock so the tracked size can't miss a file a concurrent rescan didn't see
+            with self._disk_lock:
+                try:
+                    previous = os.path.getsize(path)
+                except OSError:
+                    previous = 0
+                os.replace(tmp_path, path)
+                if self._disk_bytes is not None:
+                    self._disk_bytes += len(pdf_bytes) - previous
+                if self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes:
+                    self._disk_evict()
+        except OSError as e:
+            logger.warning(f"Could not write render cache entry: {e}")
+            self._remove(tmp_path)
+
+    def _disk_remove(self, path: str, size: int):
+        with self._disk_lock:
+            if self._remove(path) and self._disk_bytes is not None:
+                self._disk_bytes -= size
+
+    def _disk_evict(self):
+        """
+        Rescan the directory: drop expired entries, then the least recently
+        used ones until it fits its budget, and reset the tracked size.
+        Caller holds the disk lock.
+        """
+        now = time.time()
+        files = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".pdf"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if now - st.st_mtime > self.disk_ttl:
+                self._remove(entry.path)
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            self._remove(path)
+            total -= size
+        self._disk_bytes = total
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
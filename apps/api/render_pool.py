@@ -0,0 +1,217 @@
+"""
+Render pool for cvOS
+Keeps a set of warm worker processes (WeasyPrint imported, Jinja templates
+loaded) so PDF layout never runs on the API event loop. Workers are replaced
+by a fresh, pre-warmed set once one of them passes its job or memory budget
+(see worker_limits).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from metrics import capture_stages, record_stages
+from profiler import profile_call
+from worker_limits import WorkerBudget, run_job
+
+logger = logging.getLogger("render_pool")
+
+# Pool sizing, overridable per deployment
+RENDER_WORKERS = int(os.getenv("CVOS_RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_QUEUE_SIZE = int(os.getenv("CVOS_RENDER_QUEUE_SIZE", RENDER_WORKERS * 4))
+
+
+class RenderQueueFull(RuntimeError):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+# Generator owned by each worker process and its warm-up timings (set by _init_worker)
+_worker_generator = None
+_worker_warmup: dict = {}
+
+# How long start() waits for every worker to report its warm-up
+WARMUP_TIMEOUT = 120
+
+
+def _init_worker(template_dir: str, reports=None):
+    """Runs once per worker process: import WeasyPrint, load templates, render each once."""
+    global _worker_generator, _worker_warmup
+    start = time.perf_counter()
+    from pdf_generator import PDFGenerator
+
+    _worker_generator = PDFGenerator(template_dir)
+    import_seconds = time.perf_counter() - start
+    try:
+        templates = _worker_generator.warm_up()
+    except Exception as e:
+        # A broken template or missing system library shouldn't kill the worker; requests will report it
+        logger.error(f"Render worker warm-up failed: {e}")
+        templates = {"error": str(e)}
+    _worker_warmup = {"pid": os.getpid(), "import_seconds": round(import_seconds, 4), "templates": templates}
+    if reports is not None:
+        reports.put(_worker_warmup)
+
+
+def _render_in_worker(data: dict, template: str, backend: Optional[str] = None,
+                      profile: bool = False) -> Tuple[object, list, dict]:
+    # Stage timings and the worker's memory usage travel back with the PDF; its own metrics are never scraped.
+    # A profiled render returns (PDF bytes, captured profile) in place of the bytes
+    with capture_stages() as stages:
+        if profile:
+            result, usage = run_job(profile_call, _worker_generator.render_pdf, data, template, backend)
+        else:
+            result, usage = run_job(_worker_generator.render_pdf, data, template, backend)
+    return result, stages, usage
+
+
+def _unpack(result: Tuple[object, list, dict]):
+    rendered, stages, _ = result
+    record_stages(stages)
+    return rendered
+
+
+class RenderPool:
+    """
+    Dispatches CV renders to a pool of pre-warmed worker processes.
+
+    At most `workers + queue_size` renders are admitted at once; further
+    submissions fail fast with RenderQueueFull instead of piling up. The pool
+    is started by the app's warm-up (start()); until then, and after
+    shutdown(), submissions fail the same way rather than spawning workers
+    on the caller's thread.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 template_dir: str = "templates", start_method: str = "spawn"):
+        self.workers = RENDER_WORKERS if workers is None else workers
+        self.queue_size = RENDER_QUEUE_SIZE if queue_size is None else queue_size
+        self.template_dir = template_dir
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # One entry per worker: pid, import and per-template warm-up seconds
+        self.warmup_report: list = []
+        self.budget = WorkerBudget("render")
+        self._recycling = False
+
+    @property
+    def enabled(self) -> bool:
+        """A pool configured with 0 workers renders in-process instead."""
+        return self.workers > 0
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Spawn the worker processes and block until each one is warm."""
+        with self._lock:
+            if self._executor is not None or self.workers <= 0:
+                return
+            logger.info(f"Starting render pool: {self.workers} workers, queue {self.queue_size}")
+            self._executor, self.warmup_report = self._spawn()
+
+    def _spawn(self) -> Tuple[ProcessPoolExecutor, list]:
+        """A new set of workers, each one warm by the time this returns."""
+        context = multiprocessing.get_context(self.start_method)
+        reports = context.Queue()
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.template_dir, reports),
+        )
+        # Force every worker up front so the first request doesn't pay for the import
+        warmups = [executor.submit(os.getpid) for _ in range(self.workers)]
+        for f in warmups:
+            f.result()
+        report = []
+        try:
+            for _ in range(self.workers):
+                report.append(reports.get(timeout=WARMUP_TIMEOUT))
+        except queue.Empty:
+            logger.warning(f"Only {len(report)}/{self.workers} render workers reported warm-up")
+        return executor, report
+
+    def recycle(self, reason: str = "manual"):
+        """
+        Replace the workers without dropping work: a new set warms up in the
+        background, takes over new renders, and the old set exits once its
+        in-flight renders are done.
+        """
+        with self._lock:
+            if self._recycling or self._executor is None:
+                return
+            self._recycling = True
+        threading.Thread(target=self._replace, args=(reason,), name="render-recycle", daemon=True).start()
+
+    def _replace(self, reason: str):
+        try:
+            executor, report = self._spawn()
+        except Exception as e:
+            logger.error(f"Render pool recycle failed, keeping the current workers: {e}")
+            with self._lock:
+                self._recycling = False
+            return
+        with self._lock:
+            old, self._recycling = self._executor, False
+            if old is None:
+                # Shut down meanwhile
+                executor.shutdown(wait=False, cancel_futures=True)
+                return
+            self._executor, self.warmup_report = executor, report
+            self.budget.recycled(reason)
+        old.shutdown(wait=True)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=not wait)
+                self._executor = None
+
+    def submit(self, data: dict, template: str, backend: Optional[str] = None, profile: bool = False) -> Future:
+        """Queue a render and return a Future resolving to (PDF bytes, stage timings, worker usage)."""
+        if not self.enabled:
+            raise RuntimeError("Render pool is disabled (0 workers)")
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull("Render queue is full, try again shortly")
+        try:
+            # Under the lock so a recycle can't shut this executor down in between
+            with self._lock:
+                executor = self._executor
+                if executor is None:
+                    raise RenderQueueFull("Render pool is not started yet, try again shortly")
+                future = executor.submit(_render_in_worker, data, template, backend, profile)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._finished(f, executor))
+        return future
+
+    def _finished(self, future: Future, executor: ProcessPoolExecutor):
+        self._slots.release()
+        reason = self.budget.observe(future, current=executor is self._executor)
+        if reason:
+            self.recycle(reason)
+
+    def render(self, data: dict, template: str, backend: Optional[str] = None,
+               timeout: Optional[float] = None) -> bytes:
+        return _unpack(self.submit(data, template, backend).result(timeout=timeout))
+
+    async def render_async(self, data: dict, template: str, backend: Optional[str] = None) -> bytes:
+        return _unpack(await asyncio.wrap_future(self.submit(data, template, backend)))
+
+    async def render_profiled_async(self, data: dict, template: str,
+                                    backend: Optional[str] = None) -> Tuple[bytes, dict]:
+        """Render under cProfile in the worker; returns (PDF bytes, captured profile, see profiler)."""
+        return _unpack(await asyncio.wrap_future(self.submit(data, template, backend, profile=True)))
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "started": self.started, "recycling": self._recycling,
+                "budget": self.budget.stats()}
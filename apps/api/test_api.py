@@ -21,13 +21,32 @@ def test_pdf_generator_init():
     assert gen.env is not None
 
 def test_template_exists():
-    """Test that CV template exists."""
-    template_path = os.path.join(
-        os.path.dirname(__file__), 
-        "templates", 
-        "cv_template.html"
-    )
-    assert os.path.exists(template_path), f"Template not found at {template_path}"
+    """Test that every CV template exists."""
+    from pdf_generator import TEMPLATES
+    for info in TEMPLATES.values():
+        template_path = os.path.join(
+            os.path.dirname(__file__), 
+            "templates", 
+            info["file"]
+        )
+        assert os.path.exists(template_path), f"Template not found at {template_path}"
+
+def test_bytecode_cache_refuses_shared_directories(monkeypatch, tmp_path):
+    """Test that Jinja bytecode is only cached in a directory private to this user."""
+    import pdf_generator
+    
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    monkeypatch.setattr(pdf_generator, "JINJA_CACHE_DIR", str(shared))
+    assert pdf_generator._bytecode_cache("1") is None
+    
+    private = tmp_path / "private"
+    monkeypatch.setattr(pdf_generator, "JINJA_CACHE_DIR", str(private))
+    assert pdf_generator._bytecode_cache("1") is not None
+    assert private.stat().st_mode & 0o777 == 0o700
+    monkeypatch.setattr(pdf_generator, "JINJA_CACHE_DIR", "")
+    assert pdf_generator._bytecode_cache("1") is None
 
 def test_pdf_generation():
     """Test actual PDF generation."""
@@ -77,10 +96,1187 @@ def test_pdf_generation():
     # Cleanup
     os.remove(output_path)
 
+def test_render_pool_generates_pdf():
+    """Test that renders dispatched to the worker pool produce a PDF."""
+    from pdf_generator import PDFGenerator
+    from render_pool import RenderPool
+    
+    pool = RenderPool(workers=2, queue_size=2)
+    try:
+        pool.start()
+        gen = PDFGenerator(engine=pool)
+        output_path = "/tmp/test_cv_pool_output.pdf"
+        gen.generate_cv({"fullName": "Pool User", "skills": "Python"}, output_path, template="modern")
+        assert os.path.getsize(output_path) > 0, "PDF file is empty"
+        os.remove(output_path)
+    finally:
+        pool.shutdown()
+
+def test_render_pool_rejects_when_full():
+    """Test that the pool fails fast once workers and queue are all taken."""
+    from render_pool import RenderPool, RenderQueueFull
+    
+    pool = RenderPool(workers=1, queue_size=0)
+    pool._slots.acquire()
+    with pytest.raises(RenderQueueFull):
+        pool.submit({"fullName": "Busy"}, "classic")
+    assert not pool.started
+    
+    # Not started (warm-up pending, or shut down): rejected without spawning workers on the caller
+    pool._slots.release()
+    with pytest.raises(RenderQueueFull):
+        pool.submit({"fullName": "Early"}, "classic")
+    assert not pool.started
+    assert pool._slots.acquire(blocking=False)
+
+def test_render_pool_recycles_workers_without_dropping_renders():
+    """Test that workers past their job budget are replaced while renders keep succeeding."""
+    import time
+    from render_pool import RenderPool
+    
+    pool = RenderPool(workers=1, queue_size=2)
+    pool.budget.max_jobs = 2
+    try:
+        pool.start()
+        first_pid = pool.warmup_report[0]["pid"]
+        for i in range(4):
+            assert pool.render({"fullName": f"Recycle {i}"}, "classic", "mupdf").startswith(b"%PDF")
+        deadline = time.monotonic() + 60
+        while (pool._recycling or pool.budget.recycles == 0) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert pool.budget.recycles == 1
+        assert pool.warmup_report[0]["pid"] != first_pid
+        assert pool.render({"fullName": "After"}, "classic", "mupdf").startswith(b"%PDF")
+    finally:
+        pool.shutdown()
+
+def test_render_pool_profiles_inside_the_worker():
+    """Test that a profiled render is profiled in the worker and its stats come back with the PDF."""
+    import asyncio
+    import marshal
+    from render_pool import RenderPool
+    
+    pool = RenderPool(workers=1, queue_size=1)
+    try:
+        pool.start()
+        pdf_bytes, captured = asyncio.run(pool.render_profiled_async({"fullName": "Profiled"}, "classic", "mupdf"))
+    finally:
+        pool.shutdown()
+    assert pdf_bytes.startswith(b"%PDF") and captured["duration_ms"] > 0
+    assert any(func == "render_pdf" for _, _, func in marshal.loads(captured["stats"]))
+
+def test_job_ceiling_fails_the_job_and_is_accounted():
+    """Test the per-job time/memory ceiling and the budget accounting of worker usage."""
+    import pickle
+    import time
+    from concurrent.futures import Future
+    from worker_limits import MB, CeilingExceeded, WorkerBudget, ceiling, run_job
+    
+    with pytest.raises(CeilingExceeded) as exc:
+        with ceiling(max_seconds=0.1, max_memory_mb=0):
+            while True:
+                time.sleep(0.001)
+    assert exc.value.kind == "time"
+    
+    hog = []
+    with pytest.raises(CeilingExceeded) as exc:
+        with ceiling(max_seconds=0, max_memory_mb=32):
+            for _ in range(1000):
+                hog.append(bytearray(MB))
+                hog[-1][::4096] = b"x" * 256
+                time.sleep(0.001)
+    hog.clear()
+    assert exc.value.kind == "memory"
+    
+    # The job after a failed one runs normally in the same process
+    result, usage = run_job(sum, [1, 2, 3])
+    assert result == 6 and usage["jobs"] >= 1 and usage["rss"] > 0
+    
+    error = pickle.loads(pickle.dumps(CeilingExceeded("memory", 32, {"pid": 1, "jobs": 5, "rss": 2048 * MB})))
+    budget = WorkerBudget("test", max_jobs=100, max_rss_mb=1024)
+    failed = Future()
+    failed.set_exception(error)
+    # A ceiling hit always recycles: the interrupted job may have left the worker inconsistent
+    assert budget.observe(failed) == "ceiling"
+    assert budget.observe(failed, current=False) is None
+    done = Future()
+    done.set_result((b"%PDF", [], {"pid": 2, "jobs": 100, "rss": MB}))
+    assert budget.observe(done) == "jobs"
+    assert budget.ceiling_hits == 2 and len(budget.stats()["workers"]) == 2
+
+def test_render_key_is_canonical():
+    """Test that key order in the CV data doesn't change the cache key."""
+    from render_cache import render_key
+    
+    a = render_key({"fullName": "A", "skills": "Python"}, "classic", "digest", "1.0")
+    b = render_key({"skills": "Python", "fullName": "A"}, "classic", "digest", "1.0")
+    assert a == b
+    assert a != render_key({"fullName": "A", "skills": "Python"}, "modern", "digest", "1.0")
+    assert a != render_key({"fullName": "A", "skills": "Python"}, "classic", "digest", "1.1")
+
+def test_render_cache_lru_byte_budget():
+    """Test that the memory tier evicts least recently used entries past its budget."""
+    from render_cache import RenderCache
+    
+    cache = RenderCache(max_bytes=10, disk_dir="")
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.get("a") == b"12345"  # "a" is now most recent
+    cache.put("c", b"12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    stats = cache.stats()
+    assert stats["bytes"] <= 10
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 2 and stats["misses"] == 1
+
+def test_render_cache_disk_tier(tmp_path):
+    """Test that the disk tier survives a memory flush and expires by TTL."""
+    from render_cache import RenderCache
+    
+    cache = RenderCache(max_bytes=1024, disk_dir=str(tmp_path), disk_ttl=60)
+    cache.put("k", b"%PDF-data")
+    cache.clear()
+    assert cache.get("k") == b"%PDF-data"
+    assert cache.stats()["disk_hits"] == 1
+    
+    expired = RenderCache(max_bytes=1024, disk_dir=str(tmp_path), disk_ttl=-1)
+    expired.clear()
+    assert expired.get("k") is None
+
+def test_render_cache_disk_tier_is_lru_and_tracks_its_size(tmp_path, monkeypatch):
+    """Test that disk hits protect an entry from eviction and puts only rescan when over budget."""
+    import time
+    from render_cache import RenderCache
+    
+    cache = RenderCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=25, disk_ttl=60)
+    scans = []
+    evict = cache._disk_evict
+    monkeypatch.setattr(cache, "_disk_evict", lambda: (scans.append(1), evict()))
+    old = time.time() - 30
+    for key in ("a", "b"):
+        cache.put(key, b"x" * 10)
+        os.utime(cache._disk_path(key), (old, old))
+    assert len(scans) == 1  # the first write learns the directory's size
+    assert cache.get("a") == b"x" * 10
+    cache.put("c", b"x" * 10)
+    assert len(scans) == 2
+    assert sorted(os.listdir(tmp_path)) == ["a.pdf", "c.pdf"]
+    assert cache._disk_bytes == 20
+
+def test_pdf_generation_uses_render_cache():
+    """Test that a repeat render with the same data is served from the cache."""
+    from pdf_generator import PDFGenerator
+    from render_cache import RenderCache
+    
+    cache = RenderCache(max_bytes=10 * 1024 * 1024, disk_dir="")
+    gen = PDFGenerator(cache=cache)
+    data = {"fullName": "Cache User", "skills": "Python"}
+    gen.generate_cv(data, "/tmp/test_cv_cache_1.pdf")
+    gen.generate_cv(dict(data), "/tmp/test_cv_cache_2.pdf")
+    with open("/tmp/test_cv_cache_1.pdf", "rb") as f1, open("/tmp/test_cv_cache_2.pdf", "rb") as f2:
+        assert f1.read() == f2.read()
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    os.remove("/tmp/test_cv_cache_1.pdf")
+    os.remove("/tmp/test_cv_cache_2.pdf")
+
+def test_async_render_keeps_cache_io_off_the_event_loop():
+    """Test that render_cv_async keys, reads and writes the render cache outside the loop thread."""
+    import asyncio
+    import threading
+    from pdf_generator import PDFGenerator
+    from render_cache import RenderCache
+    
+    threads = []
+    class RecordingCache(RenderCache):
+        def get(self, key):
+            threads.append(threading.current_thread())
+            return super().get(key)
+        def put(self, key, pdf_bytes):
+            threads.append(threading.current_thread())
+            super().put(key, pdf_bytes)
+    class FakeEngine:
+        enabled = True
+        async def render_async(self, data, template, backend):
+            return b"%PDF-fake"
+    
+    gen = PDFGenerator(engine=FakeEngine(), cache=RecordingCache(max_bytes=1024, disk_dir=""))
+    data = {"fullName": "Async User"}
+    async def render_twice():
+        return await gen.render_cv_async(data), await gen.render_cv_async(data)
+    assert asyncio.run(render_twice()) == (b"%PDF-fake", b"%PDF-fake")
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
+    assert gen.cache.stats()["hits"] == 1
+
+def test_mupdf_backend_renders_classic():
+    """Test that the PyMuPDF backend renders classic without WeasyPrint and is keyed apart."""
+    import fitz
+    from pdf_generator import PDFGenerator
+    
+    gen = PDFGenerator()
+    data = {"fullName": "Story User", "title": "Backend Engineer", "skills": "Python, Docker",
+            "experience": [{"company": "Tech Corp", "position": "Developer", "startDate": "2020",
+                            "endDate": "2024", "description": "• Logro uno\n• Logro dos"}]}
+    doc = fitz.open(stream=gen.render_pdf(data, "classic", backend="mupdf"), filetype="pdf")
+    text = doc[0].get_text()
+    assert "Story User" in text and "Developer - Tech Corp" in text and "2020 - 2024" in text
+    
+    assert gen.resolve_backend("classic", "mupdf") == "mupdf"
+    assert gen.resolve_backend("modern", "mupdf") == "weasyprint"
+    assert gen.resolve_backend("classic", "nope") == "weasyprint"
+    assert gen.cache_key(data, "classic", "mupdf") != gen.cache_key(data, "classic")
+
+def test_mupdf_backend_matches_weasyprint():
+    """Test text and page count parity of the PyMuPDF backend against WeasyPrint."""
+    import fitz
+    from collections import Counter
+    from pdf_generator import PDFGenerator
+    
+    gen = PDFGenerator()
+    data = {
+        "fullName": "Parity User",
+        "title": "Software Developer",
+        "email": "parity@example.com",
+        "location": "Remote",
+        "summary": "Experienced developer with Python and JavaScript skills.",
+        "experience": [{"company": "Tech Corp", "position": "Senior Developer", "startDate": "2020",
+                        "endDate": "Present", "description": "• Led development of key features.\n• Cut costs."}],
+        "education": [{"institution": "Tech University", "degree": "BS Computer Science",
+                       "startDate": "2016", "endDate": "2020"}],
+        "skills": "Python, JavaScript, Docker, AWS",
+        "languages": "English, Spanish",
+    }
+    
+    def words(pdf_bytes):
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        # Story has no text-transform, so compare case-insensitively
+        return len(doc), Counter(w.casefold() for page in doc for w in page.get_text().split())
+    
+    weasy_pages, weasy_words = words(gen.render_pdf(data, "classic", backend="weasyprint"))
+    mupdf_pages, mupdf_words = words(gen.render_pdf(data, "classic", backend="mupdf"))
+    assert mupdf_pages == weasy_pages
+    shared = sum((weasy_words & mupdf_words).values())
+    assert shared / max(sum(weasy_words.values()), sum(mupdf_words.values())) > 0.85
+
+def test_stylesheets_are_parsed_once_and_keyed(tmp_path):
+    """Test that template CSS is parsed once per thread and is part of the cache key."""
+    import shutil
+    from pdf_generator import PDFGenerator, TEMPLATES
+
+    template_dir = tmp_path / "templates"
+    shutil.copytree(os.path.join(os.path.dirname(__file__), "templates"), template_dir)
+    for info in TEMPLATES.values():
+        assert "<style" not in (template_dir / info["file"]).read_text(encoding="utf-8")
+
+    gen = PDFGenerator(template_dir=str(template_dir))
+    sheet, font_config = gen.stylesheet("classic")
+    assert gen.stylesheet("classic") == (sheet, font_config)
+    assert gen.stylesheet("modern")[1] is font_config
+
+    data = {"fullName": "Style User"}
+    key = gen.cache_key(data, "classic")
+    css_file = template_dir / "css" / TEMPLATES["classic"]["css"]
+    css_file.write_text(css_file.read_text(encoding="utf-8") + "\nh1 { color: red; }\n", encoding="utf-8")
+    os.utime(css_file, (0, 0))
+    assert gen.cache_key(data, "classic") != key
+
+def test_generate_pdf_endpoint_streams_bytes(monkeypatch):
+    """Test that /generate-pdf answers from memory with ETag and honours If-None-Match."""
+    from fastapi.testclient import TestClient
+    import main
+    
+    monkeypatch.setattr(main.render_pool, "workers", 0)
+    client = TestClient(main.app)
+    response = client.post("/generate-pdf", json={"fullName": "Stream User", "template": "classic"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    assert int(response.headers["content-length"]) == len(response.content)
+    etag = response.headers["etag"]
+    
+    cached = client.post("/generate-pdf", json={"fullName": "Stream User", "template": "classic"},
+                         headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+def test_preview_endpoint_html_and_png(monkeypatch):
+    """Test that /preview inlines the stylesheet, rasterizes page 1 and caches by content."""
+    from fastapi.testclient import TestClient
+    import main
+    
+    generator = main.get_pdf_generator()
+    renders = []
+    
+    async def fake_render(data, template="classic", backend=None):
+        renders.append((template, backend))
+        return _make_pdf(data["fullName"], pages=2)
+    
+    monkeypatch.setattr(generator, "render_cv_async", fake_render)
+    main.previews.cache.clear()
+    client = TestClient(main.app)
+    data = {"fullName": "Preview User", "template": "modern"}
+    
+    html = client.post("/preview", json=data)
+    assert html.status_code == 200 and html.headers["content-type"].startswith("text/html")
+    assert "Preview User" in html.text and "<style>" in html.text and "</style>\n</head>" in html.text
+    assert html.headers["content-security-policy"] == "default-src 'none'; style-src 'unsafe-inline'"
+    assert renders == []
+    
+    hostile = client.post("/preview", json={"fullName": "<script>alert(1)</script>", "summary": "a & b"})
+    assert "<script>alert(1)" not in hostile.text
+    assert "&lt;script&gt;alert(1)&lt;/script&gt;" in hostile.text and "a &amp; b" in hostile.text
+    
+    png = client.post("/preview?format=png&dpi=30", json=data)
+    assert png.status_code == 200 and png.content.startswith(b"\x89PNG")
+    again = client.post("/preview?format=png&dpi=30", json=data, headers={"If-None-Match": png.headers["etag"]})
+    assert again.status_code == 304
+    assert client.post("/preview?format=png&dpi=30", json=data).content == png.content
+    assert renders == [("modern", None)]
+    assert client.post("/preview?format=gif", json=data).status_code == 400
+    
+    mupdf = client.post("/preview?format=png&dpi=30", json={"fullName": "Preview User", "backend": "mupdf"})
+    assert mupdf.status_code == 200 and renders[-1] == ("classic", "mupdf")
+
+def test_preview_follower_survives_a_cancelled_leader():
+    """Test that a cancelled leading preview doesn't cancel requests waiting on it."""
+    import asyncio
+    from preview import PreviewService
+    
+    class FakeGenerator:
+        def cache_key(self, data, template, backend=None):
+            return f"{data['fullName']}/{template}/{backend}"
+        def render_preview_html(self, data, template):
+            import time
+            time.sleep(0.1)
+            return f"<p>{data['fullName']}</p>"
+    
+    service = PreviewService(lambda: FakeGenerator())
+    async def scenario():
+        leader = asyncio.create_task(service.preview({"fullName": "Ana"}))
+        await asyncio.sleep(0.02)
+        follower = asyncio.create_task(service.preview({"fullName": "Ana"}))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        return await follower
+    content, _ = asyncio.run(scenario())
+    assert content == b"<p>Ana</p>"
+    assert service.coalesced == 1 and service.stats()["building"] == 0
+
+def _make_pdf(text: str, pages: int = 1) -> bytes:
+    """Build a small text PDF in memory with PyMuPDF."""
+    import fitz
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 560, 800), text, fontsize=10)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+SAMPLE_CV_TEXT = """Ana Pérez
+Email: ana@example.com | LinkedIn
+Perfil
+Desarrolladora backend con experiencia en Python.
+Experiencia
+- Lideré la migración a FastAPI
+- Reduje la latencia un 40%
+Educación
+Universidad Nacional
+Habilidades
+Python, Docker, AWS"""
+
+def test_parsed_document_is_shared_without_reparsing(monkeypatch):
+    """Test that one ParsedDocument carries pages, lines and blocks and feeds the analyzer as-is."""
+    import ats_checker
+    from ats_checker import ATSAnalyzer, parse_pdf
+    
+    document = parse_pdf(_make_pdf(SAMPLE_CV_TEXT, pages=2))
+    assert document.page_count == 2 and len(document.page_spans) == 2
+    assert document.page_text(1).startswith("Ana Pérez")
+    assert {b[0] for b in document.blocks} == {0, 1} and all(len(b) == 6 for b in document.blocks)
+    line = document.line_at(document.text.index("Educación"))
+    assert document.text[document.line_offsets[line]:].startswith("Educación")
+    assert document.head(20) == "Ana Pérez\n" and not hasattr(document, "__dict__")
+    
+    monkeypatch.setattr(ats_checker, "open_pdf", lambda source: pytest.fail("PDF parsed twice"))
+    assert ATSAnalyzer(document).analyze() == ATSAnalyzer.from_text(document.text, page_count=2).analyze()
+
+def test_ats_analyzer_accepts_bytes_buffer_and_path(tmp_path):
+    """Test that bytes, buffers and paths give the same analysis."""
+    import io
+    from ats_checker import ATSAnalyzer
+    
+    pdf_bytes = _make_pdf(SAMPLE_CV_TEXT, pages=2)
+    pdf_path = tmp_path / "cv.pdf"
+    pdf_path.write_bytes(pdf_bytes)
+    
+    from_bytes = ATSAnalyzer(pdf_bytes).analyze()
+    from_buffer = ATSAnalyzer(io.BytesIO(pdf_bytes)).analyze()
+    from_path = ATSAnalyzer(str(pdf_path)).analyze()
+    assert from_bytes == from_buffer == from_path
+    assert from_bytes["metrics"]["page_count"] == 2
+
+def test_ats_analyzer_stops_at_page_and_char_limits():
+    """Test that extraction stops early at the page and character caps and says so."""
+    from ats_checker import ATSAnalyzer
+    
+    pdf_bytes = _make_pdf(SAMPLE_CV_TEXT, pages=5)
+    full = ATSAnalyzer(pdf_bytes)
+    assert not full.truncated and not full.analyze()["truncated"]
+    
+    by_pages = ATSAnalyzer(pdf_bytes, max_pages=2)
+    assert by_pages.truncated and by_pages.analyze()["truncated"]
+    assert by_pages.page_count == 5
+    assert len(by_pages.text) == len(full.text) * 2 // 5
+    
+    by_chars = ATSAnalyzer(pdf_bytes, max_chars=100)
+    assert by_chars.truncated and by_chars.text == full.text[:100]
+
+def test_analyze_rejects_oversized_upload(monkeypatch):
+    """Test that uploads over the byte limit get 413 without being analyzed."""
+    from fastapi.testclient import TestClient
+    import ats_checker
+    import main
+    
+    monkeypatch.setattr(ats_checker, "MAX_PDF_BYTES", 1000)
+    client = TestClient(main.app)
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT, pages=3), "application/pdf")}
+    response = client.post("/analyze", files=files)
+    assert response.status_code == 413
+    assert "límite" in response.json()["detail"]
+
+def test_analyze_endpoint_in_memory():
+    """Test that /analyze processes uploads without writing temp files, in the analysis pool."""
+    from fastapi.testclient import TestClient
+    import main
+    
+    main.analysis_cache.clear()
+    client = TestClient(main.app)
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT), "application/pdf")}
+    response = client.post("/analyze", files=files)
+    assert response.status_code == 200
+    assert "Experiencia Laboral" in response.json()["sections_found"]
+    assert not os.path.exists("temp_cv.pdf")
+    # Parsed and scored by a pool worker, under the per-job ceiling
+    workers = main.analysis_budget.stats()["workers"]
+    assert workers and os.getpid() not in [w["pid"] for w in workers]
+
+def test_analyze_maps_job_ceilings_to_422_and_504(monkeypatch):
+    """Test that a job over its memory ceiling answers 422 and one over its time ceiling 504."""
+    from fastapi.testclient import TestClient
+    from worker_limits import CeilingExceeded
+    import main
+    
+    async def over(kind):
+        raise CeilingExceeded(kind, 1)
+    main.analysis_cache.clear()
+    client = TestClient(main.app)
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT + "\nCeiling"), "application/pdf")}
+    monkeypatch.setattr(main, "run_analysis", lambda fn, *args: over("memory"))
+    memory = client.post("/analyze", files=files)
+    assert memory.status_code == 422 and "memoria" in memory.json()["detail"]
+    monkeypatch.setattr(main, "run_analysis", lambda fn, *args: over("time"))
+    assert client.post("/analyze", files=files).status_code == 504
+
+def test_analyze_batch_endpoint_streams_ndjson():
+    """Test that /analyze-batch streams one line per CV and isolates bad files."""
+    import io
+    import json
+    import zipfile
+    from fastapi.testclient import TestClient
+    import main
+    
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("cvs/one.pdf", _make_pdf(SAMPLE_CV_TEXT))
+        zf.writestr("cvs/readme.txt", "ignored")
+    files = [
+        ("files", ("direct.pdf", _make_pdf(SAMPLE_CV_TEXT), "application/pdf")),
+        ("files", ("broken.pdf", b"not a pdf", "application/pdf")),
+        ("files", ("batch.zip", archive.getvalue(), "application/zip")),
+    ]
+    client = TestClient(main.app)
+    try:
+        response = client.post("/analyze-batch", files=files)
+    finally:
+        main.shutdown_analysis_executor()
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    by_name = {line["filename"]: line for line in lines if "filename" in line}
+    assert by_name["direct.pdf"]["ok"] and by_name["cvs/one.pdf"]["ok"]
+    assert not by_name["broken.pdf"]["ok"]
+    assert lines[-1] == {"done": True, "total": 3, "failed": 1}
+
+def test_analyze_batch_bounds_in_flight():
+    """Test that no more than max_in_flight PDFs are loaded before results are consumed."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from batch_analyzer import analyze_batch
+    
+    pdf_bytes = _make_pdf(SAMPLE_CV_TEXT)
+    loaded = []
+    
+    def item(i):
+        async def load():
+            loaded.append(i)
+            return pdf_bytes
+        return (f"cv{i}.pdf", load)
+    
+    async def run():
+        stream = analyze_batch((item(i) for i in range(10)), executor=ThreadPoolExecutor(2), max_in_flight=3)
+        first = await stream.__anext__()
+        assert first["ok"]
+        assert len(loaded) <= 3
+        return [first] + [entry async for entry in stream]
+    
+    entries = asyncio.run(run())
+    assert entries[-1]["total"] == 10 and entries[-1]["failed"] == 0
+
+def test_bulk_generation_streams_zip_with_manifest():
+    """Test that bulk generation bounds in-flight renders and lists failures in the manifest."""
+    import asyncio
+    import io
+    import json
+    import zipfile
+    from bulk_generator import generate_bulk, ndjson_records
+    
+    started = []
+    
+    async def render(data):
+        started.append(data["fullName"])
+        await asyncio.sleep(0)
+        if data["fullName"] == "Broken":
+            raise ValueError("render failed")
+        return b"%PDF-" + data["fullName"].encode()
+    
+    lines = [json.dumps({"fullName": f"User {i}"}) for i in range(8)]
+    lines[3] = json.dumps({"fullName": "Broken"})
+    lines.insert(5, "{not json")
+    
+    async def run():
+        stream = generate_bulk(ndjson_records(lines), render, lambda d: f"cv_{d['fullName']}.pdf", max_in_flight=2)
+        first = await stream.__anext__()
+        assert first and len(started) <= 2
+        return first + b"".join([chunk async for chunk in stream])
+    
+    with zipfile.ZipFile(io.BytesIO(asyncio.run(run()))) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        assert zf.read("0001_cv_User 0.pdf") == b"%PDF-User 0"
+        assert len(zf.namelist()) == 8
+    assert manifest["total"] == 9 and manifest["generated"] == 7 and manifest["failed"] == 2
+    assert [e["index"] for e in manifest["errors"]] == [3, 5]
+    assert manifest["errors"][0] == {"index": 3, "name": "Broken", "error": "render failed"}
+
+def test_generate_bulk_endpoint_accepts_csv(monkeypatch):
+    """Test /generate-bulk with a CSV upload rendered by the PyMuPDF backend, and its tier check."""
+    import io
+    import json
+    import zipfile
+    from fastapi.testclient import TestClient
+    import admission
+    import main
+    
+    monkeypatch.setattr(main.render_pool, "workers", 0)
+    experience = json.dumps([{"company": "Tech Corp", "position": "Dev", "startDate": "2020", "endDate": "2024"}])
+    rows = ["fullName,title,skills,experience",
+            f'Ana Gómez,Developer,Python,"{experience.replace(chr(34), chr(34) * 2)}"',
+            "Luis Pérez,Designer,Figma,",
+            'Bad Row,Dev,Go,"not json"']
+    csv_bytes = "\n".join(rows).encode("utf-8")
+    monkeypatch.setattr(admission, "GATEWAY_TOKEN", "gw-secret")
+    client = TestClient(main.app)
+    
+    forged = client.post("/generate-bulk", json=[{"fullName": "A"}], headers={"X-User-Tier": "business"})
+    assert forged.status_code == 403
+    denied = client.post("/generate-bulk", json=[{"fullName": "A"}],
+                         headers={"X-User-Tier": "pro", "X-Gateway-Token": "gw-secret"})
+    assert denied.status_code == 403
+    
+    response = client.post("/generate-bulk", headers={"X-User-Tier": "business", "X-Gateway-Token": "gw-secret"},
+                           data={"template": "classic", "backend": "mupdf"},
+                           files={"file": ("people.csv", csv_bytes, "text/csv")})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        manifest = json.loads(zf.read("manifest.json"))
+        pdfs = [name for name in zf.namelist() if name.endswith(".pdf")]
+        assert all(zf.read(name).startswith(b"%PDF") for name in pdfs)
+    assert manifest["backend"] == "mupdf" and manifest["generated"] == 2 and manifest["failed"] == 1
+    assert sorted(pdfs) == ["0001_cv_Ana_Gómez.pdf", "0002_cv_Luis_Pérez.pdf"]
+
+def test_body_limit_rejects_declared_and_chunked_bodies():
+    """Test that oversized bodies get 413, whether declared by Content-Length or sent chunked."""
+    from fastapi import FastAPI, Request
+    from fastapi.testclient import TestClient
+    from body_limits import BodyLimitMiddleware
+    
+    app = FastAPI()
+    
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"received": len(await request.body())}
+    
+    @app.post("/form")
+    async def form(request: Request):
+        return {"fields": len(await request.form())}
+    
+    app.add_middleware(BodyLimitMiddleware, limits={"/upload": 1000, "/form": 1000})
+    client = TestClient(app)
+    
+    def chunks(count):
+        for _ in range(count):
+            yield b"x" * 100
+    
+    assert client.post("/upload", content=b"x" * 500).json() == {"received": 500}
+    assert client.post("/upload", content=chunks(5)).json() == {"received": 500}
+    assert client.post("/upload", content=b"x" * 2000).status_code == 413
+    assert client.post("/upload", content=chunks(50)).status_code == 413
+    big = client.post("/form", files={"file": ("a.bin", b"x" * 5000)})
+    assert big.status_code == 413 and "límite" in big.json()["detail"]
+
+def test_upload_routes_enforce_body_limits(monkeypatch):
+    """Test that every upload route counts body bytes, so chunked uploads are cut off too."""
+    from fastapi.testclient import TestClient
+    import main
+    
+    monkeypatch.setitem(main.UPLOAD_LIMITS, "/analyze", 4096)
+    monkeypatch.setitem(main.UPLOAD_LIMITS, "/analyze-batch", 4096)
+    client = TestClient(main.app)
+    
+    def multipart(size):
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="cv.pdf"\r\n'
+        yield b"Content-Type: application/pdf\r\n\r\n%PDF-"
+        for _ in range(size // 1024):
+            yield b"x" * 1024
+        yield b"\r\n--b--\r\n"
+    chunked = client.post("/analyze", content=multipart(64 * 1024),
+                          headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert chunked.status_code == 413
+    batch = client.post("/analyze-batch", files=[("files", ("a.pdf", b"%PDF-" + b"x" * 8192, "application/pdf"))])
+    assert batch.status_code == 413 and "límite" in batch.json()["detail"]
+
+def test_analysis_cache_ttl_and_budget():
+    """Test LRU eviction by entry count and expiry by TTL."""
+    from analysis_cache import AnalysisCache
+    
+    cache = AnalysisCache(max_entries=2, max_bytes=1024, ttl=60)
+    cache.put("a", {"score": 1})
+    cache.put("b", {"score": 2})
+    cache.get("a")
+    cache.put("c", {"score": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"score": 1}
+    assert cache.stats()["evictions"] == 1
+    
+    expired = AnalysisCache(ttl=-1)
+    expired.put("a", {"score": 1})
+    assert expired.get("a") is None
+
+def test_analyze_endpoint_reports_cache_hits():
+    """Test that re-uploading the same PDF is served from the analysis cache."""
+    from fastapi.testclient import TestClient
+    import main
+    
+    main.analysis_cache.clear()
+    client = TestClient(main.app)
+    pdf_bytes = _make_pdf(SAMPLE_CV_TEXT + "\nCache")
+    first = client.post("/analyze", files={"file": ("cv.pdf", pdf_bytes, "application/pdf")})
+    second = client.post("/analyze", files={"file": ("other-name.pdf", pdf_bytes, "application/pdf")})
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert first.json() == second.json()
+
+class _CountingBackend:
+    """Model backend that records prompts and answers with fixed JSON."""
+    
+    def __init__(self, answer='{"score": 88, "summary": "ok"}', failures=0, delay=0.0):
+        self.answer = answer
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+    
+    def generate(self, prompt):
+        import time
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise ConnectionError("transient")
+        return self.answer
+
+def test_analyze_with_ai_is_cached(monkeypatch):
+    """Test that the AI path calls the model once per distinct PDF."""
+    from fastapi.testclient import TestClient
+    from ai_service import AIService
+    import main
+    
+    backend = _CountingBackend()
+    service = AIService(backend=backend)
+    monkeypatch.setattr(main, "get_ai_service", lambda: service)
+    main.ai_cache.clear()
+    
+    client = TestClient(main.app)
+    pdf_bytes = _make_pdf(SAMPLE_CV_TEXT + "\nAI")
+    first = client.post("/analyze-with-ai", files={"file": ("cv.pdf", pdf_bytes, "application/pdf")})
+    second = client.post("/analyze-with-ai", files={"file": ("cv.pdf", pdf_bytes, "application/pdf")})
+    assert first.json() == second.json() == {"score": 88, "summary": "ok", "truncated": False}
+    assert second.headers["x-cache"] == "HIT"
+    assert backend.calls == 1
+
+def test_ai_service_retries_transient_errors():
+    """Test that transient backend errors are retried with backoff."""
+    import asyncio
+    from ai_service import AIService
+    
+    backend = _CountingBackend(failures=2)
+    service = AIService(backend=backend, retries=2, backoff=0)
+    assert asyncio.run(service.analyze_cv_async("cv")) == '{"score": 88, "summary": "ok"}'
+    assert backend.calls == 3
+
+def test_ai_service_timeout_and_capacity():
+    """Test that slow calls time out and excess callers are rejected fast."""
+    import asyncio
+    import metrics
+    from ai_service import AIBusy, AIService, AITimeout
+    
+    rejected = metrics.AI_REQUESTS.value(outcome="rejected")
+    # A timed-out call is not retried: it still holds its executor thread
+    slow_backend = _CountingBackend(delay=0.3)
+    slow = AIService(backend=slow_backend, timeout=0.05, retries=2, backoff=0)
+    with pytest.raises(AITimeout):
+        asyncio.run(slow.analyze_cv_async("cv"))
+    assert slow_backend.calls == 1
+    
+    service = AIService(backend=_CountingBackend(delay=0.2), max_concurrency=1, max_queue=0)
+    async def two_calls():
+        return await asyncio.gather(service.analyze_cv_async("a"), service.analyze_cv_async("b"),
+                                    return_exceptions=True)
+    first, second = asyncio.run(two_calls())
+    assert first == '{"score": 88, "summary": "ok"}'
+    assert isinstance(second, AIBusy)
+    assert service.stats()["rejected"] == 1
+    assert metrics.AI_REQUESTS.value(outcome="rejected") == rejected + 1
+    assert metrics.AI_SLOTS.value(state="in_flight") == 0
+    assert metrics.AI_SLOTS.value(state="waiting") == 0
+
+def test_ai_service_holds_slot_until_timed_out_call_returns():
+    """Test that a call abandoned on timeout keeps its slot until its thread finishes."""
+    import asyncio
+    import metrics
+    from ai_service import AIBusy, AIService, AITimeout
+    
+    service = AIService(backend=_CountingBackend(delay=0.3), timeout=0.05, retries=0,
+                        max_concurrency=1, max_queue=0)
+    async def scenario():
+        with pytest.raises(AITimeout):
+            await service.analyze_cv_async("a")
+        with pytest.raises(AIBusy):
+            await service.analyze_cv_async("b")
+        assert service.stats()["in_flight"] == 1
+        assert metrics.AI_SLOTS.value(state="in_flight") == 1
+        await asyncio.sleep(0.4)
+        assert service.stats()["in_flight"] == 0
+    asyncio.run(scenario())
+    assert service.stats()["abandoned"] == 1
+
+def test_ai_service_coalesces_identical_requests():
+    """Test that concurrent analyses of the same CV text share one model call."""
+    import asyncio
+    import metrics
+    from ai_service import AIService
+    
+    coalesced = metrics.AI_REQUESTS.value(outcome="coalesced")
+    backend = _CountingBackend(delay=0.1)
+    service = AIService(backend=backend)
+    async def burst():
+        return await asyncio.gather(
+            service.analyze_cv_async("Ana Pérez\nPython"),
+            service.analyze_cv_async("Ana  Pérez Python "),
+            service.analyze_cv_async("Ana Pérez\nPython"),
+            service.analyze_cv_async("Otra persona"),
+        )
+    results = asyncio.run(burst())
+    assert len(set(results)) == 1
+    assert backend.calls == 2
+    assert service.stats()["coalesced"] == 2
+    assert service.stats()["coalesce_waiting"] == 0
+    assert metrics.AI_REQUESTS.value(outcome="coalesced") == coalesced + 2
+
+def test_analyze_with_ai_degrades_when_busy(monkeypatch):
+    """Test that a saturated AI service falls back to the local ATS score."""
+    from fastapi.testclient import TestClient
+    from ai_service import AIBusy, AIService
+    import main
+    
+    class BusyService(AIService):
+        async def analyze_cv_async(self, text):
+            raise AIBusy("AI service at capacity")
+    monkeypatch.setattr(main, "get_ai_service", lambda: BusyService(backend=_CountingBackend()))
+    main.ai_cache.clear()
+    
+    client = TestClient(main.app)
+    pdf_bytes = _make_pdf(SAMPLE_CV_TEXT + "\nBusy")
+    response = client.post("/analyze-with-ai", files={"file": ("cv.pdf", pdf_bytes, "application/pdf")})
+    local = client.post("/analyze", files={"file": ("cv.pdf", pdf_bytes, "application/pdf")}).json()
+    assert response.status_code == 200
+    assert response.headers["x-ai-degraded"] == "1"
+    assert response.json()["degraded"] is True
+    assert response.json()["score"] == local["score"]
+
+def test_metrics_endpoint_reports_stages():
+    """Test that /metrics exposes per-stage histograms and requests carry an ID."""
+    from fastapi.testclient import TestClient
+    import main
+
+    main.analysis_cache.clear()
+    client = TestClient(main.app)
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT + "\nMetrics"), "application/pdf")}
+    response = client.post("/analyze", files=files, headers={"X-Request-ID": "abc123"})
+    assert response.headers["x-request-id"] == "abc123"
+    assert client.get("/health").headers["x-request-id"]
+
+    body = client.get("/metrics").text
+    for stage in ("upload_read", "fitz_open", "text_extract", "metrics", "scoring"):
+        assert f'cvos_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'cvos_request_seconds_count{route="/analyze",method="POST",status="200"}' in body
+    assert 'cvos_bytes_total{kind="upload"}' in body
+    assert 'cvos_cache{cache="analysis",stat="misses"}' in body
+
+def test_profiled_request_is_stored_for_admins(monkeypatch):
+    """Test that an admin can profile a request and download the profile."""
+    import marshal
+    from fastapi.testclient import TestClient
+    import main
+    import profiler
+
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", "secret")
+    client = TestClient(main.app)
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT), "application/pdf")}
+    client.post("/analyze", files=files)  # cached now; profiling must bypass the cache
+    response = client.post("/analyze", files=files, headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    assert "x-profile-id" not in client.post("/analyze", files=files, headers={"X-Profile": "1"}).headers
+
+    admin = {"X-Admin-Token": "secret"}
+    assert client.get("/debug/profiles").status_code == 403
+    listed = client.get("/debug/profiles", headers=admin).json()["profiles"]
+    assert listed[0]["id"] == int(profile_id) and listed[0]["kind"] == "analyze"
+    assert "(read_document)" in client.get(f"/debug/profiles/{profile_id}?format=text", headers=admin).text
+    assert client.get(f"/debug/profiles/{profile_id}?format=text&sort=time", headers=admin).status_code == 200
+    assert client.get(f"/debug/profiles/{profile_id}?format=text&sort=bogus", headers=admin).status_code == 400
+    assert marshal.loads(client.get(f"/debug/profiles/{profile_id}", headers=admin).content)
+
+def test_readiness_waits_for_warmup(monkeypatch):
+    """Test that /health answers at once and /ready flips after the warm-up."""
+    import time
+    from fastapi.testclient import TestClient
+    import main
+    from warmup import WarmupState
+
+    monkeypatch.setattr(main.render_pool, "workers", 0)
+    monkeypatch.setattr(main, "warmup_state", WarmupState())
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        deadline = time.monotonic() + 60
+        while (response := client.get("/ready")).status_code == 503 and time.monotonic() < deadline:
+            assert response.json()["status"] == "warming_up"
+            time.sleep(0.05)
+        report = response.json()
+    assert response.status_code == 200 and report["ready"]
+    assert "fitz" in report["imports"] and "weasyprint" in report["imports"]
+    assert set(report["steps"]) == {"keyword_index", "render", "analysis_pool", "ai_service", "job_index"}
+    assert report["warmup_seconds"] is not None
+
+def test_warmup_is_not_ready_when_a_required_step_fails():
+    """Test that a failed required step keeps the instance unready and an optional one doesn't."""
+    import asyncio
+    from warmup import WarmupState, run_warmup, start_warmup
+    
+    def broken():
+        raise RuntimeError("no renderer")
+    
+    state = WarmupState()
+    run_warmup(state, {"render": broken, "extra": lambda: 1}, modules=(), required=("render",))
+    assert not state.ready
+    assert state.report()["failed_steps"] == ["render"] and state.report()["finished"]
+    
+    optional = WarmupState()
+    run_warmup(optional, {"render": lambda: 1, "ai_service": broken}, modules=(), required=("render",))
+    assert optional.ready and optional.steps["ai_service"]["ok"] is False
+    
+    async def background():
+        started = WarmupState()
+        task = start_warmup(started, {"render": lambda: 1}, modules=(), required=("render",))
+        assert started.task is task
+        await task
+        return started.ready
+    assert asyncio.run(background())
+
+def test_pdf_job_queue_priority_caps_and_expiry():
+    """Test that paid tiers jump the queue, per-tier caps hold and finished jobs expire."""
+    import asyncio
+    from pdf_jobs import DONE, JobQueueFull, PDFJobQueue
+    
+    async def scenario():
+        order = []
+        release = asyncio.Event()
+        
+        async def render(data, template):
+            order.append(data["fullName"])
+            await release.wait()
+            return b"%PDF-" + data["fullName"].encode()
+        
+        queue = PDFJobQueue(render, workers=1, concurrency={"business": 1, "pro": 1, "free": 1},
+                            queue_limits={"business": 5, "pro": 5, "free": 2}, ttl=60)
+        first = queue.submit({"fullName": "free-1"}, "classic", "free")
+        queue.submit({"fullName": "free-2"}, "classic", "free")
+        queue.submit({"fullName": "free-3"}, "classic", "free")
+        with pytest.raises(JobQueueFull) as exc:
+            queue.submit({"fullName": "free-4"}, "classic", "free")
+        assert exc.value.retry_after >= 1
+        business = queue.submit({"fullName": "biz"}, "executive", "business")
+        
+        await asyncio.sleep(0)
+        release.set()
+        while queue.stats()["jobs"] and not all(j.finished for j in queue._jobs.values()):
+            await asyncio.sleep(0.01)
+        assert order == ["free-1", "biz", "free-2", "free-3"]
+        assert business.status == DONE and business.pdf_bytes == b"%PDF-biz"
+        
+        queue.ttl = -1
+        assert queue.get(first.id) is None
+        assert queue.stats()["retained"] == 0 and queue.stats()["retained_bytes"] == 0
+    
+    asyncio.run(scenario())
+
+def test_pdf_job_queue_caps_retained_results():
+    """Test that finished jobs are dropped oldest first past the count and byte caps, and swept when idle."""
+    import asyncio
+    from pdf_jobs import PDFJobQueue
+    
+    async def scenario():
+        async def render(data, template):
+            return b"x" * data["size"]
+        
+        queue = PDFJobQueue(render, workers=1, ttl=60, max_retained=3, max_retained_bytes=215)
+        jobs = []
+        for size in (100, 10, 10, 10, 200):
+            jobs.append(queue.submit({"size": size}, "classic", "free"))
+            while not jobs[-1].finished:
+                await asyncio.sleep(0.001)
+        assert [queue.get(j.id) is not None for j in jobs] == [False, False, False, True, True]
+        assert queue.stats()["retained_bytes"] == 210 and queue.stats()["evicted"] == 3
+        
+        queue.ttl = 0
+        queue.start(interval=0.01)
+        await asyncio.sleep(0.05)
+        assert queue.stats()["jobs"] == 0
+        await queue.stop()
+    
+    asyncio.run(scenario())
+
+def test_pdf_job_endpoints(monkeypatch):
+    """Test submit, SSE status, download and 429 backpressure for PDF jobs."""
+    import asyncio
+    from fastapi.testclient import TestClient
+    from pdf_jobs import PDFJobQueue
+    import admission
+    import main
+    
+    async def render(data, template):
+        await asyncio.sleep(0.01)
+        return b"%PDF-1.4 job"
+    monkeypatch.setattr(admission, "GATEWAY_TOKEN", "gw-secret")
+    monkeypatch.setattr(main, "pdf_jobs", PDFJobQueue(render, workers=1, queue_limits={"business": 1, "pro": 1, "free": 0}))
+    monkeypatch.setattr(main.render_pool, "workers", 0)
+    
+    # One event loop for every request, so the job keeps running between them
+    with TestClient(main.app) as client:
+        _check_pdf_job_endpoints(client)
+
+def _check_pdf_job_endpoints(client):
+    # The plan comes from the gateway, not from the template or a bare X-User-Tier
+    pro = {"X-User-Tier": "pro", "X-Gateway-Token": "gw-secret"}
+    submitted = client.post("/jobs/generate-pdf", json={"fullName": "Job User", "template": "modern"}, headers=pro)
+    assert submitted.status_code == 202
+    job = submitted.json()
+    assert job["tier"] == "pro" and job["status"] in ("queued", "running")
+    
+    events = client.get(job["events_url"]).text
+    assert events.startswith("event: status") and '"status": "done"' in events
+    download = client.get(job["download_url"])
+    assert download.content == b"%PDF-1.4 job" and download.headers["etag"]
+    assert client.get(job["status_url"]).json()["size"] == len(b"%PDF-1.4 job")
+    
+    busy = client.post("/jobs/generate-pdf", json={"fullName": "Free User", "template": "executive"},
+                       headers={"X-User-Tier": "business"})
+    assert busy.status_code == 429 and int(busy.headers["retry-after"]) >= 1
+    assert client.get("/jobs/unknown").status_code == 404
+
+def test_job_index_ranks_postings_and_lists_gaps(monkeypatch):
+    """Test that the job index ranks postings for a CV and reports missing skills and terms."""
+    from job_matcher import JobIndex, tokenize
+    
+    assert tokenize("Dev Sr. en C++, C# y Node.js (2020).") == ["dev", "sr", "c++", "c#", "node.js"]
+    index = JobIndex()
+    index.add([
+        {"id": "backend", "title": "Backend Python", "description": "Python, Django, PostgreSQL y Docker.", "company": "A"},
+        {"id": "frontend", "title": "Frontend", "description": "React, TypeScript y Figma."},
+    ])
+    index.add([{"id": "data", "description": "Python, SQL, pandas y machine learning."}])
+    with pytest.raises(ValueError):
+        index.add([{"id": "data", "description": "duplicada"}])
+    
+    matches = index.match("Desarrolladora Python con Django y Docker. SQL.", top_k=2)
+    assert [m["id"] for m in matches] == ["backend", "data"]
+    best = matches[0]
+    assert best["company"] == "A" and "description" not in best
+    assert best["missing_skills"] == [] and "postgresql" in best["missing_keywords"]
+    assert "Machine Learning" in matches[1]["missing_skills"]
+    assert 0 < matches[1]["score"] < best["score"] <= 100
+    assert index.match("Chef de cocina", min_score=1) == []
+    
+    # The keyword pass over the CV runs without the index lock
+    find = index._keywords.find
+    held = []
+    monkeypatch.setattr(index._keywords, "find", lambda text: (held.append(index._lock.locked()), find(text))[1])
+    assert index.match("Python y Docker", top_k=1)[0]["id"] == "backend"
+    assert held == [False]
+
+def test_match_endpoint(monkeypatch):
+    """Test that /postings feeds /match and that a single job_description can be scored."""
+    from fastapi.testclient import TestClient
+    from job_matcher import JobIndex
+    import main
+    import profiler
+    
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main, "get_job_index", lambda index=JobIndex(max_postings=3): index)
+    client = TestClient(main.app)
+    admin = {"X-Admin-Token": "secret"}
+    postings = [{"id": "py", "title": "Python Developer", "description": "Python y SQL"},
+                {"id": "java", "title": "Java Developer", "description": "Java y Spring"}]
+    assert client.post("/postings", json=postings).status_code == 403
+    added = client.post("/postings", json=postings, headers=admin)
+    assert added.json()["added"] == 2 and added.json()["postings"] == 2
+    assert client.post("/postings", json=[{"id": "py", "description": "x"}], headers=admin).status_code == 400
+    assert client.post("/postings", json=[{"id": "big", "description": "x", "notes": "x" * 5000}],
+                       headers=admin).status_code == 400
+    assert client.post("/postings", json=[{"id": f"j{i}", "description": "x"} for i in range(2)],
+                       headers=admin).status_code == 400
+    monkeypatch.setattr(main, "MAX_POSTINGS_PER_REQUEST", 1)
+    assert client.post("/postings", json=postings, headers=admin).status_code == 413
+    
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT), "application/pdf")}
+    ranked = client.post("/match?top_k=1", files=files).json()
+    assert ranked["postings_searched"] == 2 and [m["id"] for m in ranked["matches"]] == ["py"]
+    single = client.post("/match", files=files, data={"job_description": "Kubernetes y Go"}).json()
+    assert single["matches"][0]["missing_skills"]
+    
+    assert client.delete("/postings").status_code == 403
+    assert client.delete("/postings", headers=admin).json()["postings"] == 0
+
+def test_admission_gate_queues_by_tier_and_sheds():
+    """Test that a gate caps concurrency per tier, admits queued business first and sheds with 429/503."""
+    import asyncio
+    from admission import Gate, Overloaded
+    
+    async def scenario():
+        gate = Gate("/generate-pdf", concurrency=2, max_queue=2, queue_timeout=0.2)
+        await gate.acquire("free")
+        with pytest.raises(Overloaded) as share:
+            await gate.acquire("free")  # free may only use half of the slots, and the queue deadline passes
+        assert share.value.status == 429 and share.value.retry_after >= 1
+        await gate.acquire("pro")
+        
+        order = []
+        async def wait(tier):
+            await gate.acquire(tier)
+            order.append(tier)
+        waiters = [asyncio.create_task(wait("pro")), asyncio.create_task(wait("business"))]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as full:
+            await gate.acquire("business")
+        assert full.value.status == 503 and full.value.reason == "queue_full"
+        gate.release()
+        gate.release()
+        await asyncio.gather(*waiters)
+        assert order == ["business", "pro"] and gate.occupancy()["running"] == 2
+        
+        # Missing or unknown tiers get the free share and wait behind paying ones
+        anonymous = Gate("/preview", concurrency=4, max_queue=0, queue_timeout=0.1)
+        assert anonymous.limit(None) == anonymous.limit("gold") == anonymous.limit("free") == 2
+        await anonymous.acquire(None)
+        await anonymous.acquire("gold")
+        with pytest.raises(Overloaded):
+            await anonymous.acquire(None)
+    
+    asyncio.run(scenario())
+
+def test_trusted_tier_requires_the_gateway_token(monkeypatch):
+    """Test that X-User-Tier only counts with the gateway's token, defaulting to free."""
+    import admission
+    from admission import trusted_tier
+    
+    assert trusted_tier({"x-user-tier": "business"}) == "free"
+    monkeypatch.setattr(admission, "GATEWAY_TOKEN", "gw-secret")
+    assert trusted_tier({"x-user-tier": "business"}) == "free"
+    assert trusted_tier({"x-user-tier": "business", "x-gateway-token": "wrong"}) == "free"
+    assert trusted_tier({"x-user-tier": "Business", "x-gateway-token": "gw-secret"}) == "business"
+    assert trusted_tier({"x-user-tier": "gold", "x-gateway-token": "gw-secret"}) == "free"
+    assert trusted_tier({"x-gateway-token": "gw-secret"}) == "free"
+
+def test_admission_sheds_requests_and_reports_occupancy(monkeypatch):
+    """Test that a saturated route answers 503 with Retry-After and /health shows occupancy."""
+    from fastapi.testclient import TestClient
+    from admission import Gate
+    import main
+    
+    monkeypatch.setitem(main.admission.gates, "/analyze", Gate("/analyze", concurrency=0, max_queue=0, queue_timeout=1))
+    client = TestClient(main.app)
+    files = {"file": ("cv.pdf", _make_pdf(SAMPLE_CV_TEXT), "application/pdf")}
+    shed = client.post("/analyze", files=files)
+    assert shed.status_code == 503 and int(shed.headers["retry-after"]) >= 1
+    routes = client.get("/health").json()["admission"]["routes"]
+    assert routes["/analyze"]["shed"] == 1 and routes["/generate-pdf"]["running"] == 0
+
+def test_gemini_backend_against_local_stub(monkeypatch):
+    """Test that the Gemini SDK can be pointed at the load-test stand-in."""
+    import asyncio
+    import json
+    import ai_service
+    from ai_service import AIService
+    from benchmarks import stub_gemini
+    
+    server = stub_gemini.start(latency=0, jitter=0)
+    try:
+        monkeypatch.setattr(ai_service, "GEMINI_ENDPOINT", server.url)
+        service = AIService(backend=ai_service.GeminiBackend("stub", AIService.MODEL_NAME), retries=0)
+        result = asyncio.run(service.analyze_cv_async(SAMPLE_CV_TEXT))
+        assert json.loads(result)["score"] == 75 and server.requests == 1
+    finally:
+        server.shutdown()
+
+def test_profile_store_is_a_ring_buffer():
+    """Test that the profile buffer keeps only the newest entries."""
+    from profiler import ProfileStore, capture_profile, profile_call
+
+    store = ProfileStore(size=2)
+    ids = [store.add("analyze", "cv.pdf", "-", profile_call(sum, [i])[1]) for i in range(3)]
+    assert [p["id"] for p in store.list()] == ids[:0:-1]
+    assert store.get(ids[0]) is None
+    
+    # A block that raised still leaves a complete profile to store
+    with pytest.raises(ZeroDivisionError):
+        with capture_profile() as captured:
+            1 / 0
+    failed = store.add("render", "classic/mupdf", "-", captured)
+    assert store.get(failed).summary()["size"] > 0 and store.list()[0]["id"] == failed
+
 def test_ats_analyzer():
     """Test ATS analyzer imports."""
     from ats_checker import ATSAnalyzer
-    analyzer = ATSAnalyzer()
+    analyzer = ATSAnalyzer(_make_pdf(SAMPLE_CV_TEXT))
     assert analyzer is not None
 
 if __name__ == "__main__":
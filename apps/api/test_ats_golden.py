@@ -0,0 +1,63 @@
+"""
+Golden-output tests for ATSAnalyzer scoring.
+golden/ats_corpus.json was recorded with the line-by-line analyzer that
+predates scan_text(); any drift in score, metrics or feedback fails here.
+Expectations were re-recorded once when section detection moved to whole-word
+matching (keyword_matcher.py): only substring false hits such as
+"inexperienced" changed.
+The "truncated" field was added to every expectation when page and
+character limits were introduced for extraction; from_text() never truncates.
+Run with: python -m pytest test_ats_golden.py -v
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "ats_corpus.json")
+
+with open(CORPUS_PATH, encoding="utf-8") as f:
+    CORPUS = json.load(f)
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=[c["name"] for c in CORPUS])
+def test_analyze_matches_golden(case):
+    """Test that analyze() output is identical to the recorded result."""
+    from ats_checker import ATSAnalyzer
+
+    result = ATSAnalyzer.from_text(case["text"], page_count=case["page_count"]).analyze()
+    assert result == case["expected"]
+
+
+
+def test_keyword_automaton_word_boundaries_and_accents():
+    """Test whole-word, case- and accent-insensitive matching."""
+    from keyword_matcher import KeywordAutomaton
+
+    automaton = KeywordAutomaton([("experiencia", "exp"), ("educación", "edu"), ("c++", "cpp"), ("sobre mí", "about")])
+    assert automaton.match("EXPERIENCIA laboral") == {"exp"}
+    assert automaton.match("Inexperiencia total") == set()
+    assert automaton.match("Educacion y C++, sobre   MI") == {"edu", "cpp", "about"}
+
+
+def test_keyword_automaton_overlapping_terms():
+    """Test that terms sharing prefixes and suffixes are all reported."""
+    from keyword_matcher import KeywordAutomaton
+
+    automaton = KeywordAutomaton([("he", 1), ("she", 2), ("his", 3), ("hers", 4), ("she sells", 5)])
+    assert automaton.match("ushers") == set()
+    assert automaton.match("she sells hers") == {2, 4, 5}
+
+
+def test_keyword_index_built_once():
+    """Test that the keyword index is shared across analyzers."""
+    from ats_checker import ATSAnalyzer
+    from keyword_matcher import get_keyword_index
+
+    assert get_keyword_index() is get_keyword_index()
+    result = ATSAnalyzer.from_text("Skills\nPython, Docker y Kubernetes").analyze()
+    assert result["sections_found"] == ["Habilidades/Skills"]
+    assert result["skills_found"] == ["Python", "Docker", "Kubernetes"]
@@ -0,0 +1,104 @@
+"""
+Startup warm-up for cvOS
+Heavy modules (PyMuPDF, WeasyPrint, google-generativeai) are imported lazily
+where they are used. After the app starts accepting connections, a warm-up
+task imports them, primes the keyword index and the render path (render pool
+workers, or in-process templates and fonts) and then flips readiness, unless
+one of the required steps failed.
+
+/health is liveness (the process is up); /ready is readiness (warm-up done).
+"""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("warmup")
+
+# Modules whose first import is slow enough to measure
+HEAVY_MODULES = ("fitz", "weasyprint", "google.generativeai")
+
+
+class WarmupState:
+    """What the warm-up did and how long it took; served by /ready and /debug."""
+
+    def __init__(self):
+        self.ready = False
+        # The background warm-up task; kept so it isn't garbage-collected mid-run
+        self.task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.app_import_seconds: Optional[float] = None
+        self.imports: Dict[str, float] = {}
+        self.steps: Dict[str, object] = {}
+        self.errors: List[str] = []
+        self.failed: List[str] = []
+
+    def timed_import(self, module: str):
+        """Import a module and record how long it took (0 when it was already loaded)."""
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except (ImportError, OSError) as e:
+            # OSError: WeasyPrint without its system libraries (pango)
+            self.errors.append(f"import {module}: {str(e).splitlines()[0]}")
+        finally:
+            self.imports[module] = round(time.perf_counter() - start, 4)
+
+    def step(self, name: str, fn: Callable[[], object]) -> bool:
+        """Run one warm-up step; a failure is recorded but doesn't stop the others. True on success."""
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            logger.error(f"Warm-up step '{name}' failed: {e}")
+            self.errors.append(f"{name}: {e}")
+            self.failed.append(name)
+            self.steps[name] = {"seconds": round(time.perf_counter() - start, 4), "result": None, "ok": False}
+            return False
+        self.steps[name] = {"seconds": round(time.perf_counter() - start, 4), "result": result, "ok": True}
+        return True
+
+    def report(self) -> dict:
+        total = None
+        if self.started_at is not None and self.finished_at is not None:
+            total = round(self.finished_at - self.started_at, 4)
+        return {
+            "ready": self.ready,
+            "finished": self.finished_at is not None,
+            "app_import_seconds": self.app_import_seconds,
+            "warmup_seconds": total,
+            "imports": self.imports,
+            "steps": self.steps,
+            "errors": self.errors,
+            "failed_steps": self.failed,
+        }
+
+
+def run_warmup(state: WarmupState, steps: Dict[str, Callable[[], object]],
+               modules=HEAVY_MODULES, required: Iterable[str] = ()):
+    """
+    Blocking warm-up; run it off the event loop. The instance becomes ready
+    only if every step named in `required` succeeded; a failed optional step
+    is reported, and the endpoints that don't need it still work.
+    """
+    state.started_at = time.perf_counter()
+    for module in modules:
+        state.timed_import(module)
+    for name, fn in steps.items():
+        state.step(name, fn)
+    state.finished_at = time.perf_counter()
+    missing = [name for name in required if name in state.failed or name not in state.steps]
+    state.ready = not missing
+    if missing:
+        logger.error(f"Warm-up failed, not ready: required step(s) {', '.join(missing)} did not succeed")
+    logger.info(f"Warm-up finished in {state.finished_at - state.started_at:.2f}s, "
+                f"{len(state.errors)} error(s)")
+
+
+def start_warmup(state: WarmupState, steps: Dict[str, Callable[[], object]],
+                 modules=HEAVY_MODULES, required: Iterable[str] = ()) -> asyncio.Task:
+    """Start the warm-up in the background so liveness answers while it runs."""
+    state.task = asyncio.create_task(asyncio.to_thread(run_warmup, state, steps, modules, tuple(required)))
+    return state.task
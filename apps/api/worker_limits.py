@@ -0,0 +1,206 @@
+"""
+Worker memory budgets for cvOS
+WeasyPrint, PyMuPDF and the ATS analyzer grow a long-lived process's RSS over
+thousands of jobs. Worker processes report their pid, job count and RSS with
+every result; the pool that owns them (RenderPool, the batch analysis pool)
+replaces its workers once one passes CVOS_WORKER_MAX_JOBS or
+CVOS_WORKER_MAX_RSS_MB. New jobs go to the fresh workers while the old ones
+finish what they already took, then exit.
+
+Each job also runs under a ceiling (CVOS_JOB_MAX_SECONDS, and
+CVOS_JOB_MAX_MEMORY_MB of RSS growth): a timer checks both while the job runs
+and raises CeilingExceeded inside it, failing that request. The exception can
+land anywhere, leaving a module cache or lock half-updated, so a ceiling hit
+also recycles the pool: its workers are never trusted with another job.
+"""
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger("worker_limits")
+
+MB = 1024 * 1024
+
+# 0 disables any of these
+WORKER_MAX_JOBS = int(os.getenv("CVOS_WORKER_MAX_JOBS", "2000"))
+WORKER_MAX_RSS_MB = float(os.getenv("CVOS_WORKER_MAX_RSS_MB", "1024"))
+JOB_MAX_SECONDS = float(os.getenv("CVOS_JOB_MAX_SECONDS", "60"))
+JOB_MAX_MEMORY_MB = float(os.getenv("CVOS_JOB_MAX_MEMORY_MB", "512"))
+# How often a running job is checked against its ceiling
+CHECK_INTERVAL = 0.05
+
+# Jobs run by this process (meaningful in worker processes)
+_jobs_done = 0
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (the peak where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def usage() -> dict:
+    """What a worker reports with each result."""
+    return {"pid": os.getpid(), "jobs": _jobs_done, "rss": rss_bytes()}
+
+
+class CeilingExceeded(RuntimeError):
+    """A job ran past its time or memory ceiling; `usage` is the worker's state afterwards."""
+
+    def __init__(self, kind: str, limit: float, usage: Optional[dict] = None):
+        if kind == "time":
+            message = f"Se superó el límite de tiempo por solicitud ({limit:g} s)"
+        else:
+            message = (f"Se superó el límite de memoria por solicitud ({limit:g} MB): "
+                       "el documento es demasiado complejo para procesarlo")
+        super().__init__(message)
+        self.kind = kind
+        self.limit = limit
+        self.usage = usage
+
+    def __reduce__(self):
+        # Raised in worker processes; keep kind and usage across pickling
+        return CeilingExceeded, (self.kind, self.limit, self.usage)
+
+
+@contextmanager
+def ceiling(max_seconds: float = JOB_MAX_SECONDS, max_memory_mb: float = JOB_MAX_MEMORY_MB) -> Iterator[None]:
+    """
+    Raise CeilingExceeded inside the block once it has run max_seconds or grown
+    RSS by max_memory_mb. Uses SIGALRM, so it only applies in a process's main
+    thread (worker processes); elsewhere the block runs unbounded. Checks land
+    between Python bytecodes, so a long C call is interrupted once it returns.
+    """
+    if (not (max_seconds or max_memory_mb) or not hasattr(signal, "setitimer")
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    memory_limit = rss_bytes() + max_memory_mb * MB if max_memory_mb else None
+    active = True
+
+    def check(signum, frame):
+        if not active:
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            raise CeilingExceeded("time", max_seconds)
+        if memory_limit is not None and rss_bytes() > memory_limit:
+            raise CeilingExceeded("memory", max_memory_mb)
+
+    previous = signal.signal(signal.SIGALRM, check)
+    signal.setitimer(signal.ITIMER_REAL, CHECK_INTERVAL, CHECK_INTERVAL)
+    try:
+        yield
+    finally:
+        active = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def run_job(fn, *args) -> Tuple[object, dict]:
+    """Run one job in a worker under the ceiling; returns (result, usage)."""
+    global _jobs_done
+    try:
+        with ceiling():
+            result = fn(*args)
+    except CeilingExceeded as e:
+        _jobs_done += 1
+        e.usage = usage()
+        logger.warning(f"Job over its {e.kind} ceiling in worker {os.getpid()}")
+        raise
+    except BaseException:
+        _jobs_done += 1
+        raise
+    _jobs_done += 1
+    return result, usage()
+
+
+class WorkerBudget:
+    """
+    Parent-side accounting for one pool: the last usage each worker reported
+    and whether the pool is due for recycling.
+    """
+
+    def __init__(self, pool: str, max_jobs: int = WORKER_MAX_JOBS, max_rss_mb: float = WORKER_MAX_RSS_MB):
+        self.pool = pool
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._workers: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self.recycles = 0
+        self.ceiling_hits = 0
+
+    def observe(self, future: Future, current: bool = True) -> Optional[str]:
+        """
+        Account a finished job whose result ends with the worker's usage.
+        current=False is for jobs of workers already being replaced.
+
+        Returns:
+            Why the pool should be recycled ("ceiling", "jobs" or "rss"), or None
+        """
+        if future.cancelled():
+            return None
+        error = future.exception()
+        hit = isinstance(error, CeilingExceeded)
+        if hit:
+            self.ceiling_hits += 1
+            metrics.CEILING_HITS.inc(pool=self.pool, kind=error.kind)
+            report = error.usage
+        elif error is None:
+            report = future.result()[-1]
+        else:
+            return None
+        if not current:
+            return None
+        if report:
+            with self._lock:
+                self._workers[report["pid"]] = report
+                largest = max(w["rss"] for w in self._workers.values())
+            metrics.WORKER_RSS.set(largest, pool=self.pool)
+        if hit:
+            # The interrupted job may have left the worker's state inconsistent
+            return "ceiling"
+        if not report:
+            return None
+        if self.max_jobs and report["jobs"] >= self.max_jobs:
+            return "jobs"
+        if self.max_rss_mb and report["rss"] >= self.max_rss_mb * MB:
+            return "rss"
+        return None
+
+    def recycled(self, reason: str):
+        """The pool replaced its workers: forget the old ones."""
+        with self._lock:
+            self._workers.clear()
+        self.recycles += 1
+        metrics.WORKER_RECYCLES.inc(pool=self.pool, reason=reason)
+        logger.info(f"Recycling {self.pool} workers ({reason})")
+
+    def stats(self) -> dict:
+        with self._lock:
+            workers = sorted(self._workers.values(), key=lambda w: w["pid"])
+        return {
+            "max_jobs": self.max_jobs,
+            "max_rss_mb": self.max_rss_mb,
+            "recycles": self.recycles,
+            "ceiling_hits": self.ceiling_hits,
+            "workers": [{"pid": w["pid"], "jobs": w["jobs"], "rss_mb": round(w["rss"] / MB, 1)} for w in workers],
+        }